@@ -1,14 +1,25 @@
 from __future__ import unicode_literals
 
+from concurrent.futures import ThreadPoolExecutor
 import enum
 import json
 import logging
 from operator import attrgetter
+import os
+import time
+from urllib.parse import urlparse
 
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 import requests
+from requests.adapters import HTTPAdapter
+
+from mediasite_provisioning.cache import TieredCache, get_redis_client
+from mediasite_provisioning.decoder import Decoder
+from mediasite_provisioning.metrics import record_call
+from mediasite_provisioning.ratelimit import RateLimiter, send_request
 
 from .apimodels import (
     Account,
@@ -32,6 +43,17 @@ from .serializer import (
 
 logger = logging.getLogger(__name__)
 
+# Canvas payloads are decoded with these rather than by running the serializers on every record;
+# see mediasite_provisioning.decoder
+account_decoder = Decoder(AccountSerializer, Account)
+course_decoder = Decoder(CourseSerializer, Course)
+enrollment_decoder = Decoder(EnrollmentSerializer, Enrollment)
+external_tool_decoder = Decoder(ExternalToolSerializer, ExternalTool)
+link_decoder = Decoder(LinkSerializer, Link)
+module_decoder = Decoder(ModuleSerializer, Module)
+module_item_decoder = Decoder(ModuleItemSerializer, ModuleItem)
+user_decoder = Decoder(UserSerializer, User)
+
 
 class CanvasServiceException(Exception):
     _canvas_exception = None
@@ -67,99 +89,227 @@ class CanvasAPI:
     def __init__(self, user):
         self._user = user
 
+    ######################################################
+    # API Session
+    ######################################################
+    _api_session = None
+    _api_session_pid = None
+
+    @staticmethod
+    def get_api_session():
+        """ Returns a keep-alive session shared by every CanvasAPI instance in this worker process, so that
+        connections to Canvas are pooled rather than set up for every call.  The session carries no
+        credentials; the bearer token for the current user is passed with each request.  The session is
+        rebuilt after a fork so that gunicorn workers never share sockets. """
+        if CanvasAPI._api_session is None or CanvasAPI._api_session_pid != os.getpid():
+            _session = requests.Session()
+            _adapter = HTTPAdapter(pool_connections=settings.CANVAS_HTTP_POOL_SIZE,
+                                   pool_maxsize=settings.CANVAS_HTTP_POOL_SIZE)
+            _session.mount('https://', _adapter)
+            _session.mount('http://', _adapter)
+            _session.headers.update({'Content-Type': 'application/json'})
+            CanvasAPI._api_session = _session
+            CanvasAPI._api_session_pid = os.getpid()
+            logger.debug("Created a Canvas API session object!")
+        return CanvasAPI._api_session
+
+    # Canvas throttles each API token, as well as the host as a whole
+    _host_rate_limiter = RateLimiter('canvas:host', 'CANVAS_HOST_RATE_LIMIT', 'CANVAS_HOST_RATE_LIMIT_BURST')
+    _token_rate_limiter = RateLimiter('canvas:token', 'CANVAS_TOKEN_RATE_LIMIT', 'CANVAS_TOKEN_RATE_LIMIT_BURST',
+                                      adapt_to_remaining=True)
+
+    @staticmethod
+    def get_rate_limits(url, headers):
+        return [(CanvasAPI._host_rate_limiter, urlparse(url).netloc),
+                (CanvasAPI._token_rate_limiter, headers['Authorization'])]
+
+    ######################################################
+    # Caches
+    ######################################################
+    # Pages of course search results, for each user as they only hold what the user's token can
+    # see.  They are dropped when a course on them is provisioned, which usually happens in the
+    # provision_worker process, so they are only kept in the shared tier.
+    _search_cache = TieredCache('canvas:search', 'CANVAS_SEARCH_CACHE_TIMEOUT', local_tier=False)
+    # course id -> keys of the cached search pages the course is on.  With Redis these are sets, so
+    # that pages cached by different workers at the same time are all indexed; without it (e.g. in
+    # tests) they are lists in this cache.
+    _search_index = TieredCache('canvas:search_index', 'CANVAS_SEARCH_CACHE_TIMEOUT', local_tier=False)
+
+    @staticmethod
+    def get_search_index_key(course_id):
+        return cache.make_key('canvas:search_index:{0}'.format(course_id))
+
+    @staticmethod
+    def index_search_page(key, course_ids):
+        client = get_redis_client()
+        if client is not None:
+            try:
+                pipeline = client.pipeline(transaction=False)
+                for course_id in course_ids:
+                    index_key = CanvasAPI.get_search_index_key(course_id)
+                    pipeline.sadd(index_key, key)
+                    pipeline.expire(index_key, settings.CANVAS_SEARCH_CACHE_TIMEOUT)
+                pipeline.execute()
+            except Exception:
+                # the page will not be dropped when its courses are provisioned, so don't keep it
+                logger.warning("could not index the cached search page {}".format(key), exc_info=True)
+                CanvasAPI._search_cache.delete(key)
+            return
+        for course_id in course_ids:
+            index_key = str(course_id)
+            keys = CanvasAPI._search_index.get(index_key) or []
+            if key not in keys:
+                CanvasAPI._search_index.set(index_key, keys + [key])
+
+    @staticmethod
+    def invalidate_search_results(course_id):
+        """ Drops every cached search page (for every user) the course is on """
+        client = get_redis_client()
+        if client is not None:
+            try:
+                # read and drop the set in one transaction, so no page indexed meanwhile is lost
+                pipeline = client.pipeline(transaction=True)
+                index_key = CanvasAPI.get_search_index_key(course_id)
+                pipeline.smembers(index_key)
+                pipeline.delete(index_key)
+                keys = pipeline.execute()[0]
+            except Exception:
+                logger.warning("could not read the cached search pages of course {}".format(course_id),
+                               exc_info=True)
+                return
+            for key in keys:
+                CanvasAPI._search_cache.delete(key.decode('utf8') if isinstance(key, bytes) else key)
+            return
+        index_key = str(course_id)
+        for key in CanvasAPI._search_index.get(index_key) or []:
+            CanvasAPI._search_cache.delete(key)
+        CanvasAPI._search_index.delete(index_key)
+
     ##########################################################
     # Accounts
     ##########################################################
     def get_accounts_for_current_user(self):
-        response = self.get_canvas_request(partial_url='accounts?per_page=100')
-        account_list = response.json()
-        while response.links.get('next', False):
-            next_page = response.links['next']['url']
-            response = self.get_canvas_request(None, full_url=next_page)
-            account_list.extend(response.json())
-        serializer = AccountSerializer(data=account_list, many=True)
-        if serializer.is_valid(raise_exception=True):
-            return [Account(**attrs) for attrs in serializer.validated_data]
+        return list(self.get_paginated('accounts', account_decoder))
 
     ##########################################################
     # Courses
     ##########################################################
-    def get_courses_for_account(self, account_id):
-        response = self.get_canvas_request(partial_url='accounts/{0}/courses?include=term'.format(account_id))
-        serializer = CourseSerializer(data=response.json(), many=True)
-        if serializer.is_valid(raise_exception=True):
-            return [Course(**attrs) for attrs in serializer.validated_data]
+    def get_courses_for_account(self, account_id, enrollment_term_id=None):
+        """
+        Yields the courses of an account (optionally only those in one enrollment term) a page at a
+        time, following the pagination links, so large accounts can be walked in constant memory.
+        """
+        partial_url = 'accounts/{0}/courses?include=term'.format(account_id)
+        if enrollment_term_id is not None:
+            partial_url = '{0}&enrollment_term_id={1}'.format(partial_url, enrollment_term_id)
+        return self.get_paginated(partial_url, course_decoder, prefetch=True)
 
     def search_courses(self, account_id, search_term, page):
+        """
+        A page of the account's courses that match the search term, with each course's Mediasite
+        external link.  Pages are cached for settings.CANVAS_SEARCH_CACHE_TIMEOUT, so paging back and
+        forth or repeating a search does not go back to Canvas.
+        """
+        key = '{0}:{1}:{2}:{3}'.format(self._user.id, account_id, search_term, page)
+        search_page = CanvasAPI._search_cache.get(key)
+        if search_page is None:
+            search_page = self.get_search_page(account_id, search_term, page)
+            CanvasAPI._search_cache.set(key, search_page)
+            CanvasAPI.index_search_page(key, [attrs.get('id') for attrs in search_page['courses']])
+
         results = SearchResults()
         terms = list()
         years = list()
-        response = self.get_canvas_request(
-            partial_url='accounts/{0}/courses?include=term&completed=false&search_term={1}&page={2}&per_page=10'
-                .format(account_id, search_term, page))
 
         # get courses
-        serializer = CourseSerializer(data=response.json(), many=True)
-        if serializer.is_valid(raise_exception=True):
-            results.search_results = [Course(**attrs) for attrs in serializer.validated_data]
+        results.search_results = [Course(**attrs) for attrs in search_page['courses']]
 
-            for n, course in enumerate(results.search_results):
-                # get the Mediasite external link
-                course.canvas_mediasite_external_link = self.get_mediasite_app_external_link(course_id=course.id, course_term=course.term.name)
+        for n, course in enumerate(results.search_results):
+            external_link = search_page['external_links'][n]
+            course.canvas_mediasite_external_link = ExternalTool(**external_link) if external_link else None
 
-                if course.year not in years:
-                    years.append(course.year)
+            if course.year not in years:
+                years.append(course.year)
 
-                # find and add terms
-                if next((t for t in terms if t.name == course.term.name), None) is None:
-                    terms.append(course.term)
+            # find and add terms
+            if next((t for t in terms if t.name == course.term.name), None) is None:
+                terms.append(course.term)
 
-                # set the value of the search results to the modified value
-                results.search_results[n] = course
+            # set the value of the search results to the modified value
+            results.search_results[n] = course
 
-            results.terms = terms
-            results.years = years
+        results.terms = terms
+        results.years = years
 
         # get links, add them if there is a 'next' or 'prev' page (if there is not then there is only one page)
         # removing the current link
-        serializer = LinkSerializer(data=list(response.links.values()), many=True)
-        if serializer.is_valid(raise_exception=True):
-            links = [Link(**attrs) for attrs in serializer.validated_data]
-            # dont allow paging to the current page
-            for n, link in enumerate(links):
-                if link.page() == page:
-                    link.url = None
-                links[n] = link
-
-            if next((l for l in links if l.rel == 'next' or l.rel == 'prev'), None) is not None:
-                results.links = sorted(list(l for l in links if l.rel != 'current'), key=attrgetter('rel'))
+        links = link_decoder.build_many(search_page['links'])
+        # dont allow paging to the current page
+        for n, link in enumerate(links):
+            if link.page() == page:
+                link.url = None
+            links[n] = link
+
+        if next((l for l in links if l.rel == 'next' or l.rel == 'prev'), None) is not None:
+            results.links = sorted(list(l for l in links if l.rel != 'current'), key=attrgetter('rel'))
 
         return results
 
+    def get_search_page(self, account_id, search_term, page):
+        """ The courses, their Mediasite external links and the pagination links of a search, as plain data """
+        response = self.get_canvas_request(
+            partial_url='accounts/{0}/courses?include=term&completed=false&search_term={1}&page={2}&per_page=10'
+                .format(account_id, search_term, page))
+        courses = course_decoder.decode_many(response.json())
+
+        # get the Mediasite external links for the whole page at once, the results come back in
+        # the same order as the courses
+        external_links = self.get_mediasite_app_external_link_for_courses([Course(**attrs) for attrs in courses])
+        return {
+            'courses': [dict(attrs) for attrs in courses],
+            'external_links': [l.to_dict() if l is not None else None for l in external_links],
+            'links': list(response.links.values()),
+        }
+
     def get_course(self, course_id):
         response = self.get_canvas_request(
             partial_url='courses/{0}?include=term'.format(course_id)
         )
-        serializer = CourseSerializer(data=response.json())
-        if serializer.is_valid(raise_exception=True):
-            return Course(**serializer.validated_data)
+        return course_decoder.build(response.json())
 
     ##########################################################
     # External tools
     ##########################################################
     def get_mediasite_app_external_link(self, course_id, course_term):
-        response = self.get_canvas_request(partial_url='courses/{0}/external_tools'.format(course_id))
-        serializer = ExternalToolSerializer(data=response.json(), many=True)
-        if serializer.is_valid(raise_exception=True):
-            external_tools = [ExternalTool(**attrs) for attrs in serializer.validated_data]
-            return next((i for i in external_tools if i.name == "{0} {1}".format(CanvasAPI.MEDIASITE_EXTERNAL_TOOL_NAME, course_term)), None)
+        external_tools = self.get_paginated('courses/{0}/external_tools'.format(course_id),
+                                            external_tool_decoder)
+        return next((i for i in external_tools if i.name == "{0} {1}".format(CanvasAPI.MEDIASITE_EXTERNAL_TOOL_NAME, course_term)), None)
+
+    def get_mediasite_app_external_link_for_courses(self, courses):
+        """
+        Looks up the Mediasite external link for each of the given courses, fanning the calls out over
+        a bounded thread pool (see settings.CANVAS_MAX_CONCURRENT_REQUESTS) so that the total time
+        tracks the slowest call rather than the sum of all calls.
+        :return: a list of ExternalTool (or None) in the same order as `courses`
+        """
+        max_workers = min(len(courses), settings.CANVAS_MAX_CONCURRENT_REQUESTS)
+        if max_workers <= 1:
+            return [self.get_mediasite_app_external_link(course_id=c.id, course_term=c.term.name)
+                    for c in courses]
+
+        # resolve the user's credentials on this thread, so that the worker threads do not each
+        # have to go to the database for them
+        self.get_canvas_headers()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(
+                lambda c: self.get_mediasite_app_external_link(course_id=c.id, course_term=c.term.name),
+                courses))
 
     def get_mediasite_app_external_links(self, course_id):
-        response = self.get_canvas_request(partial_url='courses/{0}/external_tools'.format(course_id))
-        serializer = ExternalToolSerializer(data=response.json(), many=True)
-        if serializer.is_valid(raise_exception=True):
-            external_tools = [ExternalTool(**attrs) for attrs in serializer.validated_data]
-            return [i for i in external_tools if CanvasAPI.MEDIASITE_EXTERNAL_TOOL_NAME in i.name ]
+        external_tools = self.get_paginated('courses/{0}/external_tools'.format(course_id),
+                                            external_tool_decoder)
+        return [i for i in external_tools if CanvasAPI.MEDIASITE_EXTERNAL_TOOL_NAME in i.name ]
 
     def create_mediasite_app_external_link(self, course_id, course_term, url, consumer_key, shared_secret):
         mediasite_link_name = CanvasAPI.MEDIASITE_LINK_NAME
@@ -184,28 +334,21 @@ class CanvasAPI:
         )
         data = {'external_tool': external_link}
         response = self.post_canvas_request(partial_url='courses/{0}/external_tools'.format(course_id), data=data)
-        serializer = ExternalToolSerializer(data=response.json())
-        if serializer.is_valid(raise_exception=True):
-            return ExternalTool(**serializer.validated_data)
+        # the search results the course is on no longer show it as needing to be provisioned
+        CanvasAPI.invalidate_search_results(course_id)
+        return external_tool_decoder.build(response.json())
 
     ##########################################################
     # Modules
     ##########################################################
     def get_modules(self, course_id):
-        response = self.get_canvas_request(
-            partial_url='courses/{0}/modules'.format(course_id)
-        )
-        serializer = ModuleSerializer(data=response.json(), many=True)
-        if serializer.is_valid(raise_exception=True):
-            return [Module(**attrs) for attrs in serializer.validated_data]
+        return list(self.get_paginated('courses/{0}/modules'.format(course_id), module_decoder))
 
     def create_module(self, course_id, module_name):
         module = Module(name = module_name)
-        data = {'module': module.__dict__ }
+        data = {'module': module.to_dict() }
         response = self.post_canvas_request(partial_url='courses/{0}/modules'.format(course_id), data = data)
-        serializer = ModuleSerializer(data=response.json())
-        if serializer.is_valid(raise_exception=True):
-            return Module(**serializer.validated_data)
+        return module_decoder.build(response.json())
 
     def get_module_by_name(self, course_id, module_name):
         # TODO: what if there are two modules of the same name?
@@ -221,12 +364,8 @@ class CanvasAPI:
     # Module items
     ##########################################################
     def get_module_items(self, course_id, module_id):
-        response = self.get_canvas_request(
-            partial_url='courses/{0}/modules/{1}/items'.format(course_id, module_id)
-        )
-        serializer = ModuleItemSerializer(data=response.json(), many=True)
-        if serializer.is_valid(raise_exception=True):
-            return [ModuleItem(**attrs) for attrs in serializer.validated_data]
+        return list(self.get_paginated('courses/{0}/modules/{1}/items'.format(course_id, module_id),
+                                       module_item_decoder))
 
     def get_module_item_by_title_and_type(self, course_id, module_id, title, app_type):
         module_items = self.get_module_items(course_id, module_id)
@@ -236,17 +375,13 @@ class CanvasAPI:
         response = self.get_canvas_request(
             partial_url='courses/{0}/modules/{1}/items/{2}'.format(course_id, module_id, module_item_id)
         )
-        serializer = ModuleItemSerializer(data=response.json())
-        if serializer.is_valid(raise_exception=True):
-            return ModuleItem(**serializer.validated_data)
+        return module_item_decoder.build(response.json())
 
     def create_module_item(self, course_id, module_item):
-        data = { 'module_item' : module_item.__dict__ }
+        data = { 'module_item' : module_item.to_dict() }
         response = self.post_canvas_request(partial_url='courses/{0}/modules/{1}/items'
                                         .format(course_id, module_item.module_id), data = data)
-        serializer = ModuleItemSerializer(data=response.json())
-        if serializer.is_valid(raise_exception=True):
-            return ModuleItem(**serializer.validated_data)
+        return module_item_decoder.build(response.json())
 
     def get_mediasite_module_item_by_course(self, course_id):
         mediasite_module = self.get_module_by_name(course_id, module_name=CanvasAPI.MEDIASITE_MODULE_NAME)
@@ -282,46 +417,108 @@ class CanvasAPI:
     # Users, including enrollments
     ##########################################################
     def get_enrollments_for_teachers_and_tas(self, course_id):
-        response = self.get_canvas_request(partial_url='courses/{0}/enrollments?type[]={1}&type[]={2}'
-                                       .format(course_id, 'TeacherEnrollment', 'TaEnrollment'))
-        serializer = EnrollmentSerializer(data=response.json(), many=True)
-        if serializer.is_valid(raise_exception=True):
-            return [Enrollment(**attrs) for attrs in serializer.validated_data]
+        return list(self.get_paginated('courses/{0}/enrollments?type[]={1}&type[]={2}'
+                                       .format(course_id, 'TeacherEnrollment', 'TaEnrollment'),
+                                       enrollment_decoder))
 
     def get_enrollments(self, course_id, include_user_email):
         enrollments = self.get_enrollments_for_teachers_and_tas(course_id=course_id)
         # find users for enrollments to add the email address, not available in the
         # enrollments API call, and an expensive call so optional
         if include_user_email:
-            for enrollment_counter, enrollment in enumerate(enrollments):
-                enrollments[enrollment_counter].user = self.get_user_profile(enrollment.user.id)
+            users = dict((u.id, u) for u in self.get_teaching_users_with_email(course_id))
+            missing_users = [e.user.id for e in enrollments if e.user.id not in users]
+            users.update((u.id, u) for u in self.get_user_profiles(missing_users))
+            for enrollment in enrollments:
+                enrollment.user = users[enrollment.user.id]
         return enrollments
 
+    def get_teaching_users_with_email(self, course_id):
+        """
+        Gets the teachers and then the TAs of a course, each with `primary_email` set, using one
+        (paginated) users call per enrollment type.  The profile of a user is only fetched when the
+        users call did not include their email, and those fetches are made concurrently.
+        """
+        # resolve the user's credentials on this thread, so that the worker threads do not each
+        # have to go to the database for them
+        self.get_canvas_headers()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            teachers = executor.submit(self.get_teaching_users_for_course, course_id)
+            tas = executor.submit(self.get_ta_users_for_course, course_id)
+            teaching_users = teachers.result() + tas.result()
+
+        users = list()
+        user_ids = set()
+        for user in teaching_users:
+            # a user can be both a teacher and a TA
+            if user.id not in user_ids:
+                user_ids.add(user.id)
+                if not user.primary_email:
+                    user.primary_email = user.email
+                users.append(user)
+
+        profiles = dict((p.id, p) for p in self.get_user_profiles([u.id for u in users if not u.primary_email]))
+        return [profiles.get(u.id, u) for u in users]
+
+    def get_user_profiles(self, user_ids):
+        """ Fetches the profiles of the given users concurrently, in the order given """
+        max_workers = min(len(user_ids), settings.CANVAS_MAX_CONCURRENT_REQUESTS)
+        if max_workers <= 1:
+            return [self.get_user_profile(user_id) for user_id in user_ids]
+        self.get_canvas_headers()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.get_user_profile, user_ids))
+
     def get_user_profile(self, user_id):
         response = self.get_canvas_request(partial_url='users/{0}/profile'.format(user_id))
-        serializer = UserSerializer(data=response.json())
-        if serializer.is_valid(raise_exception=True):
-            return User(**serializer.validated_data)
+        return user_decoder.build(response.json())
 
     def get_teaching_users_for_course(self, course_id):
-        response = self.get_canvas_request(partial_url='courses/{0}/users?enrollment_type=teacher&include[]=email'
-                                            .format(course_id))
-        serializer = UserSerializer(data=response.json(), many=True)
-        if serializer.is_valid(raise_exception=True):
-            return [User(**attr) for attr in serializer.validated_data]
+        return list(self.get_paginated('courses/{0}/users?enrollment_type=teacher&include[]=email'.format(course_id),
+                                       user_decoder))
 
     def get_ta_users_for_course(self, course_id):
-        response = self.get_canvas_request(partial_url='courses/{0}/users?enrollment_type=ta&include[]=email'
-                                       .format(course_id))
-        serializer = UserSerializer(data=response.json(), many=True)
-        if serializer.is_valid(raise_exception=True):
-            return [User(**attrs) for attrs in serializer.validated_data]
+        return list(self.get_paginated('courses/{0}/users?enrollment_type=ta&include[]=email'.format(course_id),
+                                       user_decoder))
 
 
 
     ##########################################################
     # API methods
     ##########################################################
+    def get_paginated(self, partial_url, decoder, per_page=None, prefetch=False):
+        """
+        Yields the objects of a Canvas list endpoint one page at a time, following the 'next'
+        pagination links, so that only the current page (and, with `prefetch`, the next one) is
+        held in memory.
+        :param decoder: the mediasite_provisioning.decoder.Decoder that turns each page into api models
+        :param per_page: page size; defaults to settings.CANVAS_PER_PAGE
+        :param prefetch: fetch the next page in the background while the current one is consumed
+        """
+        separator = '&' if '?' in partial_url else '?'
+        partial_url = '{0}{1}per_page={2}'.format(partial_url, separator, per_page or settings.CANVAS_PER_PAGE)
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            response = self.get_canvas_request(partial_url=partial_url)
+            while response is not None:
+                next_link = response.links.get('next')
+                next_response = None
+                if next_link and executor is not None:
+                    next_response = executor.submit(self.get_canvas_request, None, full_url=next_link['url'])
+
+                for item in decoder.build_many(response.json()):
+                    yield item
+
+                if next_response is not None:
+                    response = next_response.result()
+                elif next_link:
+                    response = self.get_canvas_request(None, full_url=next_link['url'])
+                else:
+                    response = None
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
 
     # def get_canvas_api_key(self, code):
     #     auth_data = dict (
@@ -350,33 +547,47 @@ class CanvasAPI:
         return r.json()['access_token']
 
     def get_canvas_request(self, partial_url, full_url=None):
+        start_time = time.time()
+        url = full_url or CanvasAPI.get_canvas_api_url(partial_url)
+        r = None
         try:
-            url = full_url or CanvasAPI.get_canvas_api_url(partial_url)
-            r = requests.get(url=url, headers=self.get_canvas_headers())
+            headers = self.get_canvas_headers()
+            r = send_request('GET', lambda: CanvasAPI.get_api_session().get(url=url, headers=headers),
+                             CanvasAPI.get_rate_limits(url, headers))
             r.raise_for_status()
-            return r
         except Exception as e:
+            CanvasAPI.record_call('GET', url, start_time, r, error=True)
             raise CanvasServiceException(canvas_exception=e)
+        CanvasAPI.record_call('GET', url, start_time, r)
+        return r
 
     def post_canvas_request(self, partial_url, data, use_api=True):
+        if use_api:
+            url = CanvasAPI.get_canvas_api_url(partial_url)
+        else:
+            url = CanvasAPI.get_canvas_url(partial_url)
+        start_time = time.time()
+        r = None
         try:
-            if use_api:
-                url = CanvasAPI.get_canvas_api_url(partial_url)
-            else:
-                url = CanvasAPI.get_canvas_url(partial_url)
-
-            r = requests.post(url=url,
-                              data=json.dumps(data),
-                              headers=self.get_canvas_headers())
+            headers = self.get_canvas_headers()
+            body = json.dumps(data)
+            r = send_request('POST', lambda: CanvasAPI.get_api_session().post(url=url, data=body, headers=headers),
+                             CanvasAPI.get_rate_limits(url, headers))
             r.raise_for_status()
+            CanvasAPI.record_call('POST', url, start_time, r)
             logger.debug("made a {} call to {} via requests".format(
                 r.request.method, r.request.url))
             return r
         except Exception as e:
-            logger.info("tried to make a {} call to {} via requests with data {}".format(
-                r.request.method, r.request.url, r.request.body))
+            CanvasAPI.record_call('POST', url, start_time, r, error=True)
+            logger.info("tried to make a POST call to {} via requests with data {}".format(url, data))
             raise CanvasServiceException(canvas_exception=e)
 
+    @staticmethod
+    def record_call(method, url, start_time, response, error=False):
+        record_call('canvas', method, url, time.time() - start_time, error=error,
+                    bytes_received=len(response.content or b'') if response is not None else 0)
+
     @staticmethod
     def get_canvas_api_url(partial_url):
         return settings.CANVAS_URL.format('api/v1/{0}'.format(partial_url))
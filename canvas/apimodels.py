@@ -1,86 +1,78 @@
-from django.db import models
+from mediasite_provisioning.apimodels import ApiModel
 
-# Create your models here.
 
-class BaseSerializedModel(models.Model):
-    id = models.IntegerField(blank=True, null=True)
+class BaseSerializedModel(ApiModel):
+    __slots__ = ('id',)
 
-    def __init__(self, **kwargs):
-        self.__dict__.update(kwargs)
 
 class User(BaseSerializedModel):
-    name = models.TextField()
-    sis_user_id = models.TextField()
-    primary_email = models.TextField(blank=True, null=True)
-    email = models.TextField(blank=True, null=True)
-    time_zone = models.TextField(blank=True, null=True)
+    __slots__ = ('name', 'sis_user_id', 'primary_email', 'email', 'time_zone')
+
 
 class Term(BaseSerializedModel):
-    name = models.TextField()
-    start_at = models.DateTimeField(blank=True, null=True)
-    end_at = models.DateTimeField(blank=True, null=True)
-    sis_term_id = models.TextField(blank=True, null=True)
+    __slots__ = ('name', 'start_at', 'end_at', 'sis_term_id')
+
 
 class Enrollment(BaseSerializedModel):
-    type = models.TextField()
-    role = models.TextField()
-    enrollment_state = models.TextField()
-    role_id = models.IntegerField(blank=True, null=True)
-    user = None
+    __slots__ = ('type', 'role', 'enrollment_state', 'role_id', 'user')
+    _defaults = {'user': None}
 
     def __init__(self, **kwargs):
         # Enrollment has a hierarchy which needs to be manually initialized
-        self.__dict__.update(kwargs)
-        user = kwargs['user']
-        if user:
-            self.user = User(**user)
+        self._init_attributes(**kwargs)
+        if isinstance(self.user, dict):
+            self.user = User(**self.user)
+
 
 class Account(BaseSerializedModel):
-    name = models.TextField()
-    sis_account_id = models.TextField(blank=True, null=True, default="")
+    __slots__ = ('name', 'sis_account_id')
+
 
 class ModuleItem(BaseSerializedModel):
-    module_id = models.TextField()
-    title = models.TextField()
-    external_url = models.TextField()
-    html_url = models.TextField()
-    type = models.TextField()
-    content_id = models.IntegerField()
+    __slots__ = ('module_id', 'title', 'external_url', 'html_url', 'type', 'content_id')
+
 
 class Module(BaseSerializedModel):
-    name = models.TextField()
-    items = models.ManyToManyField(ModuleItem)
-    items_count = models.IntegerField()
+    __slots__ = ('name', 'items', 'items_count')
+
+    def __init__(self, **kwargs):
+        # Module has a hierarchy which needs to be manually initialized
+        self._init_attributes(**kwargs)
+        items = getattr(self, 'items', None)
+        if items:
+            self.items = [ModuleItem(**i) if isinstance(i, dict) else i for i in items]
+
 
 class Course(BaseSerializedModel):
-    sis_course_id = models.TextField(blank=True, null=True, default="")
-    name = models.TextField()
-    course_code = models.TextField()
-    workflow_state = models.TextField()
-    account_id = models.TextField()
-    enrollment_term_id = models.TextField()
-    enrollments = models.ManyToManyField(Enrollment, blank=True, null=True)
-    start_at = models.DateTimeField(blank=True, null=True)
-    end_at = models.DateTimeField(blank=True, null=True)
-    total_students = models.IntegerField(null=True)
-    modules = models.ManyToManyField(Module, null=True, blank=True)
-    teaching_users = list()
-    term = None
-    year = None
-    canvas_mediasite_module_item = None
-    canvas_mediasite_external_link = None
+    __slots__ = ('sis_course_id', 'name', 'course_code', 'workflow_state', 'account_id', 'enrollment_term_id',
+                 'enrollments', 'start_at', 'end_at', 'total_students', 'modules', 'teaching_users', 'term', 'year',
+                 'canvas_mediasite_module_item', 'canvas_mediasite_external_link')
+    _defaults = {
+        'start_at': None,
+        'teaching_users': list,
+        'term': None,
+        'year': None,
+        'canvas_mediasite_module_item': None,
+        'canvas_mediasite_external_link': None,
+    }
 
     def __init__(self, **kwargs):
         # Course has a hierarchy which needs to be manually initialized
-        self.__dict__.update(kwargs)
-        term = kwargs['term']
-
-        if term:
-            self.term = Term(**term)
+        self._init_attributes(**kwargs)
+        if isinstance(self.term, dict):
+            self.term = Term(**self.term)
+        if self.teaching_users is None:
+            self.teaching_users = list()
+        else:
+            self.teaching_users = [User(**u) if isinstance(u, dict) else u for u in self.teaching_users]
+        if getattr(self, 'enrollments', None):
+            self.enrollments = [Enrollment(**e) if isinstance(e, dict) else e for e in self.enrollments]
+        if getattr(self, 'modules', None):
+            self.modules = [Module(**m) if isinstance(m, dict) else m for m in self.modules]
 
         # If the term is set to "Default Term" we know that it is bad data, so we get rid of it and rely on
         # other methods to get the term
-        if self.term.name == "Default Term":
+        if self.term is not None and self.term.name == "Default Term":
             self.term = None
 
         if self.term is not None:
@@ -127,18 +119,12 @@ class Course(BaseSerializedModel):
             return '{0}-{1}'.format(year_start_at.year, year_start_at.year + 1)
         else:
             return '{0}-{1}'.format(year_start_at.year-1, year_start_at.year)
-        endif
 
 class ExternalTool(BaseSerializedModel):
-    name = models.TextField()
-    description = models.TextField(blank=True, null=True)
-    url = models.TextField(blank=True, null=True)
-    domain = models.TextField(blank=True, null=True)
-    consumer_key = models.TextField(blank=True, null=True)
+    __slots__ = ('name', 'description', 'url', 'domain', 'consumer_key')
 
 class Link(BaseSerializedModel):
-    url = models.TextField()
-    rel = models.TextField()
+    __slots__ = ('url', 'rel')
 
     def page(self):
         page = 0
@@ -152,10 +138,13 @@ class Link(BaseSerializedModel):
                     page = page[0:page_index]
         return page
 
-class SearchResults(models.Model):
-    search_results = list()
-    terms = list()
-    years = list()
-    links = list()
-    count = None
-    school = None
+class SearchResults(ApiModel):
+    __slots__ = ('search_results', 'terms', 'years', 'links', 'count', 'school')
+    _defaults = {
+        'search_results': list,
+        'terms': list,
+        'years': list,
+        'links': list,
+        'count': None,
+        'school': None,
+    }
@@ -0,0 +1,260 @@
+from __future__ import unicode_literals
+
+import itertools
+from urllib.parse import urlencode
+
+from mediasite_provisioning.fakeserver import FakeResponse, FakeServer
+
+_ENROLLMENT_TYPES = {'teacher': 'TeacherEnrollment', 'ta': 'TaEnrollment', 'student': 'StudentEnrollment'}
+
+
+class FakeCanvasServer(FakeServer):
+    """
+    A stand-in for the Canvas REST API, implementing the endpoints CanvasAPI uses with Canvas'
+    Link header pagination (page and per_page, capped at 100).  Courses can be addressed by id or by
+    `sis_course_id:<id>`.  Requests without a bearer token, or with one that is not in `tokens`
+    (when given), get a 401.
+
+        server = FakeCanvasServer()
+        account = server.add_account('School of Public Health')
+        course = server.add_course(account['id'], 'Epidemiology', 'EPI 201', sis_course_id='346889')
+        server.enroll(course['id'], server.add_user('Ann Smith', 'ann@example.edu'), 'TeacherEnrollment')
+    """
+
+    def __init__(self, tokens=None, **kwargs):
+        super(FakeCanvasServer, self).__init__(**kwargs)
+        self.tokens = tokens
+        self.accounts = list()
+        # id -> course, and id -> user
+        self.courses = dict()
+        self.users = dict()
+        # course id -> its external tools, modules and (user id, enrollment type) enrollments
+        self.external_tools = dict()
+        self.modules = dict()
+        self.enrollments = dict()
+        # module id -> its items
+        self.module_items = dict()
+        # sis term id -> term id
+        self._term_ids = dict()
+        self._ids = itertools.count(1000)
+
+        api = 'api/v1/'
+        course = '(?P<course_id>[^/]+)'
+        self.add_route('GET', api + 'accounts', self.get_accounts)
+        self.add_route('GET', api + r'accounts/(?P<account_id>\d+)/courses', self.get_account_courses)
+        self.add_route('GET', api + 'courses/' + course, self.get_course)
+        self.add_route('GET', api + 'courses/' + course + '/external_tools', self.get_external_tools)
+        self.add_route('POST', api + 'courses/' + course + '/external_tools', self.create_external_tool)
+        self.add_route('GET', api + 'courses/' + course + '/modules', self.get_modules)
+        self.add_route('POST', api + 'courses/' + course + '/modules', self.create_module)
+        self.add_route('GET', api + 'courses/' + course + r'/modules/(?P<module_id>\d+)/items', self.get_module_items)
+        self.add_route('POST', api + 'courses/' + course + r'/modules/(?P<module_id>\d+)/items',
+                       self.create_module_item)
+        self.add_route('GET', api + 'courses/' + course + r'/modules/(?P<module_id>\d+)/items/(?P<item_id>\d+)',
+                       self.get_module_item)
+        self.add_route('GET', api + 'courses/' + course + '/enrollments', self.get_enrollments)
+        self.add_route('GET', api + 'courses/' + course + '/users', self.get_users)
+        self.add_route('GET', api + r'users/(?P<user_id>\d+)/profile', self.get_user_profile)
+        self.add_route('POST', 'login/oauth2/token', self.create_token)
+
+    def settings(self):
+        return {'CANVAS_URL': self.url + '{0}'}
+
+    ######################################################
+    # Data
+    ######################################################
+    def next_id(self):
+        return next(self._ids)
+
+    def add_account(self, name):
+        account = dict(id=self.next_id(), name=name, sis_account_id=None)
+        self.accounts.append(account)
+        return account
+
+    def add_course(self, account_id, name, course_code, sis_course_id=None, term_name='2016 Fall',
+                   sis_term_id='2016-1', start_at='2016-09-01T04:00:00Z'):
+        course_id = self.next_id()
+        term_id = self._term_ids.setdefault(sis_term_id, self.next_id())
+        course = dict(id=course_id, account_id=account_id, name=name, course_code=course_code,
+                      sis_course_id=sis_course_id, workflow_state='available', enrollment_term_id=term_id,
+                      start_at=start_at, end_at=None, total_students=0,
+                      term=dict(id=term_id, name=term_name, sis_term_id=sis_term_id, start_at=start_at,
+                                end_at=None))
+        self.courses[course_id] = course
+        self.external_tools[course_id] = list()
+        self.modules[course_id] = list()
+        self.enrollments[course_id] = list()
+        return course
+
+    def add_user(self, name, email=None):
+        """ Adds a user; `email` is what the user's profile reports as their primary email """
+        user = dict(id=self.next_id(), name=name, sis_user_id=str(self.next_id()), primary_email=email,
+                    time_zone='America/New_York')
+        self.users[user['id']] = user
+        return user
+
+    def enroll(self, course_id, user, enrollment_type='TeacherEnrollment'):
+        self.enrollments[course_id].append((user['id'], enrollment_type))
+
+    def populate(self, account_name='Fake School', courses=10, teachers=2, tas=1, search_prefix='FAKE'):
+        """
+        Adds an account with `courses` courses, each with its own teachers and TAs (see get_user_json
+        for which of them have no email in the users listing)
+        :return: the account
+        """
+        account = self.add_account(account_name)
+        for n in range(courses):
+            course = self.add_course(account['id'], 'Fake Course {0}'.format(n),
+                                     '{0} {1}'.format(search_prefix, n), sis_course_id=str(500000 + n))
+            for t in range(teachers + tas):
+                user = self.add_user('Teacher {0}-{1}'.format(n, t), 'teacher{0}-{1}@example.edu'.format(n, t))
+                self.enroll(course['id'], user, 'TeacherEnrollment' if t < teachers else 'TaEnrollment')
+        return account
+
+    ######################################################
+    # Handlers
+    ######################################################
+    def dispatch(self, request):
+        authorization = request.headers.get('Authorization') or ''
+        token = authorization[len('Bearer '):] if authorization.startswith('Bearer ') else ''
+        if request.path.startswith('/api/') and (not token or (self.tokens is not None and token not in self.tokens)):
+            with self._lock:
+                self._calls[(request.method, 'unauthorized')] += 1
+            return FakeResponse({'errors': [{'message': 'Invalid access token.'}]}, status=401)
+        return super(FakeCanvasServer, self).dispatch(request)
+
+    def paginate(self, request, items):
+        """ Returns one page of `items`, with the Link header Canvas sends for it """
+        try:
+            page = max(1, int(request.params.get('page', 1)))
+            per_page = min(100, max(1, int(request.params.get('per_page', 10))))
+        except ValueError:
+            return self.error_response(400, 'invalid page')
+        last_page = max(1, (len(items) + per_page - 1) // per_page)
+
+        params = [(k, v) for k, v in request.params_list if k not in ('page', 'per_page')]
+
+        def page_url(n):
+            return '{0}{1}?{2}'.format(self.url, request.path.lstrip('/'),
+                                       urlencode(params + [('page', n), ('per_page', per_page)]))
+
+        links = [('current', page)]
+        if page < last_page:
+            links.append(('next', page + 1))
+        if page > 1:
+            links.append(('prev', page - 1))
+        links.extend([('first', 1), ('last', last_page)])
+        link_header = ','.join('<{0}>; rel="{1}"'.format(page_url(n), rel) for rel, n in links)
+        return FakeResponse(items[(page - 1) * per_page:page * per_page], headers={'Link': link_header})
+
+    def find_course(self, course_id):
+        if course_id.startswith('sis_course_id:'):
+            sis_course_id = course_id[len('sis_course_id:'):]
+            return next((c for c in self.courses.values() if c['sis_course_id'] == sis_course_id), None)
+        return self.courses.get(int(course_id)) if course_id.isdigit() else None
+
+    def not_found(self):
+        return FakeResponse({'errors': [{'message': 'The specified resource does not exist.'}]}, status=404)
+
+    def get_accounts(self, request):
+        return self.paginate(request, self.accounts)
+
+    def get_account_courses(self, request, account_id):
+        courses = [c for c in self.courses.values() if str(c['account_id']) == account_id]
+        if request.params.get('enrollment_term_id'):
+            courses = [c for c in courses if str(c['enrollment_term_id']) == request.params['enrollment_term_id']]
+        search_term = request.params.get('search_term', '').lower()
+        if search_term:
+            courses = [c for c in courses
+                       if any(search_term in (c[f] or '').lower() for f in ('name', 'course_code', 'sis_course_id'))]
+        return self.paginate(request, courses)
+
+    def get_course(self, request, course_id):
+        course = self.find_course(course_id)
+        return FakeResponse(course) if course is not None else self.not_found()
+
+    def get_external_tools(self, request, course_id):
+        course = self.find_course(course_id)
+        if course is None:
+            return self.not_found()
+        return self.paginate(request, self.external_tools[course['id']])
+
+    def create_external_tool(self, request, course_id):
+        course = self.find_course(course_id)
+        if course is None:
+            return self.not_found()
+        tool = dict(request.json()['external_tool'], id=self.next_id(), domain=None, description=None)
+        self.external_tools[course['id']].append(tool)
+        return FakeResponse(tool)
+
+    def get_modules(self, request, course_id):
+        course = self.find_course(course_id)
+        if course is None:
+            return self.not_found()
+        return self.paginate(request, [dict(m, items_count=len(self.module_items[m['id']]))
+                                       for m in self.modules[course['id']]])
+
+    def create_module(self, request, course_id):
+        course = self.find_course(course_id)
+        if course is None:
+            return self.not_found()
+        module = dict(id=self.next_id(), name=request.json()['module']['name'])
+        self.modules[course['id']].append(module)
+        self.module_items[module['id']] = list()
+        return FakeResponse(dict(module, items_count=0))
+
+    def get_module_items(self, request, course_id, module_id):
+        if self.find_course(course_id) is None or int(module_id) not in self.module_items:
+            return self.not_found()
+        return self.paginate(request, self.module_items[int(module_id)])
+
+    def create_module_item(self, request, course_id, module_id):
+        if self.find_course(course_id) is None or int(module_id) not in self.module_items:
+            return self.not_found()
+        item = dict(request.json()['module_item'], id=self.next_id(), module_id=module_id)
+        item.setdefault('html_url', '{0}courses/{1}/modules/items/{2}'.format(self.url, course_id, item['id']))
+        self.module_items[int(module_id)].append(item)
+        return FakeResponse(item)
+
+    def get_module_item(self, request, course_id, module_id, item_id):
+        items = self.module_items.get(int(module_id), ())
+        item = next((i for i in items if i['id'] == int(item_id)), None)
+        return FakeResponse(item) if item is not None else self.not_found()
+
+    def get_enrollments(self, request, course_id):
+        course = self.find_course(course_id)
+        if course is None:
+            return self.not_found()
+        types = [v for k, v in request.params_list if k == 'type[]']
+        enrollments = [dict(id=n, type=enrollment_type, role=enrollment_type, enrollment_state='active',
+                            user=self.get_user_json(user_id, include_email=False))
+                       for n, (user_id, enrollment_type) in enumerate(self.enrollments[course['id']])
+                       if not types or enrollment_type in types]
+        return self.paginate(request, enrollments)
+
+    def get_users(self, request, course_id):
+        course = self.find_course(course_id)
+        if course is None:
+            return self.not_found()
+        enrollment_type = _ENROLLMENT_TYPES.get(request.params.get('enrollment_type'))
+        include_email = ('include[]', 'email') in request.params_list
+        user_ids = list()
+        for user_id, user_enrollment_type in self.enrollments[course['id']]:
+            if (enrollment_type is None or user_enrollment_type == enrollment_type) and user_id not in user_ids:
+                user_ids.append(user_id)
+        return self.paginate(request, [self.get_user_json(user_id, include_email) for user_id in user_ids])
+
+    def get_user_json(self, user_id, include_email):
+        user = self.users[user_id]
+        user_json = dict(id=user['id'], name=user['name'], sis_user_id=user['sis_user_id'])
+        # like Canvas, only some users' emails are visible in listings; their profile has it
+        if include_email and user['id'] % 3:
+            user_json['email'] = user['primary_email']
+        return user_json
+
+    def get_user_profile(self, request, user_id):
+        user = self.users.get(int(user_id))
+        return FakeResponse(user) if user is not None else self.not_found()
+
+    def create_token(self, request):
+        return FakeResponse(dict(access_token='token-{0}'.format(request.json()['code'])))
@@ -1,57 +1,78 @@
 from rest_framework import  serializers
-from .apimodels import Course, Term, Enrollment, User, Account, ModuleItem, Module, ExternalTool, Link
 
-class UserSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = User
-        fields = '__all__'
+# These serializers validate the Canvas API payloads that are turned into the objects in
+# canvas.apimodels.  Fields that Canvas may leave out are optional, so the objects only get the
+# attributes Canvas actually returned.
 
-class AccountSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Account
-        fields = '__all__'
+class UserSerializer(serializers.Serializer):
+    id = serializers.IntegerField(allow_null=True, required=False)
+    # the email fields are only returned by some endpoints; default them so callers can always read them
+    primary_email = serializers.CharField(allow_null=True, allow_blank=True, required=False, default=None)
+    email = serializers.CharField(allow_null=True, allow_blank=True, required=False, default=None)
+    name = serializers.CharField()
+    sis_user_id = serializers.CharField()
+    time_zone = serializers.CharField(allow_null=True, allow_blank=True, required=False)
 
-class TermSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Term
-        fields = '__all__'
+class AccountSerializer(serializers.Serializer):
+    id = serializers.IntegerField(allow_null=True, required=False)
+    name = serializers.CharField()
+    sis_account_id = serializers.CharField(allow_null=True, allow_blank=True, required=False)
 
-class ModuleItemSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = ModuleItem
-        fields = '__all__'
+class TermSerializer(serializers.Serializer):
+    id = serializers.IntegerField(allow_null=True, required=False)
+    name = serializers.CharField()
+    start_at = serializers.DateTimeField(allow_null=True, required=False)
+    end_at = serializers.DateTimeField(allow_null=True, required=False)
+    sis_term_id = serializers.CharField(allow_null=True, allow_blank=True, required=False)
 
-class ModuleSerializer(serializers.ModelSerializer):
-    items = ModuleItemSerializer(many=True, allow_null=True, default=None)
+class ModuleItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField(allow_null=True, required=False)
+    module_id = serializers.CharField()
+    title = serializers.CharField()
+    external_url = serializers.CharField()
+    html_url = serializers.CharField()
+    type = serializers.CharField()
+    content_id = serializers.IntegerField()
 
-    class Meta:
-        model = Module
-        fields = '__all__'
+class ModuleSerializer(serializers.Serializer):
+    id = serializers.IntegerField(allow_null=True, required=False)
+    items = ModuleItemSerializer(many=True, allow_null=True, default=None)
+    name = serializers.CharField()
+    items_count = serializers.IntegerField()
 
-class EnrollmentSerializer(serializers.ModelSerializer):
+class EnrollmentSerializer(serializers.Serializer):
+    id = serializers.IntegerField(allow_null=True, required=False)
     user = UserSerializer(allow_null=True, default=None)
+    type = serializers.CharField()
+    role = serializers.CharField()
+    enrollment_state = serializers.CharField()
+    role_id = serializers.IntegerField(allow_null=True, required=False)
 
-    class Meta:
-        model = Enrollment
-        fields = '__all__'
-
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(serializers.Serializer):
+    id = serializers.IntegerField(allow_null=True, required=False)
     enrollments = EnrollmentSerializer(many=True, allow_null=True, default=None)
     teaching_users = UserSerializer(many=True, allow_null=True, default=None)
     term = TermSerializer(allow_null=True, default=None)
     modules = ModuleSerializer(many=True, allow_null=True, default=None)
+    sis_course_id = serializers.CharField(allow_null=True, allow_blank=True, required=False)
+    name = serializers.CharField()
+    course_code = serializers.CharField()
+    workflow_state = serializers.CharField()
+    account_id = serializers.CharField()
+    enrollment_term_id = serializers.CharField()
+    start_at = serializers.DateTimeField(allow_null=True, required=False)
+    end_at = serializers.DateTimeField(allow_null=True, required=False)
+    total_students = serializers.IntegerField(allow_null=True, required=False)
 
-    class Meta:
-        model = Course
-        fields = '__all__'
-
-class ExternalToolSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = ExternalTool
-        fields = '__all__'
-
-class LinkSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Link
-        fields = '__all__'
+class ExternalToolSerializer(serializers.Serializer):
+    id = serializers.IntegerField(allow_null=True, required=False)
+    name = serializers.CharField()
+    description = serializers.CharField(allow_null=True, allow_blank=True, required=False)
+    url = serializers.CharField(allow_null=True, allow_blank=True, required=False)
+    domain = serializers.CharField(allow_null=True, allow_blank=True, required=False)
+    consumer_key = serializers.CharField(allow_null=True, allow_blank=True, required=False)
 
+class LinkSerializer(serializers.Serializer):
+    id = serializers.IntegerField(allow_null=True, required=False)
+    url = serializers.CharField()
+    rel = serializers.CharField()
@@ -1,21 +1,112 @@
-from django.test import TestCase
-from .apimethods import CanvasAPI
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from web.models import APIUser
+from .apimethods import CanvasAPI, CanvasServiceException
+from .fakeserver import FakeCanvasServer
+
+
+class FakeRedisSets(object):
+    """ Just the redis set commands the search index uses, as the tests have no redis """
+
+    def __init__(self):
+        self.sets = defaultdict(set)
+
+    def pipeline(self, transaction=True):
+        commands = list()
+        pipeline = mock.Mock()
+        pipeline.sadd = lambda name, value: commands.append(lambda: self.sets[name].add(value.encode('utf8')))
+        pipeline.expire = lambda name, seconds: commands.append(lambda: True)
+        pipeline.smembers = lambda name: commands.append(lambda: set(self.sets.get(name, ())))
+        pipeline.delete = lambda name: commands.append(lambda: self.sets.pop(name, None))
+        pipeline.execute = lambda: [command() for command in commands]
+        return pipeline
+
 
-# Create your tests here.
 class CanvasAPITest(TestCase):
 
-    def test_getting_course_hiearchy(self):
-        accounts = CanvasAPI.get_accounts_for_current_user()
-        self.assertFalse(accounts is None)
-
-        if len(accounts) > 0:
-            account = accounts[0]
-            courses_for_account = CanvasAPI.get_courses_for_account(account.id)
-            self.assertFalse(courses_for_account is None)
-            if len(courses_for_account) > 0:
-                course_to_test = courses_for_account[0]
-
-                course = CanvasAPI.get_course(course_to_test.id)
-                self.assertFalse(course is None)
-                teachers = CanvasAPI.get_enrollments(course_id=course.id, include_user_email=True)
-                self.assertFalse(teachers is None)
+    def setUp(self):
+        self.server = FakeCanvasServer(tokens=['test-token']).start()
+        self.addCleanup(self.server.stop)
+        self.account = self.server.populate(courses=5)
+        settings_override = override_settings(CANVAS_PER_PAGE=2, **self.server.settings())
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = User.objects.create(username='teacher')
+        APIUser.objects.create(user=user, canvas_api_key='test-token')
+        self.canvas_api = CanvasAPI(user=user)
+
+    def test_getting_course_hierarchy(self):
+        accounts = self.canvas_api.get_accounts_for_current_user()
+        self.assertEqual([a.id for a in accounts], [self.account['id']])
+
+        # 5 courses, 2 to a page
+        courses = list(self.canvas_api.get_courses_for_account(self.account['id']))
+        self.assertEqual(len(courses), 5)
+        self.assertEqual(self.server.calls[('GET', 'accounts/{id}/courses')], 3)
+
+        course = self.canvas_api.get_course(courses[0].id)
+        self.assertEqual(course.sis_course_id, '500000')
+        self.assertEqual(course.year, '2016-2017')
+        teachers = self.canvas_api.get_enrollments(course_id=course.id, include_user_email=True)
+        self.assertEqual(sorted(e.user.primary_email for e in teachers),
+                         ['teacher0-0@example.edu', 'teacher0-1@example.edu', 'teacher0-2@example.edu'])
+
+    def test_search_courses(self):
+        results = self.canvas_api.search_courses(self.account['id'], 'fake 1', page=1)
+        self.assertEqual([c.course_code for c in results.search_results], ['FAKE 1'])
+        self.assertEqual([t.name for t in results.terms], ['2016 Fall'])
+        self.assertEqual(results.links, [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'canvas_tests'}})
+    def test_search_results_are_cached_until_a_course_is_provisioned(self):
+        results = self.canvas_api.search_courses(self.account['id'], 'FAKE', page=1)
+        calls = self.server.call_count()
+        self.assertEqual([c.course_code for c in self.canvas_api.search_courses(self.account['id'], 'FAKE', page=1)
+                          .search_results], [c.course_code for c in results.search_results])
+        self.assertEqual(self.server.call_count(), calls)
+
+        course = results.search_results[0]
+        self.assertIsNone(course.canvas_mediasite_external_link)
+        self.canvas_api.create_mediasite_app_external_link(course.id, course.term.name, 'https://mediasite.test/lti',
+                                                           'key', 'secret')
+        results = self.canvas_api.search_courses(self.account['id'], 'FAKE', page=1)
+        self.assertEqual(results.search_results[0].canvas_mediasite_external_link.consumer_key, 'key')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'canvas_redis_tests'}})
+    def test_search_pages_are_indexed_in_redis_sets(self):
+        redis = FakeRedisSets()
+        with mock.patch('canvas.apimethods.get_redis_client', return_value=redis):
+            results = self.canvas_api.search_courses(self.account['id'], 'FAKE', page=1)
+            self.canvas_api.search_courses(self.account['id'], 'FAKE 1', page=1)
+            course = next(c for c in results.search_results if c.course_code == 'FAKE 1')
+            self.assertEqual(len(redis.sets[CanvasAPI.get_search_index_key(course.id)]), 2)
+
+            CanvasAPI.invalidate_search_results(course.id)
+            self.assertNotIn(CanvasAPI.get_search_index_key(course.id), redis.sets)
+            calls = self.server.call_count()
+            self.canvas_api.search_courses(self.account['id'], 'FAKE', page=1)
+            self.canvas_api.search_courses(self.account['id'], 'FAKE 1', page=1)
+            self.assertGreater(self.server.call_count(), calls)
+
+    def test_create_mediasite_app_external_link(self):
+        course_id = self.server.add_course(self.account['id'], 'Biostatistics', 'BST 210')['id']
+        self.assertIsNone(self.canvas_api.get_mediasite_app_external_link(course_id, '2016 Fall'))
+        self.canvas_api.create_mediasite_app_external_link(course_id, '2016 Fall', 'https://mediasite.test/lti',
+                                                           'key', 'secret')
+        external_tool = self.canvas_api.get_mediasite_app_external_link(course_id, '2016 Fall')
+        self.assertEqual(external_tool.consumer_key, 'key')
+
+    def test_invalid_token(self):
+        self.canvas_api._user.apiuser.canvas_api_key = 'expired-token'
+        with self.assertRaises(CanvasServiceException) as cm:
+            self.canvas_api.get_accounts_for_current_user()
+        self.assertEqual(cm.exception.status_code(), 401)
@@ -1,17 +1,26 @@
 from __future__ import unicode_literals
 
+from concurrent.futures import ThreadPoolExecutor
 import json
 import logging
+import os
 import time
+from urllib.parse import urlparse
 import uuid
 
 from django.conf import settings
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
+from mediasite_provisioning.cache import TieredCache, shared_lock
+from mediasite_provisioning.decoder import Decoder
+from mediasite_provisioning.metrics import record_call
+from mediasite_provisioning.ratelimit import RateLimiter, send_request
+
 from .apimodels import (
-    AccessControl,
     Catalog,
+    CatalogSetting,
     Folder,
     FolderPermission,
     Home,
@@ -21,16 +30,61 @@ from .apimodels import (
     UserProfile, )
 from .serializer import (
     CatalogSerializer,
+    CatalogSettingSerializer,
     FolderSerializer,
     HomeSerializer,
     ModuleSerializer,
     ResourcePermissionSerializer,
     RoleSerializer,
     UserProfileSerializer, )
-from .utils import odata_encode_str
+from .odata import ODataQuery, endswith_clause, select_fields
 
 logger = logging.getLogger(__name__)
 
+# Mediasite payloads are decoded with these rather than by running the serializers on every record;
+# see mediasite_provisioning.decoder
+catalog_decoder = Decoder(CatalogSerializer, Catalog)
+catalog_setting_decoder = Decoder(CatalogSettingSerializer, CatalogSetting)
+folder_decoder = Decoder(FolderSerializer, Folder)
+home_decoder = Decoder(HomeSerializer, Home)
+module_decoder = Decoder(ModuleSerializer, Module)
+resource_permission_decoder = Decoder(ResourcePermissionSerializer, ResourcePermission)
+role_decoder = Decoder(RoleSerializer, Role)
+user_profile_decoder = Decoder(UserProfileSerializer, UserProfile)
+
+
+class Lookup(object):
+    """
+    A search for one Mediasite object and how its result is cached, run by MediasiteAPI.find_one
+    or MediasiteAPI.find_indexed.
+
+    `cache` and `key` are where the attributes of the object found are kept (if anywhere), and
+    `not_found_key` is the MediasiteAPI._not_found_cache key that remembers nothing was found.
+    `remember` caches the attributes of the object found, by default under `cache` and `key`.
+    Searches whose results have to be filtered (see the oData note on MediasiteAPI.get_folders) give
+    `matches`, and `on_page` is called with each page of results they read.  A `unique` search
+    raises a ValueError if more than one object matches, rather than finding none.
+    """
+
+    def __init__(self, url, query, decoder, cache=None, key=None, not_found_key=None, remember=None,
+                 matches=None, on_page=None, unique=False):
+        self.url = url
+        self.query = query
+        self.decoder = decoder
+        self.cache = cache
+        self.key = key
+        self.not_found_key = not_found_key
+        self._remember = remember
+        self.matches = matches
+        self.on_page = on_page
+        self.unique = unique
+
+    def remember(self, attrs):
+        if self._remember is not None:
+            self._remember(attrs)
+        elif self.cache is not None:
+            self.cache.set(self.key, dict(attrs))
+
 
 class MediasiteServiceException(Exception):
     _mediasite_exception = None
@@ -68,41 +122,289 @@ class MediasiteAPI:
     # API Session
     ######################################################
     _api_session = None
+    _api_session_pid = None
 
     @staticmethod
     def get_api_session():
-        if MediasiteAPI._api_session is None:
+        """ The session is shared by the threads of a process, and rebuilt after a fork so that gunicorn
+        workers never share sockets. """
+        if MediasiteAPI._api_session is None or MediasiteAPI._api_session_pid != os.getpid():
             _session = requests.Session()
+            _adapter = HTTPAdapter(pool_connections=settings.MEDIASITE_HTTP_POOL_SIZE,
+                                   pool_maxsize=settings.MEDIASITE_HTTP_POOL_SIZE)
+            _session.mount('https://', _adapter)
+            _session.mount('http://', _adapter)
             _session.auth = MediasiteAPI.get_mediasite_auth()
             _session.headers.update(MediasiteAPI.get_mediasite_headers())
             MediasiteAPI._api_session = _session
+            MediasiteAPI._api_session_pid = os.getpid()
             logger.debug("Created a Mediasite API session object!")
         return MediasiteAPI._api_session
 
+    _rate_limiter = RateLimiter('mediasite', 'MEDIASITE_RATE_LIMIT', 'MEDIASITE_RATE_LIMIT_BURST')
+
+    @staticmethod
+    def get_rate_limits(url):
+        return [(MediasiteAPI._rate_limiter, urlparse(url).netloc)]
+
     ######################################################
-    # Folders
+    # Caches
+    ######################################################
+    # Well known ids (the root folder, roles) practically never change, so they are cached across
+    # all workers.  They are evicted when Mediasite rejects them (see assign_permissions_to_folder and
+    # create_folder), and can be flushed with the flush_mediasite_caches management command.
+    _folder_cache = TieredCache('mediasite:folders', 'MEDIASITE_FOLDER_CACHE_TIMEOUT')
+    # index of (ParentFolderId, exact Name) to folder, filled as folders are fetched or created and
+    # refreshed by the sync_mediasite_folders management command
+    _folder_index = TieredCache('mediasite:folder_index', 'MEDIASITE_FOLDER_INDEX_TIMEOUT')
+    _role_cache = TieredCache('mediasite:roles', 'MEDIASITE_ROLE_CACHE_TIMEOUT')
+    # index of LinkedFolderId to the catalog of that folder, filled as catalogs are fetched or
+    # created and refreshed by the sync_mediasite_catalogs management command
+    _catalog_index = TieredCache('mediasite:catalog_index', 'MEDIASITE_CATALOG_INDEX_TIMEOUT')
+    # catalog id -> the settings last read from or written to the catalog
+    _catalog_settings_cache = TieredCache('mediasite:catalog_settings', 'MEDIASITE_CATALOG_SETTINGS_CACHE_TIMEOUT')
+    # lookups that found nothing, keyed like the caches above (e.g. 'role:name:<name>'), so misses
+    # aren't repeated within a run.  Kept out of the local tier: the create_* methods evict these
+    # entries, and a worker still seeing one after another has created the object would create it twice.
+    _not_found_cache = TieredCache('mediasite:not_found', 'MEDIASITE_NOT_FOUND_CACHE_TIMEOUT', local_tier=False)
+
+    @staticmethod
+    def invalidate_root_folder_id():
+        MediasiteAPI._folder_cache.delete('root_folder_id')
+
+    @staticmethod
+    def invalidate_role(role_name=None, directory_entry=None):
+        if role_name is not None:
+            MediasiteAPI._role_cache.delete('name:{0}'.format(role_name))
+        if directory_entry is not None:
+            MediasiteAPI._role_cache.delete('directory_entry:{0}'.format(directory_entry))
+
+    @staticmethod
+    def invalidate_role_id(role_id):
+        """ Evicts the cached role with this id, if any, under its name and directory entry """
+        role_attrs = MediasiteAPI._role_cache.get('id:{0}'.format(role_id))
+        if role_attrs is not None:
+            logger.info("evicting cached Mediasite role {} ({})".format(role_attrs.get('Name'), role_id))
+            MediasiteAPI.invalidate_role(role_attrs.get('Name'), role_attrs.get('DirectoryEntry'))
+            MediasiteAPI._role_cache.delete('id:{0}'.format(role_id))
+
+    @staticmethod
+    def invalidate_rejected_ids(mse, role_ids=(), parent_folder_id=None):
+        """
+        Called when Mediasite rejects a call with a 400 or 404, which is what a cached id that no
+        longer exists leads to: evicts the roles (by id) and the root folder (if it is the
+        parent_folder_id) the call used, so the next attempt looks them up again.
+        """
+        if mse.status_code() not in (requests.codes.bad_request, requests.codes.not_found):
+            return
+        for role_id in role_ids:
+            MediasiteAPI.invalidate_role_id(role_id)
+        if parent_folder_id is not None and parent_folder_id == MediasiteAPI._folder_cache.get('root_folder_id'):
+            logger.info("evicting cached Mediasite root folder {}".format(parent_folder_id))
+            MediasiteAPI.invalidate_root_folder_id()
+
+    @staticmethod
+    def is_not_found(key):
+        return MediasiteAPI._not_found_cache.get(key) is not None
+
+    @staticmethod
+    def cache_not_found(key):
+        MediasiteAPI._not_found_cache.set(key, True)
+
+    @staticmethod
+    def evict_not_found(*keys):
+        for key in keys:
+            MediasiteAPI._not_found_cache.delete(key)
+
+    @staticmethod
+    def cache_role(role_attrs):
+        role_attrs = dict(role_attrs)
+        if role_attrs.get('Name'):
+            MediasiteAPI._role_cache.set('name:{0}'.format(role_attrs['Name']), role_attrs)
+        if role_attrs.get('DirectoryEntry'):
+            MediasiteAPI._role_cache.set('directory_entry:{0}'.format(role_attrs['DirectoryEntry']), role_attrs)
+        if role_attrs.get('Id'):
+            # so a role Mediasite rejects can be evicted by its id
+            MediasiteAPI._role_cache.set('id:{0}'.format(role_attrs['Id']), role_attrs)
+
+    ######################################################
+    # Lookups
     ######################################################
-    _root_folder_id = None
+    @staticmethod
+    def get_cached_lookup(lookup):
+        """
+        What the caches know of a Lookup: (True, attributes) if the object is cached, (True, None) if
+        it recently could not be found, and (False, None) if it has to be searched for
+        """
+        if lookup.cache is not None:
+            attrs = lookup.cache.get(lookup.key)
+            if attrs is not None:
+                return True, attrs
+        if lookup.not_found_key is not None and MediasiteAPI.is_not_found(lookup.not_found_key):
+            return True, None
+        return False, None
+
+    @staticmethod
+    def remember_lookup(lookup, results):
+        """
+        Caches the outcome of a Lookup's search: the single result, or that there was none.  More
+        than one result finds nothing, or raises a ValueError for a unique Lookup.
+        :return: the attributes of the object found, or None
+        """
+        if len(results) == 1:
+            lookup.remember(results[0])
+            return results[0]
+        if not results:
+            if lookup.not_found_key is not None:
+                MediasiteAPI.cache_not_found(lookup.not_found_key)
+        elif lookup.unique:
+            raise ValueError('{0} found more than one match for filter params {1}'.format(
+                lookup.url, lookup.query.params()))
+        return None
 
+    @staticmethod
+    def check_indexed(lookup, found):
+        """
+        The object a direct get of an index hit returned, if it still matches the Lookup; otherwise
+        None, and the index entry is dropped
+        """
+        if found is not None and lookup.matches(found.to_dict()):
+            return found
+        lookup.cache.delete(lookup.key)
+        return None
+
+    @staticmethod
+    def find_one(lookup):
+        """ Runs a Lookup that is answered by the first page of results, as its filter is exact enough """
+        cached, attrs = MediasiteAPI.get_cached_lookup(lookup)
+        if not cached:
+            json = MediasiteAPI.get_mediasite_request_json(lookup.url, params=lookup.query.params())
+            # the json returned is in the oData format, and there do not appear to be any
+            # python libraries that parse oData.  we can extract the 'value' property of the list to get at the
+            # underlying json
+            attrs = MediasiteAPI.remember_lookup(lookup, lookup.decoder.decode_many(json['value']))
+        return lookup.decoder.model_class(**attrs) if attrs is not None else None
+
+    @staticmethod
+    def find_indexed(lookup, get_by_id):
+        """
+        Runs a Lookup of an indexed object (folders, catalogs).  The index matches exactly, so a hit
+        saves the search altogether once get_by_id has shown the object still matches; otherwise the
+        search results (which are indexed as they are read) are read until the object is found.
+        """
+        cached, attrs = MediasiteAPI.get_cached_lookup(lookup)
+        if attrs is not None:
+            found = MediasiteAPI.check_indexed(lookup, get_by_id(attrs['Id']))
+            if found is not None:
+                return found
+        elif cached:
+            return None
+
+        results = MediasiteAPI.query_mediasite(lookup.url, lookup.query, lookup.decoder, on_page=lookup.on_page)
+        attrs = next((result for result in results if lookup.matches(result)), None)
+        if attrs is None and lookup.not_found_key is not None:
+            MediasiteAPI.cache_not_found(lookup.not_found_key)
+        return lookup.decoder.model_class(**attrs) if attrs is not None else None
+
+    @staticmethod
+    def get_by_id(url, decoder, not_found_key=None):
+        """
+        Gets an object by its id, e.g. "Folders('<id>')".
+        :param not_found_key: if given, a 404 is remembered in MediasiteAPI._not_found_cache under it
+        :return: the api model if found; None if no object found.
+        """
+        if not_found_key is not None and MediasiteAPI.is_not_found(not_found_key):
+            return None
+        try:
+            json = MediasiteAPI.get_mediasite_request_json(url)
+        except MediasiteServiceException as mse:
+            if mse.status_code() == requests.codes.not_found:
+                if not_found_key is not None:
+                    MediasiteAPI.cache_not_found(not_found_key)
+                return None
+            raise mse
+        return decoder.build(json)
+
+    ######################################################
+    # Folders
+    ######################################################
     @staticmethod
     def get_root_folder_id():
-        if MediasiteAPI._root_folder_id is None:
+        root_folder_id = MediasiteAPI._folder_cache.get('root_folder_id')
+        if root_folder_id is None:
             url = 'Home'
             json = MediasiteAPI.get_mediasite_request_json(url)
-            serializer = HomeSerializer(data=json)
-            if serializer.is_valid(raise_exception=True):
-                MediasiteAPI._root_folder_id = Home(**serializer.validated_data).RootFolderId
-        return MediasiteAPI._root_folder_id
+            root_folder_id = home_decoder.build(json).RootFolderId
+            MediasiteAPI._folder_cache.set('root_folder_id', root_folder_id)
+        return root_folder_id
 
     @staticmethod
-    def get_folder(name, parent_folder_id, search_term=None):
+    def index_folder(folder_attrs):
+        folder_attrs = dict(folder_attrs)
+        key = '{0}:{1}'.format(folder_attrs['ParentFolderId'], folder_attrs['Name'])
+        MediasiteAPI._folder_index.set(key, folder_attrs)
+
+    @staticmethod
+    def index_folders(folders_attrs):
+        for folder_attrs in folders_attrs:
+            MediasiteAPI.index_folder(folder_attrs)
+
+    @staticmethod
+    def invalidate_folder(name, parent_folder_id):
+        MediasiteAPI._folder_index.delete('{0}:{1}'.format(parent_folder_id, name))
+
+    @staticmethod
+    def folder_lookup(name, parent_folder_id, search_term=None):
+        """ The Lookup of the folder with this exact name in the parent folder, see get_folder """
         # Search on the name being passed in, unless a search_term is provided
-        if search_term is None:
-            search_term = name
+        return Lookup('Folders', MediasiteAPI.folder_query(name if search_term is None else search_term,
+                                                           parent_folder_id),
+                      folder_decoder,
+                      cache=MediasiteAPI._folder_index,
+                      key='{0}:{1}'.format(parent_folder_id, name),
+                      not_found_key='folder:{0}:{1}'.format(parent_folder_id, name),
+                      matches=lambda attrs: attrs['Name'] == name and attrs['ParentFolderId'] == parent_folder_id,
+                      on_page=MediasiteAPI.index_folders)
 
-        folders = MediasiteAPI.get_folders(search_term, parent_folder_id)
-        folder = next((f for f in folders if f.Name == name), None)
-        return folder
+    @staticmethod
+    def folder_query(name, parent_folder_id):
+        return ODataQuery(select=select_fields(FolderSerializer), top=settings.MEDIASITE_PAGE_SIZE)\
+            .eq('ParentFolderId', parent_folder_id).eq('Name', name)
+
+    @staticmethod
+    def child_folders_query(parent_folder_id):
+        return ODataQuery(select=select_fields(FolderSerializer), top=settings.MEDIASITE_PAGE_SIZE)\
+            .eq('ParentFolderId', parent_folder_id)
+
+    @staticmethod
+    def index_child_folders(parent_folder_id, folders_attrs):
+        """
+        Indexes the child folders of a folder, and drops the index entries of the children seen by the
+        last sync that have since been deleted, moved or renamed
+        :param folders_attrs: the results of child_folders_query
+        :return: the child folders
+        """
+        # ParentFolderId is an exact match, unlike Name
+        folders = [Folder(**attrs) for attrs in folders_attrs if attrs['ParentFolderId'] == parent_folder_id]
+        MediasiteAPI.index_folders(folder.to_dict() for folder in folders)
+        children_key = 'children:{0}'.format(parent_folder_id)
+        names = [f.Name for f in folders]
+        for name in set(MediasiteAPI._folder_index.get(children_key) or ()) - set(names):
+            MediasiteAPI.invalidate_folder(name, parent_folder_id)
+        MediasiteAPI._folder_index.set(children_key, names)
+        return folders
+
+    @staticmethod
+    def remember_created_folder(folder_attrs):
+        MediasiteAPI.index_folder(folder_attrs)
+        MediasiteAPI.evict_not_found('folder:{0}:{1}'.format(folder_attrs['ParentFolderId'], folder_attrs['Name']))
+
+    @staticmethod
+    def get_folder(name, parent_folder_id, search_term=None):
+        if parent_folder_id is None:
+            parent_folder_id = MediasiteAPI.get_root_folder_id()
+        return MediasiteAPI.find_indexed(MediasiteAPI.folder_lookup(name, parent_folder_id, search_term),
+                                         MediasiteAPI.get_folder_by_id)
 
     @staticmethod
     def get_folders(name, parent_folder_id):
@@ -111,23 +413,30 @@ class MediasiteAPI:
         to be case insensitive in practice with Mediasite.  There is also some weird behavior when matching common words like
         "The" and "And" - I've observed that these words can yield no results when left as camel cased, but work fine (or are
         ignored) when lowercased. """
+        return [Folder(**attrs) for attrs in MediasiteAPI.query_folders(name, parent_folder_id)]
 
+    @staticmethod
+    def query_folders(name, parent_folder_id):
+        """ Yields the attributes of the folders get_folders finds, reading the results a page at a time """
         if parent_folder_id is None:
             parent_folder_id = MediasiteAPI.get_root_folder_id()
-        # we only search on the first 40 characters of the folder name because the API does not seem able to process
-        # longer strings
-        encoded_name = odata_encode_str(name)
-        url = 'Folders'
-        params = '$filter=ParentFolderId eq \'{0}\' and Name eq \'{1}\''.format(parent_folder_id, encoded_name)
-        json = MediasiteAPI.get_mediasite_request_json(url, params=params)
-        # the json returned is in the oData format, and there do not appear to be any
-        # python libraries that parse oData.  we can extract the 'value' property of the list to get at the
-        # underlying json
-        serializer = FolderSerializer(data=json['value'], many=True)
-        if serializer.is_valid(raise_exception=True):
-            return [Folder(**attrs) for attrs in serializer.validated_data]
-        else:
-            errors = serializer.errors
+        return MediasiteAPI.query_mediasite('Folders', MediasiteAPI.folder_query(name, parent_folder_id),
+                                            folder_decoder, on_page=MediasiteAPI.index_folders)
+
+    @staticmethod
+    def get_folder_by_id(folder_id):
+        """
+        Finds a folder by its Id.
+        :return: a mediasite.apimodels.Folder if found; None if no object found.
+        """
+        return MediasiteAPI.get_by_id("Folders('{}')".format(folder_id), folder_decoder)
+
+    @staticmethod
+    def sync_child_folders(parent_folder_id):
+        """ Reads the child folders of a folder, updating the folder index, see index_child_folders """
+        query = MediasiteAPI.child_folders_query(parent_folder_id)
+        return MediasiteAPI.index_child_folders(parent_folder_id,
+                                                MediasiteAPI.query_mediasite('Folders', query, folder_decoder))
 
     @staticmethod
     def create_folder(name, parent_folder_id, is_copy_destination=False, is_shared=False):
@@ -138,12 +447,14 @@ class MediasiteAPI:
             IsCopyDestination=is_copy_destination,
             IsShared=is_shared
         )
-        json = MediasiteAPI.post_mediasite_request_json('Folders', body=folder_to_create)
-        serializer = FolderSerializer(data=json)
-        if serializer.is_valid(raise_exception=True):
-            return Folder(**serializer.validated_data)
-        else:
-            errors = serializer.errors
+        try:
+            json = MediasiteAPI.post_mediasite_request_json('Folders', body=folder_to_create)
+        except MediasiteServiceException as mse:
+            MediasiteAPI.invalidate_rejected_ids(mse, parent_folder_id=parent_folder_id)
+            raise
+        attrs = folder_decoder.decode(json)
+        MediasiteAPI.remember_created_folder(attrs)
+        return Folder(**attrs)
 
     @staticmethod
     def get_or_create_folder(name, parent_folder_id, search_term=None, is_copy_destination=False, is_shared=False):
@@ -152,7 +463,14 @@ class MediasiteAPI:
         if parent_folder_id is not None:
             folder = MediasiteAPI.get_folder(name, parent_folder_id, search_term)
             if not folder:
-                folder = MediasiteAPI.create_folder(name, parent_folder_id, is_copy_destination, is_shared)
+                # the courses of a new term all miss its folders at once, and are provisioned by
+                # several threads and workers; only one of them may create each folder
+                with shared_lock('mediasite:folder:{0}:{1}'.format(parent_folder_id, name)):
+                    # a miss remembered before another worker created the folder is not to be trusted
+                    MediasiteAPI.evict_not_found('folder:{0}:{1}'.format(parent_folder_id, name))
+                    folder = MediasiteAPI.get_folder(name, parent_folder_id, search_term)
+                    if not folder:
+                        folder = MediasiteAPI.create_folder(name, parent_folder_id, is_copy_destination, is_shared)
         return folder
 
     ######################################################
@@ -166,29 +484,69 @@ class MediasiteAPI:
         return catalog
 
     @staticmethod
-    def get_catalog(name, course_folder_id, search_term=None):
-        """ See oDAta note above in `get_folders` method """
+    def index_catalog(catalog_attrs):
+        catalog_attrs = dict(catalog_attrs)
+        MediasiteAPI._catalog_index.set(catalog_attrs['LinkedFolderId'], catalog_attrs)
+
+    @staticmethod
+    def index_catalogs(catalogs_attrs):
+        for catalog_attrs in catalogs_attrs:
+            MediasiteAPI.index_catalog(catalog_attrs)
 
+    @staticmethod
+    def catalog_lookup(name, course_folder_id, search_term=None):
+        """ The Lookup of the catalog linked to the course folder, see get_catalog """
         # Search on the name being passed in, unless a search_term is provided
-        if search_term is None:
-            search_term = name
+        return Lookup('Catalogs', MediasiteAPI.catalog_query(name if search_term is None else search_term),
+                      catalog_decoder,
+                      cache=MediasiteAPI._catalog_index,
+                      key=course_folder_id,
+                      matches=lambda attrs: attrs['LinkedFolderId'] == course_folder_id,
+                      on_page=MediasiteAPI.index_catalogs)
 
-        catalogs = MediasiteAPI.get_catalogs(search_term)
-        catalog = next((c for c in catalogs if c.LinkedFolderId == course_folder_id), None)
+    @staticmethod
+    def catalog_query(name=None):
+        query = ODataQuery(select=select_fields(CatalogSerializer), top=settings.MEDIASITE_PAGE_SIZE)
+        if name is not None:
+            query.eq('Name', name)
+        return query
 
-        return catalog
+    @staticmethod
+    def get_catalog(name, course_folder_id, search_term=None):
+        """ See oDAta note above in `get_folders` method """
+        return MediasiteAPI.find_indexed(MediasiteAPI.catalog_lookup(name, course_folder_id, search_term),
+                                         MediasiteAPI.get_catalog_by_id)
+
+    @staticmethod
+    def get_indexed_catalog(course_folder_id):
+        """
+        The catalog the catalog index has for the folder, without asking Mediasite whether it still
+        exists (see get_catalog for that).
+        :return: a mediasite.apimodels.Catalog if indexed; None otherwise.
+        """
+        catalog_attrs = MediasiteAPI._catalog_index.get(course_folder_id)
+        return Catalog(**catalog_attrs) if catalog_attrs is not None else None
+
+    @staticmethod
+    def get_catalog_by_id(catalog_id):
+        """
+        Finds a catalog by its Id.
+        :return: a mediasite.apimodels.Catalog if found; None if no object found.
+        """
+        return MediasiteAPI.get_by_id("Catalogs('{}')".format(catalog_id), catalog_decoder)
 
     @staticmethod
     def get_catalogs(name):
-        url = 'Catalogs'
-        encoded_name = odata_encode_str(name)
-        params = '$filter=Name eq \'{0}\''.format(encoded_name)
-        json = MediasiteAPI.get_mediasite_request_json(url, params=params)
-        serializer = CatalogSerializer(data=json['value'], many=True)
-        if serializer.is_valid(raise_exception=True):
-            return [Catalog(**attrs) for attrs in serializer.validated_data]
-        else:
-            errors = serializer.errors
+        return [Catalog(**attrs) for attrs in MediasiteAPI.query_catalogs(name)]
+
+    @staticmethod
+    def query_catalogs(name=None):
+        """
+        Yields the attributes of the catalogs whose names contain `name` (or of every catalog), a page
+        at a time, adding them to the catalog index
+        """
+        return MediasiteAPI.query_mediasite('Catalogs', MediasiteAPI.catalog_query(name), catalog_decoder,
+                                            on_page=MediasiteAPI.index_catalogs)
 
     @staticmethod
     def create_catalog(friendly_name, catalog_name, course_folder_id):
@@ -199,24 +557,66 @@ class MediasiteAPI:
             LimitSearchToCatalog=True
         )
         json = MediasiteAPI.post_mediasite_request_json('Catalogs', catalog_to_create)
-        serializer = CatalogSerializer(data=json)
-        if serializer.is_valid(raise_exception=True):
-            return Catalog(**serializer.validated_data)
-        else:
-            errors = serializer.errors
+        attrs = catalog_decoder.decode(json)
+        MediasiteAPI.index_catalog(attrs)
+        return Catalog(**attrs)
 
     @staticmethod
-    def set_catalog_settings(catalog_id, show_date, show_time, items_per_page):
-        catalog_settings = dict(
-            ShowTablePresentationDate= show_date,
-            ShowTablePresentationTime = show_time,
-            ShowCardPresentationDate = show_date,
-            ShowCardPresentationTime = show_time,
-            PresentationsPerPage = items_per_page,
-            AllowLoginControls = False
+    def get_catalog_settings(catalog_id):
+        """ The catalog's settings, as a dict of the CatalogSetting attributes; cached, see set_catalog_settings """
+        catalog_settings = MediasiteAPI._catalog_settings_cache.get(catalog_id)
+        if catalog_settings is None:
+            json = MediasiteAPI.get_mediasite_request_json(MediasiteAPI.get_catalog_settings_url(catalog_id))
+            catalog_settings = MediasiteAPI.cache_catalog_settings(catalog_id, catalog_setting_decoder.decode(json))
+        return catalog_settings
+
+    @staticmethod
+    def get_catalog_settings_url(catalog_id):
+        return 'Catalogs(\'{0}\')/Settings'.format(catalog_id)
+
+    @staticmethod
+    def cache_catalog_settings(catalog_id, catalog_settings):
+        catalog_settings = dict(catalog_settings)
+        MediasiteAPI._catalog_settings_cache.set(catalog_id, catalog_settings)
+        return catalog_settings
+
+    @staticmethod
+    def invalidate_catalog_settings(catalog_id):
+        MediasiteAPI._catalog_settings_cache.delete(catalog_id)
+
+    @staticmethod
+    def get_catalog_settings_changes(catalog_settings, show_date, show_time, items_per_page):
+        """ The settings that need to change for the catalog to show the given date, time and items per page """
+        wanted = dict(
+            ShowTablePresentationDate=show_date,
+            ShowTablePresentationTime=show_time,
+            ShowCardPresentationDate=show_date,
+            ShowCardPresentationTime=show_time,
+            PresentationsPerPage=items_per_page,
+            AllowLoginControls=False
         )
-        url = 'Catalogs(\'{0}\')/Settings'.format(catalog_id)
-        MediasiteAPI.patch_mediasite_request_json(url, catalog_settings)
+        return dict((k, v) for k, v in wanted.items() if catalog_settings.get(k) != v)
+
+    @staticmethod
+    def set_catalog_settings(catalog_id, show_date, show_time, items_per_page):
+        """
+        Patches only the catalog settings that differ from the catalog's current ones, which are read
+        once and then cached as they are written.  Settings changed outside of this app go unnoticed
+        for up to settings.MEDIASITE_CATALOG_SETTINGS_CACHE_TIMEOUT.
+        :return: whether any settings were written
+        """
+        catalog_settings = MediasiteAPI.get_catalog_settings(catalog_id)
+        changes = MediasiteAPI.get_catalog_settings_changes(catalog_settings, show_date, show_time, items_per_page)
+        if not changes:
+            return False
+        try:
+            MediasiteAPI.patch_mediasite_request_json(MediasiteAPI.get_catalog_settings_url(catalog_id), changes)
+        except MediasiteServiceException:
+            # the cached settings may be why the patch failed
+            MediasiteAPI.invalidate_catalog_settings(catalog_id)
+            raise
+        MediasiteAPI.cache_catalog_settings(catalog_id, dict(catalog_settings, **changes))
+        return True
 
     ######################################################
     # Modules
@@ -237,9 +637,13 @@ class MediasiteAPI:
             module_to_create['Associations'] = [catalog_mediasite_id]
         module_json = MediasiteAPI.post_mediasite_request_json('Modules',
                                                                module_to_create)
-        serializer = ModuleSerializer(data=module_json)
-        if serializer.is_valid(raise_exception=True):
-            return Module(**serializer.validated_data)
+        module = module_decoder.build(module_json)
+        MediasiteAPI.remember_created_module(module)
+        return module
+
+    @staticmethod
+    def remember_created_module(module):
+        MediasiteAPI.evict_not_found('module:{0}'.format(module.Id), 'module_id:{0}'.format(module.ModuleId))
 
     @staticmethod
     def get_module(mediasite_id=None, module_id=None):
@@ -261,16 +665,17 @@ class MediasiteAPI:
         Finds a module by its Id.
         :return: a mediasite.apimodels.Module if found; None if no object found.
         """
-        url = "Modules('{}')".format(mediasite_id)
-        try:
-            module_json = MediasiteAPI.get_mediasite_request_json(url)
-        except MediasiteServiceException as mse:
-            if mse.status_code() == requests.codes.not_found:
-                return None
-            raise mse
-        serializer = ModuleSerializer(data=module_json)
-        if serializer.is_valid(raise_exception=True):
-            return Module(**serializer.validated_data)
+        return MediasiteAPI.get_by_id("Modules('{}')".format(mediasite_id), module_decoder,
+                                      not_found_key='module:{0}'.format(mediasite_id))
+
+    @staticmethod
+    def module_lookup(module_id):
+        # this is equivalent to a 'contains' search, as this is a
+        # mediasite-search-backed filter endpoint.  Only a single match is used, so two are enough to tell.
+        return Lookup('Modules', ODataQuery(select=select_fields(ModuleSerializer), top=2).eq('ModuleId', module_id),
+                      module_decoder,
+                      not_found_key='module_id:{0}'.format(module_id),
+                      unique=True)
 
     @staticmethod
     def get_module_by_module_id(module_id):
@@ -279,20 +684,7 @@ class MediasiteAPI:
         :return: a mediasite.apimodels.Module if found; None if no object found;
          throws an error if multiple objects found.
         """
-        url = 'Modules'
-        encoded_module_id = odata_encode_str(module_id)
-        # this is equivalent to a 'contains' search, as this is a
-        # mediasite-search-backed filter endpoint
-        params = "$filter=ModuleId eq '{0}'".format(encoded_module_id)
-        module_json = MediasiteAPI.get_mediasite_request_json(url, params=params)
-        if module_json['odata.count'] == "0":
-            return None
-        if module_json['odata.count'] != "1":
-            raise ValueError(('get_module_by_module_id() found more than one '
-                              'Module for filter params {}').format(params))
-        serializer = ModuleSerializer(data=module_json['value'], many=True)
-        if serializer.is_valid(raise_exception=True):
-            return Module(**serializer.validated_data[0])
+        return MediasiteAPI.find_one(MediasiteAPI.module_lookup(module_id))
 
     @staticmethod
     def add_module_association_by_mediasite_id(module_mediasite_id,
@@ -321,43 +713,42 @@ class MediasiteAPI:
         # the json returned is in the oData format, and there do not appear to be any
         # python libraries that parse oData.  we can extract the 'value' property of the list to get at the
         # underlying json
-        serializer = ResourcePermissionSerializer(data=json)
-        if serializer.is_valid(raise_exception=True):
-            return ResourcePermission(**serializer.validated_data)
-        else:
-            errors = serializer.errors
+        return resource_permission_decoder.build(json)
 
     @staticmethod
     def assign_permissions_to_folder(folder_id, folder_permissions):
+        """
+        Posts the folder permissions to Mediasite, unless they are the same as those read by
+        get_folder_permissions, as they usually are when a course is provisioned again.
+        :return: whether the permissions were written
+        """
+        if not folder_permissions.has_changes():
+            logger.debug("permissions for folder {} are unchanged".format(folder_id))
+            return False
+        added, changed, removed = folder_permissions.diff()
+        logger.debug("updating permissions for folder {}: {} roles added, {} changed and {} removed".format(
+            folder_id, len(added), len(changed), len(removed)))
         url = 'Folders(\'{0}\')/UpdatePermissions'.format(folder_id)
-        # Need to change the folder_permissions object into a dictionary object that can be cast to json
-        # when posting to the Mediasite API
-        folder_permissions_as_dict = folder_permissions.__dict__
-        folder_permissions_as_dict['Permissions'] = [ac.__dict__ for ac in folder_permissions.Permissions]
         # this call returns a status object that is probably of no use to us
-        MediasiteAPI.post_mediasite_request_json(url, body=folder_permissions_as_dict)
+        try:
+            MediasiteAPI.post_mediasite_request_json(url, body=folder_permissions.to_dict())
+        except MediasiteServiceException as mse:
+            MediasiteAPI.invalidate_rejected_ids(mse, role_ids=added + changed)
+            raise
+        folder_permissions.mark_saved()
+        return True
 
     @staticmethod
     def get_folder_permissions(folder_id):
-        folder_permissions = FolderPermission()
         permissions_for_folder = MediasiteAPI.get_resource_permissions(folder_id)
-        if permissions_for_folder is not None:
-            folder_permissions.Owner = permissions_for_folder.Owner
-            folder_permissions.Permissions = permissions_for_folder.AccessControlList
-        return folder_permissions
+        if permissions_for_folder is None:
+            return FolderPermission()
+        return FolderPermission(Owner=permissions_for_folder.Owner,
+                                Permissions=permissions_for_folder.AccessControlList)
 
     @staticmethod
     def update_folder_permissions(folder_permissions, role, permission_mask):
-        existing_permission = next((fp for fp in folder_permissions.Permissions if fp.RoleId == role.Id), None)
-        if existing_permission is not None:
-            if permission_mask == MediasiteAPI.NO_ACCESS_PERMISSION_FLAG:
-                folder_permissions.Permissions = [fp for fp in folder_permissions.Permissions if fp.RoleId != role.Id]
-            else:
-                existing_permission.PermissionMask = permission_mask
-        elif permission_mask != MediasiteAPI.NO_ACCESS_PERMISSION_FLAG:
-            folder_permissions.Permissions.append(
-                AccessControl(RoleId = role.Id, PermissionMask = permission_mask)
-            )
+        folder_permissions.set(role.Id, permission_mask)
         return folder_permissions
 
     ######################################################
@@ -370,45 +761,35 @@ class MediasiteAPI:
             DirectoryEntry = directory_entry
         )
         json = MediasiteAPI.post_mediasite_request_json('Roles', body=role_to_create)
-        serializer = RoleSerializer(data=json)
-        if serializer.is_valid(raise_exception=True):
-            return Role(**serializer.validated_data)
-        else:
-            errors = serializer.errors
+        attrs = role_decoder.decode(json)
+        MediasiteAPI.remember_created_role(attrs)
+        return Role(**attrs)
+
+    @staticmethod
+    def remember_created_role(role_attrs):
+        MediasiteAPI.cache_role(role_attrs)
+        MediasiteAPI.evict_not_found('role:name:{0}'.format(role_attrs['Name']),
+                                     'role:directory_entry:{0}'.format(role_attrs['DirectoryEntry']))
+
+    @staticmethod
+    def role_lookup(field, value):
+        """ The Lookup of the role whose Name or DirectoryEntry (`field`) is `value` """
+        key = '{0}:{1}'.format('name' if field == 'Name' else 'directory_entry', value)
+        # only a single match is used, so two are enough to tell
+        return Lookup('Roles', ODataQuery(select=select_fields(RoleSerializer), top=2).eq(field, value),
+                      role_decoder,
+                      cache=MediasiteAPI._role_cache,
+                      key=key,
+                      not_found_key='role:{0}'.format(key),
+                      remember=MediasiteAPI.cache_role)
 
     @staticmethod
     def get_role_by_name(role_name):
-        url = 'Roles'
-        encoded_name = odata_encode_str(role_name)
-        params = '$filter=Name eq \'{0}\''.format(encoded_name)
-        json = MediasiteAPI.get_mediasite_request_json(url, params=params)
-        # the json returned is in the oData format, and there do not appear to be any
-        # python libraries that parse oData.  we can extract the 'value' property of the list to get at the
-        # underlying json
-        serializer = RoleSerializer(data=json['value'], many=True)
-        if serializer.is_valid(raise_exception=True):
-            roles = [Role(**attrs) for attrs in serializer.validated_data]
-            if len(roles) == 1:
-                return roles[0]
-        else:
-            errors = serializer.errors
+        return MediasiteAPI.find_one(MediasiteAPI.role_lookup('Name', role_name))
 
     @staticmethod
     def get_role_by_directory_entry(directory_entry):
-        url = 'Roles'
-        encoded_dir_entry = odata_encode_str(directory_entry)
-        params='$filter=DirectoryEntry eq \'{0}\''.format(encoded_dir_entry)
-        json = MediasiteAPI.get_mediasite_request_json(url, params=params)
-        # the json returned is in the oData format, and there do not appear to be any
-        # python libraries that parse oData.  we can extract the 'value' property of the list to get at the
-        # underlying json
-        serializer = RoleSerializer(data=json['value'], many=True)
-        if serializer.is_valid(raise_exception=True):
-            roles = [Role(**attrs) for attrs in serializer.validated_data]
-            if len(roles) == 1:
-                return roles[0]
-        else:
-            errors = serializer.errors
+        return MediasiteAPI.find_one(MediasiteAPI.role_lookup('DirectoryEntry', directory_entry))
 
     @staticmethod
     def get_or_create_role(role_name, directory_entry):
@@ -429,30 +810,154 @@ class MediasiteAPI:
     ######################################################
     # User Profiles
     ######################################################
+    _user_profile_cache = TieredCache('mediasite:user_profiles', 'MEDIASITE_USER_PROFILE_CACHE_TIMEOUT')
+
+    @staticmethod
+    def cache_user_profile(email_address, user_profile_attrs):
+        MediasiteAPI._user_profile_cache.set(email_address.lower(), dict(user_profile_attrs))
+
+    @staticmethod
+    def user_profile_lookup(email_address):
+        return Lookup('UserProfiles',
+                      ODataQuery(select=select_fields(UserProfileSerializer), top=2).endswith('Email', email_address),
+                      user_profile_decoder,
+                      cache=MediasiteAPI._user_profile_cache,
+                      key=email_address.lower(),
+                      not_found_key='user_profile:{0}'.format(email_address.lower()))
+
     @staticmethod
     def get_user_by_email_address(email_address):
-        url = 'UserProfiles'
-        encoded_email = odata_encode_str(email_address)
-        params='$filter=endswith(Email, \'{0}\')'.format(encoded_email)
-        json = MediasiteAPI.get_mediasite_request_json(url, params=params)
-        # the json returned is in the oData format, and there do not appear to be any
-        # python libraries that parse oData.  we can extract the 'value' property of the list to get at the
-        # underlying json
-        serializer = UserProfileSerializer(data=json['value'], many=True)
-        if serializer.is_valid(raise_exception=True):
-            user_profiles = [UserProfile(**attrs) for attrs in serializer.validated_data]
-            if len(user_profiles) == 1:
-                return user_profiles[0]
-        else:
-            errors = serializer.errors
+        return MediasiteAPI.find_one(MediasiteAPI.user_profile_lookup(email_address))
+
+    @staticmethod
+    def user_profiles_query(email_filter):
+        """ The query for the user profiles matching one of get_email_address_filters' filters """
+        return ODataQuery(select=select_fields(UserProfileSerializer), top=settings.MEDIASITE_PAGE_SIZE)\
+            .where(email_filter)
+
+    @staticmethod
+    def get_users_by_email_address(email_addresses):
+        """
+        Looks up many user profiles at once.  The emails are combined into `endswith(...) or ...`
+        filters, in chunks that keep the url under settings.MEDIASITE_MAX_FILTER_LENGTH, and the
+        chunks are requested concurrently.  As with get_user_by_email_address, an email only
+        resolves to a profile if exactly one profile's email ends with it.
+        :return: a dict of email address to UserProfile, for the emails that were found
+        """
+        user_profiles, missing = MediasiteAPI.get_cached_users_by_email_address(email_addresses)
+        chunks = MediasiteAPI.get_email_address_filters(missing)
+
+        def get_user_profile_attrs(email_filter):
+            query = MediasiteAPI.user_profiles_query(email_filter)
+            return list(MediasiteAPI.query_mediasite('UserProfiles', query, user_profile_decoder))
+
+        found = list()
+        if chunks:
+            with ThreadPoolExecutor(max_workers=min(len(chunks), settings.MEDIASITE_MAX_CONCURRENT_REQUESTS)) as executor:
+                for attrs_list in executor.map(get_user_profile_attrs, chunks):
+                    found.extend(attrs_list)
+
+        user_profiles.update(MediasiteAPI.match_user_profiles(missing, found))
+        return user_profiles
+
+    @staticmethod
+    def get_cached_users_by_email_address(email_addresses):
+        """
+        :return: a dict of email address to the cached UserProfile, and a list of the (distinct)
+         email addresses that are not cached.  Addresses recently found to have no profile are in
+         neither.
+        """
+        user_profiles = dict()
+        missing = list()
+        for email_address in email_addresses:
+            user_profile_attrs = MediasiteAPI._user_profile_cache.get(email_address.lower())
+            if user_profile_attrs is not None:
+                user_profiles[email_address] = UserProfile(**user_profile_attrs)
+            elif email_address not in missing and \
+                    not MediasiteAPI.is_not_found('user_profile:{0}'.format(email_address.lower())):
+                missing.append(email_address)
+        return user_profiles, missing
+
+    @staticmethod
+    def get_email_address_filters(email_addresses):
+        """
+        Combines the emails into `endswith(...) or ...` filters, each short enough to keep the url
+        under settings.MEDIASITE_MAX_FILTER_LENGTH
+        """
+        chunks = list()
+        clauses = list()
+        for email_address in email_addresses:
+            clause = endswith_clause('Email', email_address)
+            if clauses and len(' or '.join(clauses + [clause])) > settings.MEDIASITE_MAX_FILTER_LENGTH:
+                chunks.append(' or '.join(clauses))
+                clauses = list()
+            clauses.append(clause)
+        if clauses:
+            chunks.append(' or '.join(clauses))
+        return chunks
+
+    @staticmethod
+    def match_user_profiles(email_addresses, found):
+        """
+        Picks the profile of each email out of the profiles found with get_email_address_filters,
+        caching them, and the emails no profile's email ends with.  An email only matches if exactly
+        one profile's email ends with it.
+        :param found: the validated attributes of the profiles found
+        :return: a dict of email address to UserProfile, for the emails that matched
+        """
+        user_profiles = dict()
+        for email_address in email_addresses:
+            matches = [attrs for attrs in found
+                       if (attrs.get('Email') or '').lower().endswith(email_address.lower())]
+            if len(matches) == 1:
+                MediasiteAPI.cache_user_profile(email_address, matches[0])
+                user_profiles[email_address] = UserProfile(**matches[0])
+            elif not matches:
+                MediasiteAPI.cache_not_found('user_profile:{0}'.format(email_address.lower()))
+        return user_profiles
+
+    @staticmethod
+    def get_or_create_users_by_email_address(users):
+        """
+        Finds the user profiles for many users at once (see get_users_by_email_address), creating
+        only the ones that do not exist yet.
+        :param users: a list of (email address, display name) tuples
+        :return: a dict of email address to UserProfile
+        """
+        user_profiles = MediasiteAPI.get_users_by_email_address([email for email, name in users])
+        users_to_create = MediasiteAPI.get_users_to_create(users, user_profiles)
+        if users_to_create:
+            with ThreadPoolExecutor(max_workers=min(len(users_to_create),
+                                                    settings.MEDIASITE_MAX_CONCURRENT_REQUESTS)) as executor:
+                created = executor.map(MediasiteAPI.create_user, users_to_create)
+                for user_to_create, user_profile in zip(users_to_create, created):
+                    user_profiles[user_to_create.Email] = user_profile
+        return user_profiles
+
+    @staticmethod
+    def get_users_to_create(users, user_profiles):
+        """ The UserProfiles to create for the (email address, display name) users not in user_profiles """
+        users_to_create = list()
+        for email_address, display_name in users:
+            if email_address not in user_profiles and email_address not in [u.Email for u in users_to_create]:
+                users_to_create.append(UserProfile(UserName=email_address,
+                                                   DisplayName=display_name,
+                                                   Email=email_address,
+                                                   Activated=True))
+        return users_to_create
 
     @staticmethod
     def create_user(user):
         url = 'UserProfiles'
-        json = MediasiteAPI.post_mediasite_request_json(url=url, body=user.__dict__)
-        serializer = UserProfileSerializer(data=json)
-        if serializer.is_valid(raise_exception=True):
-            return UserProfile(**serializer.validated_data)
+        json = MediasiteAPI.post_mediasite_request_json(url=url, body=user.to_dict())
+        attrs = user_profile_decoder.decode(json)
+        MediasiteAPI.remember_created_user(user.Email, attrs)
+        return UserProfile(**attrs)
+
+    @staticmethod
+    def remember_created_user(email_address, user_profile_attrs):
+        MediasiteAPI.cache_user_profile(email_address, user_profile_attrs)
+        MediasiteAPI.evict_not_found('user_profile:{0}'.format(email_address.lower()))
 
     @staticmethod
     def convert_user_profile_to_role_id(user_profile_id):
@@ -461,6 +966,27 @@ class MediasiteAPI:
     ######################################################
     # Generic API Methods
     ######################################################
+    @staticmethod
+    def query_mediasite(url, query, decoder, on_page=None):
+        """
+        Yields the validated attributes of every record an ODataQuery matches, reading the results
+        a page at a time (see ODataQuery.next_page_params) so large results are neither truncated
+        to the first page nor held in memory at once.
+        :param on_page: if given, called with the attributes of each page's records as it is read
+        """
+        params = query.params()
+        fetched = 0
+        while params is not None:
+            json = MediasiteAPI.get_mediasite_request_json(url, params=params)
+            page = json.get('value') or []
+            page_attrs = decoder.decode_many(page)
+            if on_page is not None:
+                on_page(page_attrs)
+            for attrs in page_attrs:
+                yield attrs
+            fetched += len(page)
+            params = query.next_page_params(json, fetched)
+
     @staticmethod
     def get_mediasite_request_json(url, params=None):
         return MediasiteAPI.mediasite_request_json(
@@ -484,21 +1010,24 @@ class MediasiteAPI:
     @staticmethod
     def mediasite_request_json(url, method, body=None, params=None):
         start_time = time.time()
+        full_url = MediasiteAPI.get_mediasite_url(url)
+        r = None
         try:
             mediasite_session = MediasiteAPI.get_api_session()
-            r = mediasite_session.request(
-                method,
-                MediasiteAPI.get_mediasite_url(url),
-                params=params,
-                data=body)
+            r = send_request(method,
+                             lambda: mediasite_session.request(method, full_url, params=params, data=body),
+                             MediasiteAPI.get_rate_limits(full_url))
             r.raise_for_status()
         except Exception as e:
             elapsed_secs = time.time() - start_time
+            record_call('mediasite', method, full_url, elapsed_secs, error=True,
+                        bytes_received=len(r.content or b'') if r is not None else 0)
             logger.info("tried to make a {} call to {} via requests in "
                         "{:.3f}s".format(method, url, elapsed_secs))
             raise MediasiteServiceException(mediasite_exception=e)
 
         elapsed_secs = time.time() - start_time
+        record_call('mediasite', method, full_url, elapsed_secs, bytes_received=len(r.content or b''))
         logger.debug("made a {} call to {} via requests in {:.3f}s".format(
             r.request.method, r.request.url, elapsed_secs))
 
@@ -1,77 +1,91 @@
-from django.db import models
+from collections import OrderedDict
 
-# Create your models here.
+from mediasite_provisioning.apimodels import ApiModel
 
-class BaseSerializedModel(models.Model):
-    Id = models.TextField(blank=True, null=True)
 
-    def __init__(self, **kwargs):
-        self.__dict__.update(kwargs)
+class BaseSerializedModel(ApiModel):
+    __slots__ = ('Id',)
 
 class AccessControl(BaseSerializedModel):
-    RoleId = models.TextField()
-    PermissionMask = models.IntegerField()
+    __slots__ = ('RoleId', 'PermissionMask')
 
 class Catalog(BaseSerializedModel):
-    LinkedFolderId = models.TextField()
-    Name = models.TextField()
-    FriendlyName = models.TextField(null=True, blank=True)
-    CatalogUrl = models.TextField()
-    LimitSearchToCatalog = models.BooleanField()
+    __slots__ = ('LinkedFolderId', 'Name', 'FriendlyName', 'CatalogUrl', 'LimitSearchToCatalog')
 
 class CatalogSetting(BaseSerializedModel):
-    PresentationsPerPage = models.IntegerField()
-    ShowCardPresentationDate = models.BooleanField()
-    ShowCardPresentationTime = models.BooleanField()
-    ShowTablePresentationDate = models.BooleanField()
-    ShowTablePresentationTime = models.BooleanField()
-    AllowLoginControls = models.BooleanField()
+    __slots__ = ('PresentationsPerPage', 'ShowCardPresentationDate', 'ShowCardPresentationTime',
+                 'ShowTablePresentationDate', 'ShowTablePresentationTime', 'AllowLoginControls')
 
 class Folder(BaseSerializedModel):
-    Name = models.TextField()
-    Owner = models.TextField()
-    Description = models.TextField(blank=True, null=True)
-    CreationDate = models.DateTimeField()
-    LastModified = models.DateTimeField()
-    ParentFolderId = models.TextField()
-    Recycled = models.BooleanField()
-    Type = models.TextField()
-    IsShared = models.BooleanField()
-    IsCopyDestination = models.BooleanField()
-    IsReviewEditApproveEnabled = models.BooleanField()
-
-class FolderPermission(BaseSerializedModel):
-    Owner = models.TextField()
-    Permissions = list()
+    __slots__ = ('Name', 'Owner', 'Description', 'CreationDate', 'LastModified', 'ParentFolderId', 'Recycled',
+                 'Type', 'IsShared', 'IsCopyDestination', 'IsReviewEditApproveEnabled')
+
+class FolderPermission(object):
+    """
+    The permissions to post to a folder's UpdatePermissions, kept as the permission mask of each
+    RoleId so that a role is added, changed or removed in constant time.  The permissions it was
+    created with are remembered, so `diff` tells what has changed since they were read from Mediasite.
+    """
+    __slots__ = ('Owner', '_masks', '_saved_masks')
+
+    def __init__(self, Owner=None, Permissions=()):
+        self.Owner = Owner
+        self._masks = OrderedDict((ac.RoleId, ac.PermissionMask) for ac in Permissions)
+        self._saved_masks = dict(self._masks)
+
+    @property
+    def Permissions(self):
+        return [AccessControl(RoleId=role_id, PermissionMask=mask) for role_id, mask in self._masks.items()]
+
+    def get(self, role_id):
+        return self._masks.get(role_id)
+
+    def set(self, role_id, permission_mask):
+        """ Gives the role the permission mask, or removes the role for a mask of 0 (no access) """
+        if permission_mask:
+            self._masks[role_id] = permission_mask
+        else:
+            self._masks.pop(role_id, None)
+
+    def diff(self):
+        """ The RoleIds (added, changed, removed) since the permissions were read or last saved """
+        added = [r for r in self._masks if r not in self._saved_masks]
+        changed = [r for r, mask in self._masks.items() if r in self._saved_masks and self._saved_masks[r] != mask]
+        removed = [r for r in self._saved_masks if r not in self._masks]
+        return added, changed, removed
+
+    def has_changes(self):
+        return self._masks != self._saved_masks
+
+    def mark_saved(self):
+        self._saved_masks = dict(self._masks)
+
+    def to_dict(self):
+        """ The body to post to UpdatePermissions """
+        permissions = dict(Permissions=[ac.to_dict() for ac in self.Permissions])
+        if self.Owner is not None:
+            permissions['Owner'] = self.Owner
+        return permissions
 
 class Module(BaseSerializedModel):
-    ModuleId = models.TextField()
-    Name = models.TextField()
-    Associations = list()
+    __slots__ = ('ModuleId', 'Name', 'Associations')
+    _defaults = {'Associations': list}
 
 class ResourcePermission(BaseSerializedModel):
-    Owner = models.TextField()
-    InheritPermissions = models.BooleanField()
-    AccessControlList = list()
+    __slots__ = ('Owner', 'InheritPermissions', 'AccessControlList')
+    _defaults = {'AccessControlList': list}
 
     def __init__(self, **kwargs):
         # ResourcePermissions has a hierarchy which needs to be manually initialized
-        self.__dict__.update(kwargs)
-        access_control_list = kwargs['AccessControlList']
-        if access_control_list:
-            self.AccessControlList = [AccessControl(**attrs) for attrs in access_control_list]
+        self._init_attributes(**kwargs)
+        self.AccessControlList = [AccessControl(**attrs) if isinstance(attrs, dict) else attrs
+                                  for attrs in self.AccessControlList or ()]
 
 class Role(BaseSerializedModel):
-    Name = models.TextField()
-    Description = models.TextField(null=True, blank=True)
-    DirectoryEntry = models.TextField(null=True, blank=True)
+    __slots__ = ('Name', 'Description', 'DirectoryEntry')
 
 class UserProfile(BaseSerializedModel):
-    UserName = models.TextField()
-    DisplayName = models.TextField()
-    Email = models.EmailField()
-    Activated = models.BooleanField()
-    TimeZone = models.IntegerField()
+    __slots__ = ('UserName', 'DisplayName', 'Email', 'Activated', 'TimeZone')
 
 class Home(BaseSerializedModel):
-    RootFolderId = models.TextField()
+    __slots__ = ('RootFolderId',)
@@ -0,0 +1,288 @@
+from __future__ import unicode_literals
+
+import datetime
+import re
+from urllib.parse import urlencode
+import uuid
+
+from mediasite_provisioning.fakeserver import FakeResponse, FakeServer
+
+_API_PATH = 'Mediasite/Api/v1/'
+_KEY = r"\('(?P<id>[^']*)'\)"
+
+# one comparison of an OData $filter, and what joins it to the next one
+_FILTER_CLAUSE = re.compile(r"\s*(?:(?P<field>\w+) eq '(?P<value>(?:[^']|'')*)'"
+                            r"|(?P<function>endswith|startswith)\((?P<function_field>\w+),\s*"
+                            r"'(?P<function_value>(?:[^']|'')*)'\))")
+_FILTER_CONNECTOR = re.compile(r'\s+(and|or)\s+')
+
+
+def parse_filter(odata_filter):
+    """
+    Parses the subset of OData $filter expressions MediasiteAPI sends (eq, endswith and startswith
+    on string fields, joined by `and`/`or`) into a list of alternatives, each a list of
+    (operator, field, value) that must all match.
+    :raises ValueError: for anything else
+    """
+    alternatives = [[]]
+    position = 0
+    while True:
+        match = _FILTER_CLAUSE.match(odata_filter, position)
+        if match is None:
+            raise ValueError('unsupported $filter: {0}'.format(odata_filter))
+        if match.group('field'):
+            clause = ('eq', match.group('field'), match.group('value'))
+        else:
+            clause = (match.group('function'), match.group('function_field'), match.group('function_value'))
+        alternatives[-1].append((clause[0], clause[1], clause[2].replace("''", "'")))
+        position = match.end()
+        connector = _FILTER_CONNECTOR.match(odata_filter, position)
+        if connector is None:
+            break
+        if connector.group(1) == 'or':
+            alternatives.append([])
+        position = connector.end()
+    if odata_filter[position:].strip():
+        raise ValueError('unsupported $filter: {0}'.format(odata_filter))
+    return alternatives
+
+
+def matches_filter(record, alternatives, search_backed=False):
+    """
+    Whether a record matches a parsed $filter, the way Mediasite evaluates it: string comparisons
+    ignore case and, for search backed resources (folders, catalogs, modules), `eq` behaves like
+    "contains"
+    """
+    def matches(operator, field, value):
+        actual = '' if record.get(field) is None else str(record[field]).lower()
+        value = value.lower()
+        if operator == 'endswith':
+            return actual.endswith(value)
+        if operator == 'startswith':
+            return actual.startswith(value)
+        return value in actual if search_backed else value == actual
+
+    return any(all(matches(*clause) for clause in alternative) for alternative in alternatives)
+
+
+class FakeMediasiteServer(FakeServer):
+    """
+    A stand-in for the Mediasite OData API, implementing the resources MediasiteAPI uses: Home,
+    Folders, Catalogs (and their Settings), Modules, Roles, UserProfiles and ResourcePermissions.
+    Queries support $filter (with Mediasite's case insensitive, and for search backed resources
+    contains-like, `eq`; see matches_filter), $select, $top and $skip, and report odata.count and
+    an odata.nextLink while there are more results.  Errors are returned in the odata.error format.
+
+    The roles provisioning looks up (AuthenticatedUsers, Analytics Application) exist from the start.
+    """
+
+    # results returned by a query without a $top
+    DEFAULT_PAGE_SIZE = 1000
+
+    def __init__(self, **kwargs):
+        super(FakeMediasiteServer, self).__init__(**kwargs)
+        self.root_folder_id = self.new_id()
+        self.folders = dict()
+        self.catalogs = dict()
+        # catalog id -> its settings
+        self.catalog_settings = dict()
+        self.modules = dict()
+        self.roles = dict()
+        self.user_profiles = dict()
+        # folder id -> its resource permissions
+        self.permissions = dict()
+        self.authenticated_users_role = self.add_role('AuthenticatedUsers', 'AuthenticatedUsers')
+        self.add_role('Analytics Application', 'analytics@mediasite')
+
+        self.add_route('GET', _API_PATH + 'Home', self.get_home)
+        self.add_route('GET', _API_PATH + 'Folders', self.query(self.folders, search_backed=True))
+        self.add_route('GET', _API_PATH + 'Folders' + _KEY, self.get(self.folders))
+        self.add_route('POST', _API_PATH + 'Folders', self.create_folder)
+        self.add_route('POST', _API_PATH + 'Folders' + _KEY + '/UpdatePermissions', self.update_permissions)
+        self.add_route('GET', _API_PATH + 'Catalogs', self.query(self.catalogs, search_backed=True))
+        self.add_route('GET', _API_PATH + 'Catalogs' + _KEY, self.get(self.catalogs))
+        self.add_route('POST', _API_PATH + 'Catalogs', self.create_catalog)
+        self.add_route('GET', _API_PATH + 'Catalogs' + _KEY + '/Settings', self.get_catalog_settings)
+        self.add_route('PATCH', _API_PATH + 'Catalogs' + _KEY + '/Settings', self.update_catalog_settings)
+        self.add_route('PUT', _API_PATH + 'Catalogs' + _KEY + '/Settings', self.update_catalog_settings)
+        self.add_route('GET', _API_PATH + 'Modules', self.query(self.modules, search_backed=True))
+        self.add_route('GET', _API_PATH + 'Modules' + _KEY, self.get(self.modules))
+        self.add_route('POST', _API_PATH + 'Modules', self.create_module)
+        self.add_route('POST', _API_PATH + 'Modules' + _KEY + '/AddAssociation', self.add_module_association)
+        self.add_route('GET', _API_PATH + 'Roles', self.query(self.roles))
+        self.add_route('POST', _API_PATH + 'Roles', self.create_role)
+        self.add_route('GET', _API_PATH + 'UserProfiles', self.query(self.user_profiles))
+        self.add_route('POST', _API_PATH + 'UserProfiles', self.create_user_profile)
+        self.add_route('GET', _API_PATH + 'ResourcePermissions' + _KEY, self.get(self.permissions))
+
+    def settings(self):
+        return {
+            'MEDIASITE_API_URL': self.url + _API_PATH + '{0}',
+            'MEDIASITE_LTI_LAUNCH_URL': self.url + 'Mediasite/LTI',
+            # the server does not check them, but the clients need some to send
+            'MEDIASITE_USERNAME': 'fake',
+            'MEDIASITE_PASSWORD': 'fake',
+            'MEDIASITE_API_KEY': 'fake',
+        }
+
+    ######################################################
+    # Data
+    ######################################################
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def now():
+        return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def add_folder(self, name, parent_folder_id=None, is_copy_destination=False, is_shared=False):
+        folder = dict(Id=self.new_id(), Name=name, Owner='MediasiteAdmin', Description='',
+                      CreationDate=self.now(), LastModified=self.now(),
+                      ParentFolderId=parent_folder_id or self.root_folder_id, Recycled=False, Type='Folder',
+                      IsShared=is_shared, IsCopyDestination=is_copy_destination, IsReviewEditApproveEnabled=False)
+        self.folders[folder['Id']] = folder
+        # new folders can be seen by every signed in user until their permissions are updated
+        self.permissions[folder['Id']] = dict(
+            Id=folder['Id'], Owner='MediasiteAdmin', InheritPermissions=False,
+            AccessControlList=[dict(RoleId=self.authenticated_users_role['Id'], PermissionMask=5)])
+        return folder
+
+    def add_role(self, name, directory_entry):
+        role = dict(Id=self.new_id(), Name=name, Description=None, DirectoryEntry=directory_entry)
+        self.roles[role['Id']] = role
+        return role
+
+    def add_user_profile(self, email, display_name=None):
+        user_profile = dict(Id=self.new_id(), UserName=email, DisplayName=display_name or email, Email=email,
+                            Activated=True, TimeZone=0)
+        self.user_profiles[user_profile['Id']] = user_profile
+        return user_profile
+
+    ######################################################
+    # Handlers
+    ######################################################
+    def error_response(self, status, message):
+        return FakeResponse({'odata.error': {'code': '', 'message': {'lang': 'en-US', 'value': message}}},
+                            status=status)
+
+    def not_found(self):
+        return self.error_response(404, 'Resource not found')
+
+    def query(self, records, search_backed=False):
+        """ A handler for an OData query of `records` """
+        def handler(request):
+            try:
+                alternatives = parse_filter(request.params['$filter']) if request.params.get('$filter') else None
+                top = int(request.params.get('$top', self.DEFAULT_PAGE_SIZE))
+                skip = int(request.params.get('$skip', 0))
+            except ValueError as e:
+                return self.error_response(400, str(e))
+            found = [r for r in records.values()
+                     if alternatives is None or matches_filter(r, alternatives, search_backed)]
+
+            select = request.params.get('$select')
+            fields = [f.strip() for f in select.split(',')] if select else None
+            page = [self.to_json(request, r, fields, key=r['Id']) for r in found[skip:skip + top]]
+            body = {'odata.count': str(len(found)), 'value': page}
+            if skip + top < len(found):
+                params = [(k, v) for k, v in request.params_list if k != '$skip'] + [('$skip', skip + top)]
+                body['odata.nextLink'] = '{0}{1}?{2}'.format(self.url, request.path.lstrip('/'), urlencode(params))
+            return FakeResponse(body)
+
+        return handler
+
+    def get(self, records):
+        """ A handler for getting one of `records` by its key """
+        def handler(request, id):
+            record = records.get(id)
+            return FakeResponse(self.to_json(request, record)) if record is not None else self.not_found()
+
+        return handler
+
+    def to_json(self, request, record, fields=None, key=None):
+        """ The JSON of a record, with only the `fields` given; `key` is its key within a queried collection """
+        record_json = dict((f, record.get(f)) for f in fields) if fields else dict(record)
+        record_json['odata.id'] = '{0}{1}{2}'.format(self.url, request.path.lstrip('/'),
+                                                     "('{0}')".format(key) if key else '')
+        return record_json
+
+    def get_home(self, request):
+        return FakeResponse(dict(Id=self.new_id(), RootFolderId=self.root_folder_id))
+
+    def create_folder(self, request):
+        body = request.json()
+        if body.get('ParentFolderId') not in self.folders and body.get('ParentFolderId') != self.root_folder_id:
+            return self.error_response(400, 'ParentFolderId is not a folder')
+        folder = self.add_folder(body['Name'], body.get('ParentFolderId'),
+                                 is_copy_destination=body.get('IsCopyDestination', False),
+                                 is_shared=body.get('IsShared', False))
+        return FakeResponse(folder, status=201)
+
+    def update_permissions(self, request, id):
+        if id not in self.folders:
+            return self.not_found()
+        body = request.json()
+        for p in body.get('Permissions', ()):
+            # a user profile's role id is its id as a uuid
+            if p['RoleId'] not in self.roles and p['RoleId'].replace('-', '') not in self.user_profiles:
+                return self.error_response(400, 'RoleId {0} is not a role'.format(p['RoleId']))
+        self.permissions[id] = dict(self.permissions[id],
+                                    Owner=body.get('Owner') or self.permissions[id]['Owner'],
+                                    AccessControlList=[dict(RoleId=p['RoleId'], PermissionMask=p['PermissionMask'])
+                                                       for p in body.get('Permissions', ())])
+        return FakeResponse(dict(Id=self.new_id(), Status='Successful'))
+
+    def create_catalog(self, request):
+        body = request.json()
+        if body.get('LinkedFolderId') not in self.folders:
+            return self.error_response(400, 'LinkedFolderId is not a folder')
+        catalog = dict(Id=self.new_id(), Name=body['Name'], FriendlyName=body.get('FriendlyName'),
+                       LinkedFolderId=body['LinkedFolderId'],
+                       LimitSearchToCatalog=body.get('LimitSearchToCatalog', False))
+        catalog['CatalogUrl'] = '{0}Mediasite/Catalog/catalogs/{1}'.format(
+            self.url, catalog['FriendlyName'] or catalog['Id'])
+        self.catalogs[catalog['Id']] = catalog
+        self.catalog_settings[catalog['Id']] = dict(
+            Id=catalog['Id'], PresentationsPerPage=10, ShowCardPresentationDate=True,
+            ShowCardPresentationTime=True, ShowTablePresentationDate=True, ShowTablePresentationTime=True,
+            AllowLoginControls=True)
+        return FakeResponse(catalog, status=201)
+
+    def get_catalog_settings(self, request, id):
+        catalog_settings = self.catalog_settings.get(id)
+        return FakeResponse(dict(catalog_settings)) if catalog_settings is not None else self.not_found()
+
+    def update_catalog_settings(self, request, id):
+        if id not in self.catalog_settings:
+            return self.not_found()
+        self.catalog_settings[id].update(request.json())
+        return FakeResponse(status=204)
+
+    def create_module(self, request):
+        body = request.json()
+        module = dict(Id=self.new_id(), ModuleId=body['ModuleId'], Name=body['Name'],
+                      Associations=list(body.get('Associations', ())))
+        self.modules[module['Id']] = module
+        return FakeResponse(module, status=201)
+
+    def add_module_association(self, request, id):
+        module = self.modules.get(id)
+        if module is None:
+            return self.not_found()
+        associated_id = request.json()['MediasiteId']
+        if associated_id not in module['Associations']:
+            module['Associations'].append(associated_id)
+        return FakeResponse(status=204)
+
+    def create_role(self, request):
+        body = request.json()
+        return FakeResponse(self.add_role(body['Name'], body.get('DirectoryEntry')), status=201)
+
+    def create_user_profile(self, request):
+        body = request.json()
+        if any(p['UserName'].lower() == body['UserName'].lower() for p in self.user_profiles.values()):
+            return self.error_response(409, 'A user with that name already exists')
+        user_profile = self.add_user_profile(body['Email'], body.get('DisplayName'))
+        user_profile.update(UserName=body['UserName'], Activated=body.get('Activated', True))
+        return FakeResponse(user_profile, status=201)
@@ -0,0 +1,28 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from mediasite.apimethods import MediasiteAPI
+
+
+class Command(BaseCommand):
+    help = ('Flushes the cached Mediasite root folder id and roles from the shared cache, e.g. after a role '
+            'was deleted and recreated in Mediasite.  Each worker keeps serving its own copies for up to '
+            'LOCAL_CACHE_TIMEOUT seconds.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Also flush the folder and catalog indexes, user profiles, catalog settings '
+                                 'and not-found lookups')
+
+    def handle(self, *args, **options):
+        caches = [MediasiteAPI._folder_cache, MediasiteAPI._role_cache]
+        if options['all']:
+            caches.extend([MediasiteAPI._folder_index, MediasiteAPI._catalog_index,
+                           MediasiteAPI._catalog_settings_cache, MediasiteAPI._user_profile_cache,
+                           MediasiteAPI._not_found_cache])
+        for cache in caches:
+            if cache.clear():
+                self.stdout.write('Flushed {0}'.format(cache.name))
+            else:
+                self.stderr.write('Could not flush {0} from the shared cache; see the log'.format(cache.name))
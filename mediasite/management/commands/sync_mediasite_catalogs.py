@@ -0,0 +1,26 @@
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from mediasite.apimethods import MediasiteAPI
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Pages through every Mediasite catalog and refreshes the local LinkedFolderId -> catalog '
+            'index used by provisioning.  Intended to be run periodically.')
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        catalog_count = 0
+        for attrs in MediasiteAPI.query_catalogs():
+            catalog_count += 1
+            if catalog_count % 1000 == 0:
+                logger.debug("indexed {} catalogs".format(catalog_count))
+
+        self.stdout.write('Indexed {0} Mediasite catalogs in {1:.1f}s'.format(
+            catalog_count, time.time() - start_time))
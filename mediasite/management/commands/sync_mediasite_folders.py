@@ -0,0 +1,37 @@
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from mediasite.apimethods import MediasiteAPI
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Walks the Mediasite folder tree from the root folder and refreshes the local '
+            '(parent folder, name) -> folder index used by provisioning, dropping the folders that have '
+            'gone since the last run.  Intended to be run periodically.')
+
+    def add_arguments(self, parser):
+        # root -> school root folder -> year -> term -> course
+        parser.add_argument('--depth', type=int, default=4,
+                            help='How many levels below the Mediasite root folder to index (default 4)')
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        folder_count = 0
+        parent_folder_ids = [MediasiteAPI.get_root_folder_id()]
+        for level in range(options['depth']):
+            child_folder_ids = list()
+            for parent_folder_id in parent_folder_ids:
+                folders = MediasiteAPI.sync_child_folders(parent_folder_id)
+                child_folder_ids.extend(f.Id for f in folders)
+            folder_count += len(child_folder_ids)
+            logger.debug("indexed {} folders at level {}".format(len(child_folder_ids), level + 1))
+            parent_folder_ids = child_folder_ids
+
+        self.stdout.write('Indexed {0} Mediasite folders in {1:.1f}s'.format(
+            folder_count, time.time() - start_time))
@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+
+from urllib.parse import urlsplit
+
+from .utils import odata_encode_str
+
+
+def select_fields(serializer_class):
+    """ The fields a serializer reads from a record, to $select only those """
+    return list(serializer_class().get_fields())
+
+
+def eq_clause(field, value):
+    return '{0} eq \'{1}\''.format(field, odata_encode_str(value))
+
+
+def endswith_clause(field, value):
+    return 'endswith({0}, \'{1}\')'.format(field, odata_encode_str(value))
+
+
+class ODataQuery(object):
+    """
+    Builds the query string of a Mediasite OData query.  Filter clauses are joined with `and`, and
+    values are escaped with odata_encode_str.
+
+        query = ODataQuery(select=select_fields(FolderSerializer), top=100)\
+            .eq('ParentFolderId', parent_folder_id).eq('Name', name)
+        json = MediasiteAPI.get_mediasite_request_json('Folders', params=query.params())
+
+    MediasiteAPI.query_mediasite reads every page of a query; see next_page_params.
+    """
+
+    def __init__(self, select=None, top=None, skip=None):
+        self.filters = list()
+        self.select = list(select) if select else None
+        self.top = top
+        self.skip = skip
+
+    def where(self, clause):
+        """ Adds a clause that is already escaped, e.g. one of MediasiteAPI.get_email_address_filters """
+        self.filters.append(clause)
+        return self
+
+    def eq(self, field, value):
+        return self.where(eq_clause(field, value))
+
+    def endswith(self, field, value):
+        return self.where(endswith_clause(field, value))
+
+    def params(self, skip=None):
+        params = list()
+        if self.filters:
+            params.append('$filter={0}'.format(' and '.join(self.filters)))
+        if self.select:
+            params.append('$select={0}'.format(','.join(self.select)))
+        if self.top is not None:
+            params.append('$top={0}'.format(self.top))
+        skip = self.skip if skip is None else skip
+        if skip:
+            params.append('$skip={0}'.format(skip))
+        return '&'.join(params)
+
+    def next_page_params(self, json, fetched):
+        """
+        The params of the page that follows `json`, the last page read of this query, or None if it
+        was the last one.  Mediasite's odata.nextLink is followed when there is one, otherwise the
+        next page is asked for with $skip while odata.count says there are more records.
+        :param fetched: the number of records read so far
+        """
+        next_link = json.get('odata.nextLink')
+        if next_link:
+            return urlsplit(next_link).query
+        count = json.get('odata.count')
+        if json.get('value') and count is not None and int(count) > (self.skip or 0) + fetched:
+            return self.params(skip=(self.skip or 0) + fetched)
+        return None
@@ -1,65 +1,68 @@
 from rest_framework import serializers
-from .apimodels import (
-    AccessControl,
-    Catalog,
-    CatalogSetting,
-    Folder,
-    FolderPermission,
-    Home,
-    Module,
-    ResourcePermission,
-    Role,
-    UserProfile, )
 
-class RoleSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Role
-        fields = '__all__'
+# These serializers validate the Mediasite API payloads that are turned into the objects in
+# mediasite.apimodels.  Fields that Mediasite may leave out are optional, so the objects only get
+# the attributes Mediasite actually returned.
 
-class CatalogSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Catalog
-        fields = '__all__'
+class BaseSerializer(serializers.Serializer):
+    Id = serializers.CharField(allow_null=True, allow_blank=True, required=False)
 
-class CatalogSettingSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = CatalogSetting
-        fields = '__all__'
+class RoleSerializer(BaseSerializer):
+    Name = serializers.CharField()
+    Description = serializers.CharField(allow_null=True, allow_blank=True, required=False)
+    DirectoryEntry = serializers.CharField(allow_null=True, allow_blank=True, required=False)
 
-class AccessControlSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = AccessControl
-        fields = '__all__'
+class CatalogSerializer(BaseSerializer):
+    LinkedFolderId = serializers.CharField()
+    Name = serializers.CharField()
+    FriendlyName = serializers.CharField(allow_null=True, allow_blank=True, required=False)
+    CatalogUrl = serializers.CharField()
+    LimitSearchToCatalog = serializers.BooleanField(required=False)
 
-class ModuleSerializer(serializers.ModelSerializer):
-    Associations = serializers.ListField(child=serializers.CharField())
+class CatalogSettingSerializer(BaseSerializer):
+    PresentationsPerPage = serializers.IntegerField()
+    ShowCardPresentationDate = serializers.BooleanField(required=False)
+    ShowCardPresentationTime = serializers.BooleanField(required=False)
+    ShowTablePresentationDate = serializers.BooleanField(required=False)
+    ShowTablePresentationTime = serializers.BooleanField(required=False)
+    AllowLoginControls = serializers.BooleanField(required=False)
+
+class AccessControlSerializer(BaseSerializer):
+    RoleId = serializers.CharField()
+    PermissionMask = serializers.IntegerField()
 
-    class Meta:
-        model = Module
-        fields = '__all__'
+class ModuleSerializer(BaseSerializer):
+    Associations = serializers.ListField(child=serializers.CharField())
+    ModuleId = serializers.CharField()
+    Name = serializers.CharField()
 
-class ResourcePermissionSerializer(serializers.ModelSerializer):
+class ResourcePermissionSerializer(BaseSerializer):
     AccessControlList = AccessControlSerializer(many=True)
-    class Meta:
-        model = ResourcePermission
-        fields = '__all__'
+    Owner = serializers.CharField()
+    InheritPermissions = serializers.BooleanField(required=False)
 
-class FolderPermissionSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = FolderPermission
-        fields = '__all__'
+class FolderPermissionSerializer(BaseSerializer):
+    Owner = serializers.CharField()
 
-class FolderSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Folder
-        fields = '__all__'
+class FolderSerializer(BaseSerializer):
+    Name = serializers.CharField()
+    Owner = serializers.CharField()
+    Description = serializers.CharField(allow_null=True, allow_blank=True, required=False)
+    CreationDate = serializers.DateTimeField()
+    LastModified = serializers.DateTimeField()
+    ParentFolderId = serializers.CharField()
+    Recycled = serializers.BooleanField(required=False)
+    Type = serializers.CharField()
+    IsShared = serializers.BooleanField(required=False)
+    IsCopyDestination = serializers.BooleanField(required=False)
+    IsReviewEditApproveEnabled = serializers.BooleanField(required=False)
 
-class HomeSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Home
-        fields = '__all__'
+class HomeSerializer(BaseSerializer):
+    RootFolderId = serializers.CharField()
 
-class UserProfileSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = UserProfile
-        fields = '__all__'
+class UserProfileSerializer(BaseSerializer):
+    UserName = serializers.CharField()
+    DisplayName = serializers.CharField()
+    Email = serializers.EmailField(max_length=254)
+    Activated = serializers.BooleanField(required=False)
+    TimeZone = serializers.IntegerField()
@@ -1,61 +1,220 @@
 from __future__ import unicode_literals
 
-from django.test import TestCase
-from .apimethods import MediasiteAPI
-from .apimodels import Role
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.utils.six import StringIO
 
+from mediasite_provisioning.cache import TieredCache
+from .apimethods import MediasiteAPI, MediasiteServiceException
+from .apimodels import AccessControl, FolderPermission, Role
+from .fakeserver import FakeMediasiteServer, parse_filter
+from .odata import ODataQuery
 
-# Create your tests here.
-class MediasiteTestCase(TestCase):
+
+class MediasiteTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = FakeMediasiteServer().start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(**self.server.settings())
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # each test has its own Mediasite, so nothing cached from another may be used
+        for cache in TieredCache.all_caches:
+            cache.clear_local()
 
     def test_can_connect_to_Mediasite_home(self):
-        root_folder_id = MediasiteAPI.get_root_folder_id()
-        self.assertFalse(root_folder_id is None)
-
-    def test_create_and_destroy_folders(self):
-        root_folder_name = "ProofOfConcept"
-        term_name = "Winter"
-        course_name = "EPI201-01"
-        year_name = "2015"
-        course_sis_id = "346889"
-        course_code = "Advanced Epidemiologic Methods"
-        oath_consumer_key = "canvas_proof_of_concept"
-
-        course_folder = None
-        proof_of_concept_root_folder = MediasiteAPI.get_or_create_folder(root_folder_name, parent_folder_id=None)
-        self.assertFalse(proof_of_concept_root_folder is None)
-        year_folder = MediasiteAPI.get_or_create_folder(year_name, parent_folder_id=proof_of_concept_root_folder.Id)
-        self.assertFalse(year_folder is None)
-        term_folder = MediasiteAPI.get_or_create_folder(term_name, parent_folder_id=year_folder.Id)
-        self.assertFalse(term_folder is None)
-        course_folder = MediasiteAPI.get_or_create_folder(course_name, parent_folder_id=term_folder.Id)
-        self.assertFalse(course_folder is None)
-
-        catalog_name = "({0}) {1} {2} ({3})".format(term_name, course_name, course_code, course_sis_id)
-        course_catalog = MediasiteAPI.get_or_create_catalog(catalog_name, course_folder.Id)
-        self.assertFalse(course_catalog is None)
-
-        role_name = "{0}@{1}".format(course_name, oath_consumer_key)
-        course_role = MediasiteAPI.get_or_create_role(role_name)
-        self.assertFalse(course_role is None)
+        self.assertEqual(MediasiteAPI.get_root_folder_id(), self.server.root_folder_id)
+
+    def test_create_and_find_folders(self):
+        term_folder = MediasiteAPI.get_or_create_folder('Winter', parent_folder_id=None)
+        course_name = "(Winter) EPI201-01 Advanced Epidemiologic Methods (346889)"
+        course_folder = MediasiteAPI.get_or_create_folder(course_name, parent_folder_id=term_folder.Id,
+                                                          search_term='346889')
+        self.assertEqual(course_folder.ParentFolderId, term_folder.Id)
+        self.assertEqual(len(self.server.folders), 2)
+
+        # found again by a (contains) search on the sis id, even without the folder index
+        MediasiteAPI._folder_index.clear_local()
+        self.assertEqual(MediasiteAPI.get_or_create_folder(course_name, parent_folder_id=term_folder.Id,
+                                                           search_term='346889').Id, course_folder.Id)
+        self.assertEqual(len(self.server.folders), 2)
+
+    def test_folders_that_have_gone_are_dropped_from_the_folder_index(self):
+        term_folder = MediasiteAPI.get_or_create_folder('Winter', parent_folder_id=None)
+        course_folder = MediasiteAPI.get_or_create_folder('EPI201-01', parent_folder_id=term_folder.Id)
+        call_command('sync_mediasite_folders', stdout=StringIO())
+
+        # an index hit is checked with one direct get
+        self.server.reset_calls()
+        self.assertEqual(MediasiteAPI.get_folder('EPI201-01', term_folder.Id).Id, course_folder.Id)
+        self.assertEqual(dict(self.server.calls), {('GET', "Folders('{id}')"): 1})
+
+        # a folder moved away is searched for, and not found under its old parent
+        self.server.folders[course_folder.Id]['ParentFolderId'] = self.server.root_folder_id
+        self.assertIsNone(MediasiteAPI.get_folder('EPI201-01', term_folder.Id))
+
+        # the sync drops the folders it no longer sees
+        del self.server.folders[term_folder.Id]
+        call_command('sync_mediasite_folders', stdout=StringIO())
+        self.assertIsNone(MediasiteAPI._folder_index.get('{0}:Winter'.format(self.server.root_folder_id)))
+
+    def test_catalogs_are_found_through_the_catalog_index(self):
+        course_folder = MediasiteAPI.get_or_create_folder('EPI201-01', parent_folder_id=None)
+        other_folder = MediasiteAPI.get_or_create_folder('EPI202-01', parent_folder_id=None)
+        course_catalog = MediasiteAPI.get_or_create_catalog('EPI201-01-lecture-video', 'EPI201-01', course_folder.Id)
+        other_catalog = MediasiteAPI.create_catalog('EPI202-01-lecture-video', 'EPI202-01', other_folder.Id)
+
+        # one direct get, rather than a search
+        self.server.reset_calls()
+        self.assertEqual(MediasiteAPI.get_catalog('EPI201-01', course_folder.Id).Id, course_catalog.Id)
+        self.assertEqual(dict(self.server.calls), {('GET', "Catalogs('{id}')"): 1})
+
+        # refilled by the sync command, once lost
+        MediasiteAPI._catalog_index.clear_local()
+        call_command('sync_mediasite_catalogs', stdout=StringIO())
+        self.server.reset_calls()
+        self.assertEqual(MediasiteAPI.get_catalog('EPI202-01', other_folder.Id).Id, other_catalog.Id)
+        self.assertEqual(self.server.call_count(), 1)
+
+        # a catalog that has gone is searched for
+        del self.server.catalogs[course_catalog.Id]
+        self.assertIsNone(MediasiteAPI.get_catalog('EPI201-01', course_folder.Id))
+        self.assertEqual(self.server.calls[('GET', 'Catalogs')], 1)
+
+    def test_reads_every_page_of_a_search(self):
+        for n in range(5):
+            self.server.add_folder('Fall {0}'.format(n))
+        with override_settings(MEDIASITE_PAGE_SIZE=2):
+            folders = MediasiteAPI.get_folders('fall', parent_folder_id=self.server.root_folder_id)
+        self.assertEqual(sorted(f.Name for f in folders), ['Fall {0}'.format(n) for n in range(5)])
+        self.assertEqual(self.server.calls[('GET', 'Folders')], 3)
+
+    def test_builds_odata_queries(self):
+        query = ODataQuery(select=['Id', 'Name'], top=10).eq('Name', "O'Brien & co").endswith('Email', '@x.edu')
+        self.assertEqual(query.params(), "$filter=Name eq 'O%27%27Brien+%26+co' and endswith(Email, '%40x.edu')"
+                                         "&$select=Id,Name&$top=10")
+        # without an odata.nextLink, pages are skipped through while odata.count says there are more
+        self.assertEqual(query.next_page_params({'odata.count': '25', 'value': [{}] * 10}, 10),
+                         "$filter=Name eq 'O%27%27Brien+%26+co' and endswith(Email, '%40x.edu')"
+                         "&$select=Id,Name&$top=10&$skip=10")
+        self.assertIsNone(query.next_page_params({'odata.count': '25', 'value': [{}] * 5}, 25))
+
+    def test_provision_catalog_role_and_permissions(self):
+        course_folder = MediasiteAPI.get_or_create_folder('EPI201-01', parent_folder_id=None)
+        course_catalog = MediasiteAPI.get_or_create_catalog('EPI201-01-lecture-video', 'EPI201-01',
+                                                            course_folder.Id)
+        self.assertEqual(course_catalog.LinkedFolderId, course_folder.Id)
+        self.assertTrue(MediasiteAPI.set_catalog_settings(course_catalog.Id, False, False, 100))
+        self.assertEqual(self.server.catalog_settings[course_catalog.Id]['PresentationsPerPage'], 100)
+        # only what differs is written
+        self.assertFalse(MediasiteAPI.set_catalog_settings(course_catalog.Id, False, False, 100))
+        self.assertTrue(MediasiteAPI.set_catalog_settings(course_catalog.Id, False, False, 50))
+        self.assertEqual(self.server.calls[('PATCH', "Catalogs('{id}')/Settings")], 2)
+        self.assertEqual(self.server.calls[('GET', "Catalogs('{id}')/Settings")], 1)
+
+        course_role = MediasiteAPI.get_or_create_role('EPI201-01', 'EPI201-01@canvas')
+        self.assertEqual(MediasiteAPI.get_or_create_role('EPI201-01', 'EPI201-01@canvas').Id, course_role.Id)
 
         folder_permissions = MediasiteAPI.get_folder_permissions(course_folder.Id)
         folder_permissions = MediasiteAPI.update_folder_permissions(
             folder_permissions, course_role, MediasiteAPI.READ_ONLY_PERMISSION_FLAG)
-        self.assertFalse(folder_permissions is None)
-
-        # Remove permissions for authenticated users
-        authenticated_user_role = MediasiteAPI.get_role("AuthenticatedUsers")
+        authenticated_user_role = MediasiteAPI.get_role_by_name('AuthenticatedUsers')
         folder_permissions = MediasiteAPI.update_folder_permissions(
             folder_permissions, authenticated_user_role, MediasiteAPI.NO_ACCESS_PERMISSION_FLAG)
+        teacher = MediasiteAPI.get_or_create_users_by_email_address([('ann@example.edu', 'Ann')])['ann@example.edu']
+        folder_permissions = MediasiteAPI.update_folder_permissions(
+            folder_permissions, Role(Id=MediasiteAPI.convert_user_profile_to_role_id(teacher.Id)),
+            MediasiteAPI.READ_WRITE_PERMISSION_FLAG)
+        MediasiteAPI.assign_permissions_to_folder(course_folder.Id, folder_permissions)
 
-        # Make sure that Gregory_Carpenter@harvard.edu has editor role
-        greg = MediasiteAPI.get_user_by_email_address("gregory_carpenter@harvard.edu")
-        if greg is not None:
-            folder_permissions = MediasiteAPI.update_folder_permissions(
-                folder_permissions,
-                Role(Id = MediasiteAPI.convert_user_profile_to_role_id(greg.Id)),
-                MediasiteAPI.READ_WRITE_PERMISSION_FLAG)
+        self.assertEqual(sorted((p['RoleId'], p['PermissionMask'])
+                                for p in self.server.permissions[course_folder.Id]['AccessControlList']),
+                         sorted([(course_role.Id, 5), (MediasiteAPI.convert_user_profile_to_role_id(teacher.Id), 7)]))
 
-        #Assign permissions to folder
-        MediasiteAPI.assign_permissions_to_folder(course_folder.Id, folder_permissions)
+        # the same permissions again are not written
+        folder_permissions = MediasiteAPI.get_folder_permissions(course_folder.Id)
+        folder_permissions = MediasiteAPI.update_folder_permissions(
+            folder_permissions, course_role, MediasiteAPI.READ_ONLY_PERMISSION_FLAG)
+        self.assertFalse(MediasiteAPI.assign_permissions_to_folder(course_folder.Id, folder_permissions))
+        self.assertEqual(self.server.calls[('POST', "Folders('{id}')/UpdatePermissions")], 1)
+
+    def test_folder_permission_changes(self):
+        folder_permissions = FolderPermission(Owner='admin', Permissions=[
+            AccessControl(RoleId='a', PermissionMask=5), AccessControl(RoleId='b', PermissionMask=5)])
+        folder_permissions.set('a', MediasiteAPI.READ_ONLY_PERMISSION_FLAG)
+        folder_permissions.set('c', MediasiteAPI.NO_ACCESS_PERMISSION_FLAG)
+        self.assertFalse(folder_permissions.has_changes())
+
+        folder_permissions.set('a', MediasiteAPI.READ_WRITE_PERMISSION_FLAG)
+        folder_permissions.set('b', MediasiteAPI.NO_ACCESS_PERMISSION_FLAG)
+        folder_permissions.set('c', MediasiteAPI.VIEW_ONLY_PERMISSION_FLAG)
+        self.assertEqual(folder_permissions.diff(), (['c'], ['a'], ['b']))
+        self.assertEqual(folder_permissions.to_dict(), {'Owner': 'admin', 'Permissions': [
+            {'RoleId': 'a', 'PermissionMask': 7}, {'RoleId': 'c', 'PermissionMask': 4}]})
+        folder_permissions.mark_saved()
+        self.assertFalse(folder_permissions.has_changes())
+
+    def test_finds_users_in_batches(self):
+        for n in range(3):
+            self.server.add_user_profile('user{0}@example.edu'.format(n))
+        with override_settings(MEDIASITE_MAX_FILTER_LENGTH=90):
+            user_profiles = MediasiteAPI.get_users_by_email_address(
+                ['user0@example.edu', 'USER1@example.edu', 'user2@example.edu', 'nobody@example.edu'])
+        self.assertEqual(sorted(user_profiles), ['USER1@example.edu', 'user0@example.edu', 'user2@example.edu'])
+        self.assertEqual(self.server.calls[('GET', 'UserProfiles')], 2)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'mediasite_tests'}})
+    def test_misses_are_cached_until_created(self):
+        self.assertIsNone(MediasiteAPI.get_module_by_module_id('EPI201-01'))
+        self.assertIsNone(MediasiteAPI.get_role_by_directory_entry('EPI201-01@canvas'))
+        self.assertEqual(MediasiteAPI.get_users_by_email_address(['ann@example.edu']), {})
+        calls = self.server.call_count()
+        self.assertIsNone(MediasiteAPI.get_module_by_module_id('EPI201-01'))
+        self.assertIsNone(MediasiteAPI.get_role_by_directory_entry('EPI201-01@canvas'))
+        self.assertIsNone(MediasiteAPI.get_user_by_email_address('ANN@example.edu'))
+        self.assertEqual(self.server.call_count(), calls)
+
+        # creating them forgets the misses
+        module = MediasiteAPI.get_or_create_module('EPI201-01', 'EPI201-01')
+        role = MediasiteAPI.get_or_create_role('EPI201-01', 'EPI201-01@canvas')
+        MediasiteAPI.get_or_create_users_by_email_address([('ann@example.edu', 'Ann')])
+        MediasiteAPI._role_cache.clear_local()
+        MediasiteAPI._user_profile_cache.clear_local()
+        self.assertEqual(MediasiteAPI.get_module_by_module_id('EPI201-01').Id, module.Id)
+        self.assertEqual(MediasiteAPI.get_role_by_directory_entry('EPI201-01@canvas').Id, role.Id)
+        self.assertIsNotNone(MediasiteAPI.get_user_by_email_address('ann@example.edu'))
+        self.assertEqual([r['Name'] for r in self.server.roles.values() if r['DirectoryEntry'] == 'EPI201-01@canvas'],
+                         ['EPI201-01'])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'mediasite_role_tests'}})
+    def test_rejected_role_ids_are_evicted(self):
+        course_folder = MediasiteAPI.get_or_create_folder('EPI201-01', parent_folder_id=None)
+        course_role = MediasiteAPI.get_or_create_role('EPI201-01', 'EPI201-01@canvas')
+        # the role is deleted and recreated in Mediasite
+        del self.server.roles[course_role.Id]
+        new_role = self.server.add_role('EPI201-01', 'EPI201-01@canvas')
+
+        folder_permissions = MediasiteAPI.update_folder_permissions(
+            MediasiteAPI.get_folder_permissions(course_folder.Id), course_role, MediasiteAPI.READ_ONLY_PERMISSION_FLAG)
+        with self.assertRaises(MediasiteServiceException):
+            MediasiteAPI.assign_permissions_to_folder(course_folder.Id, folder_permissions)
+        self.assertEqual(MediasiteAPI.get_or_create_role('EPI201-01', 'EPI201-01@canvas').Id, new_role['Id'])
+
+    def test_server_errors(self):
+        self.server.error_rate = 1
+        self.server.error_status = 500
+        with self.assertRaises(MediasiteServiceException) as cm:
+            MediasiteAPI.get_role_by_name('Analytics Application')
+        self.assertEqual(cm.exception.status_code(), 500)
+        self.assertEqual(cm.exception.server_error(), 'injected error')
+
+    def test_parses_filters(self):
+        self.assertEqual(parse_filter("ParentFolderId eq 'a1' and Name eq 'O''Brien & co'"),
+                         [[('eq', 'ParentFolderId', 'a1'), ('eq', 'Name', "O'Brien & co")]])
+        self.assertEqual(parse_filter("endswith(Email, 'a@x.edu') or endswith(Email, 'b@x.edu')"),
+                         [[('endswith', 'Email', 'a@x.edu')], [('endswith', 'Email', 'b@x.edu')]])
+        with self.assertRaises(ValueError):
+            parse_filter("Name ne 'x'")
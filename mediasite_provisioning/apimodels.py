@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+
+
+class ApiModel(object):
+    """
+    Base class for the objects built from Canvas and Mediasite API payloads.  These are plain
+    objects rather than Django models: subclasses list their attributes in `__slots__`, so
+    instances carry no per-object `__dict__` and no model machinery.
+
+    Attributes that are not in the payload are left unset (so `hasattr` tells whether the API
+    returned them), except for those listed in `_defaults`, which maps an attribute name to a
+    default value, or to a callable returning one (use `list` for lists, so that instances never
+    share them).  Keyword arguments that are not attributes of the class are ignored, as API
+    payloads can carry more fields than the models keep.  Subclasses that need to build nested
+    objects define `__init__(self, **kwargs)`, which should call `self._init_attributes(**kwargs)`
+    first.
+    """
+    __slots__ = ()
+    _defaults = {}
+    _attribute_names = ()
+    _attribute_set = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super(ApiModel, cls).__init_subclass__(**kwargs)
+        names = list()
+        for klass in reversed(cls.__mro__):
+            for slot in klass.__dict__.get('__slots__', ()):
+                if slot not in names:
+                    names.append(slot)
+        cls._attribute_names = tuple(names)
+        cls._attribute_set = frozenset(names)
+
+    def __init__(self, **attributes):
+        self._init_attributes(**attributes)
+
+    def _init_attributes(self, **attributes):
+        for name, default in self._defaults.items():
+            if name not in attributes:
+                setattr(self, name, default() if callable(default) else default)
+        for name, value in attributes.items():
+            if name in self._attribute_set:
+                setattr(self, name, value)
+
+    @classmethod
+    def attribute_names(cls):
+        """ All of the slot names of this class and its bases, base class attributes first """
+        return cls._attribute_names
+
+    def to_dict(self):
+        """ The attributes that have been set, e.g. to post back to the API """
+        return dict((name, getattr(self, name)) for name in self._attribute_names if hasattr(self, name))
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self._init_attributes(**state)
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.__class__.__name__,
+                                 ', '.join('{0}={1!r}'.format(k, v) for k, v in sorted(self.to_dict().items())))
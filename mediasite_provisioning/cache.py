@@ -0,0 +1,194 @@
+from __future__ import unicode_literals
+
+import contextlib
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def get_redis_client():
+    """ The redis client behind CACHES['default'], or None if that cache is not django-redis (e.g. in tests) """
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+# the threads of this process wait on these before taking a shared_lock, so only one of them at a
+# time waits on Redis; names are spread over them by their hash
+_local_locks = [threading.Lock() for n in range(64)]
+
+
+@contextlib.contextmanager
+def shared_lock(name):
+    """
+    Holds the lock `name` across every process that shares CACHES['default'] (Redis), e.g. around
+    looking something up and creating it if it is missing.  The lock expires after
+    settings.SHARED_LOCK_TIMEOUT seconds, and waiting for it gives up after as long.  Like the shared
+    cache it is best effort: if Redis cannot be reached, or the wait gives up, that is logged and the
+    caller goes ahead holding only the lock of the threads of this process.
+    """
+    with _local_locks[hash(name) % len(_local_locks)]:
+        client = get_redis_client()
+        if client is None:
+            yield
+            return
+        timeout = settings.SHARED_LOCK_TIMEOUT
+        digest = hashlib.md5(name.encode('utf8')).hexdigest()
+        lock = client.lock(cache.make_key('lock:{0}'.format(digest)), timeout=timeout, blocking_timeout=timeout)
+        try:
+            acquired = lock.acquire()
+            if not acquired:
+                logger.warning("gave up waiting for the shared lock {} after {}s".format(name, timeout))
+        except Exception:
+            logger.warning("could not take the shared lock {}".format(name), exc_info=True)
+            acquired = False
+        try:
+            yield
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except Exception:
+                    logger.warning("could not release the shared lock {}; it expires in {}s".format(name, timeout),
+                                   exc_info=True)
+
+
+class TieredCache(object):
+    """
+    A cache with two tiers: a small in-memory dictionary private to this process, in front of the
+    shared `CACHES['default']` (Redis) cache that every gunicorn worker sees.  A miss in the local
+    tier falls through to the shared tier, and shared hits are copied into the local tier.
+
+    Entries live in the shared tier for `timeout_setting` seconds.  The local tier keeps them for at
+    most settings.LOCAL_CACHE_TIMEOUT seconds, which bounds how long an invalidation made by another
+    worker can go unnoticed here.
+
+    Values must be picklable; store plain data (dicts, strings) rather than API model objects.  The
+    shared tier is best effort: if it cannot be reached the error is logged and treated as a miss.
+
+    Entries that other processes invalidate and that must not be served stale, even briefly, can be
+    kept out of the local tier with `local_tier=False`.
+
+    Each cache counts where its lookups were answered, for mediasite_provisioning.metrics.
+    """
+
+    # upper bound on the number of entries kept in the local tier
+    MAX_LOCAL_ENTRIES = 1000
+
+    # every TieredCache created, so their statistics can be collected
+    all_caches = list()
+
+    def __init__(self, name, timeout_setting, local_tier=True):
+        self.name = name
+        self._timeout_setting = timeout_setting
+        self._local_tier = local_tier
+        self._local = dict()
+        self._lock = threading.Lock()
+        self._stats = dict(local_hit=0, shared_hit=0, miss=0)
+        TieredCache.all_caches.append(self)
+
+    @property
+    def timeout(self):
+        return getattr(settings, self._timeout_setting)
+
+    def make_key(self, key):
+        # keys are often names entered by users, so hash them to keep the shared cache key safe
+        digest = hashlib.md5(key.encode('utf8')).hexdigest()
+        return '{0}:{1}'.format(self.name, digest)
+
+    def get(self, key, default=None):
+        shared_key = self.make_key(key)
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(shared_key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._stats['local_hit'] += 1
+                    return entry[1]
+                del self._local[shared_key]
+
+        try:
+            value = cache.get(shared_key)
+        except Exception:
+            logger.warning("could not read {} from the shared cache".format(shared_key), exc_info=True)
+            value = None
+
+        if value is None:
+            self._count('miss')
+            return default
+        self._count('shared_hit')
+        self._set_local(shared_key, value)
+        return value
+
+    def set(self, key, value, timeout=None):
+        shared_key = self.make_key(key)
+        self._set_local(shared_key, value, timeout)
+        try:
+            cache.set(shared_key, value, self.timeout if timeout is None else timeout)
+        except Exception:
+            logger.warning("could not write {} to the shared cache".format(shared_key), exc_info=True)
+
+    def delete(self, key):
+        shared_key = self.make_key(key)
+        with self._lock:
+            self._local.pop(shared_key, None)
+        try:
+            cache.delete(shared_key)
+        except Exception:
+            logger.warning("could not delete {} from the shared cache".format(shared_key), exc_info=True)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def clear(self):
+        """
+        Drops every entry of this cache from the local tier and, where the shared cache supports
+        deleting by pattern (django-redis), from the shared tier.  Other workers' local tiers still
+        serve their copies for up to settings.LOCAL_CACHE_TIMEOUT seconds.
+        :return: whether the shared tier was cleared
+        """
+        self.clear_local()
+        if not hasattr(cache, 'delete_pattern'):
+            logger.warning("the shared cache cannot delete by pattern, so {} was only cleared locally".format(
+                self.name))
+            return False
+        try:
+            cache.delete_pattern('{0}:*'.format(self.name))
+        except Exception:
+            logger.warning("could not clear {} from the shared cache".format(self.name), exc_info=True)
+            return False
+        return True
+
+    def pop_stats(self):
+        """ Returns the number of local hits, shared hits and misses since the last call """
+        with self._lock:
+            stats = self._stats
+            self._stats = dict(local_hit=0, shared_hit=0, miss=0)
+        return stats
+
+    def _count(self, result):
+        with self._lock:
+            self._stats[result] += 1
+
+    def _set_local(self, shared_key, value, timeout=None):
+        if not self._local_tier:
+            return
+        local_timeout = settings.LOCAL_CACHE_TIMEOUT
+        if timeout is not None:
+            local_timeout = min(local_timeout, timeout)
+        now = time.time()
+        with self._lock:
+            if len(self._local) >= self.MAX_LOCAL_ENTRIES:
+                self._local = dict((k, e) for k, e in self._local.items() if e[0] > now)
+                if len(self._local) >= self.MAX_LOCAL_ENTRIES:
+                    self._local.clear()
+            self._local[shared_key] = (now + local_timeout, value)
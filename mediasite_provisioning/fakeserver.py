@@ -0,0 +1,185 @@
+from __future__ import unicode_literals
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from .metrics import normalize_endpoint
+
+
+class FakeResponse(object):
+    """ What a FakeServer route returns: a status, a JSON-serializable body and extra headers """
+
+    def __init__(self, body=None, status=200, headers=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or dict()
+
+
+class FakeRequest(object):
+    """ The parts of an HTTP request a FakeServer route needs """
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        # the raw query string, and its decoded parameters (repeated names keep their last value,
+        # see params_list for all of them)
+        self.query = query
+        self.params_list = parse_qsl(query, keep_blank_values=True)
+        self.params = dict(self.params_list)
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode('utf8')) if self.body else None
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class FakeServer(object):
+    """
+    An in-process HTTP server standing in for an API we call (see canvas.fakeserver and
+    mediasite.fakeserver), for tests and benchmarks.  Subclasses register their endpoints with
+    add_route(method, path pattern, handler); a handler is called with the FakeRequest and the
+    pattern's named groups, and returns a FakeResponse.
+
+    Every call is counted by method and endpoint template (see calls), and the server can be made
+    slow or unreliable: each response is delayed by `latency` seconds (plus up to `jitter` more), and
+    `error_rate` of the calls fail with `error_status`.
+
+        with FakeCanvasServer() as canvas_server:
+            with override_settings(**canvas_server.settings()):
+                ...
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._routes = list()
+        self._calls = Counter()
+        self._lock = threading.RLock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """ The root url of the running server, with a trailing slash """
+        host, port = self._server.server_address[:2]
+        return 'http://{0}:{1}/'.format(host, port)
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), name=type(self).__name__)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def settings(self):
+        """ The Django settings that point the API client at this server, for override_settings """
+        raise NotImplementedError()
+
+    ######################################################
+    # Calls
+    ######################################################
+    @property
+    def calls(self):
+        """ A Counter of the calls made, keyed by (method, endpoint template) """
+        with self._lock:
+            return Counter(self._calls)
+
+    def call_count(self, method=None):
+        with self._lock:
+            return sum(n for (m, endpoint), n in self._calls.items() if method is None or m == method)
+
+    def reset_calls(self):
+        with self._lock:
+            self._calls.clear()
+
+    ######################################################
+    # Routing
+    ######################################################
+    def add_route(self, method, pattern, handler):
+        """ Routes requests whose path (without the leading slash) matches the regex `pattern` """
+        self._routes.append((method, re.compile('^{0}$'.format(pattern)), handler))
+
+    def dispatch(self, request):
+        with self._lock:
+            self._calls[(request.method, normalize_endpoint(request.path))] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            fail = self.error_rate and self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return self.error_response(self.error_status, 'injected error')
+
+        path_matched = False
+        for method, pattern, handler in self._routes:
+            match = pattern.match(request.path.lstrip('/'))
+            if match:
+                path_matched = True
+                if method == request.method:
+                    with self._lock:
+                        return handler(request, **match.groupdict())
+        if path_matched:
+            return self.error_response(405, 'method not allowed')
+        return self.error_response(404, 'no such endpoint')
+
+    def error_response(self, status, message):
+        return FakeResponse({'message': message}, status=status)
+
+    def _make_handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, as the API clients pool their connections
+            protocol_version = 'HTTP/1.1'
+            # the headers and body are written separately, which Nagle's algorithm would hold up
+            disable_nagle_algorithm = True
+
+            def handle_request(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                request = FakeRequest(self.command, unquote(url.path), url.query, self.headers,
+                                      self.rfile.read(length) if length else b'')
+                response = server.dispatch(request)
+                content = b'' if response.body is None else json.dumps(response.body).encode('utf8')
+                self.send_response(response.status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in response.headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
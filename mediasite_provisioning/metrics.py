@@ -0,0 +1,179 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import json
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import TieredCache, get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (seconds) of the API call latency histogram buckets
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+_METRICS = (
+    ('api_request_duration_seconds', 'histogram',
+     'Time taken by Canvas and Mediasite API calls, including any rate limit waits and retries'),
+    ('api_request_errors_total', 'counter', 'Canvas and Mediasite API calls that failed'),
+    ('api_response_bytes_total', 'counter', 'Bytes received from Canvas and Mediasite'),
+    ('cache_requests_total', 'counter', 'Lookups in the tiered caches, by where they were answered'),
+    ('cache_hit_ratio', 'gauge', 'Share of the lookups in each tiered cache that were hits'),
+)
+
+_API_PREFIX = re.compile(r'^.*?/?api/v\d+/', re.IGNORECASE)
+_ODATA_KEY = re.compile(r"\('[^']*'\)")
+_ID_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F-]{32,36}|sis_[a-z_]+:.*)$')
+
+
+def normalize_endpoint(url):
+    """
+    The template of an API url, so that calls to the same endpoint are counted together, e.g.
+    `https://canvas/api/v1/courses/123/external_tools?per_page=100` -> `courses/{id}/external_tools`
+    and `Folders('abc')/UpdatePermissions` -> `Folders('{id}')/UpdatePermissions`
+    """
+    path = _API_PREFIX.sub('', urlparse(url).path)
+    path = _ODATA_KEY.sub("('{id}')", path)
+    return '/'.join('{id}' if _ID_SEGMENT.match(segment) else segment for segment in path.strip('/').split('/'))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+class MetricsRegistry(object):
+    """
+    Counts the Canvas and Mediasite API calls (latency histogram, errors, bytes received) by
+    service, method and endpoint template, and the tiered cache hit ratios.
+
+    Each process adds up its own counts, and every settings.METRICS_FLUSH_INTERVAL seconds adds them
+    to a hash in the shared redis cache, so render() reports the totals across all of the workers
+    and bulk jobs.  Without redis (e.g. in tests) it reports the counts of this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (metric name, labels) -> count not yet flushed to redis
+        self._pending = defaultdict(float)
+        # (metric name, labels) -> total, for when there is no redis
+        self._local_totals = defaultdict(float)
+        self._last_flush = time.time()
+
+    @property
+    def redis_key(self):
+        return cache.make_key('metrics')
+
+    def record_call(self, service, method, url, elapsed_secs, error=False, bytes_received=0):
+        labels = (('endpoint', normalize_endpoint(url)), ('method', method.upper()), ('service', service))
+        bucket = next(b for b in LATENCY_BUCKETS if elapsed_secs <= b)
+        with self._lock:
+            self._pending[('api_request_duration_seconds_bucket', labels + (('le', _format_bound(bucket)),))] += 1
+            self._pending[('api_request_duration_seconds_sum', labels)] += elapsed_secs
+            self._pending[('api_request_duration_seconds_count', labels)] += 1
+            if error:
+                self._pending[('api_request_errors_total', labels)] += 1
+            if bytes_received:
+                self._pending[('api_response_bytes_total', labels)] += bytes_received
+            flush = time.time() - self._last_flush > settings.METRICS_FLUSH_INTERVAL
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """ Adds the counts made since the last flush to the shared totals """
+        cache_stats = [(tiered_cache.name, tiered_cache.pop_stats()) for tiered_cache in TieredCache.all_caches]
+        with self._lock:
+            for cache_name, stats in cache_stats:
+                for result, count in stats.items():
+                    if count:
+                        self._pending[('cache_requests_total', (('cache', cache_name), ('result', result)))] += count
+            pending, self._pending = self._pending, defaultdict(float)
+            self._last_flush = time.time()
+        if not pending:
+            return
+
+        client = get_redis_client()
+        if client is not None:
+            try:
+                pipeline = client.pipeline(transaction=False)
+                for (name, labels), value in pending.items():
+                    pipeline.hincrbyfloat(self.redis_key, json.dumps([name, labels]), value)
+                pipeline.execute()
+                return
+            except Exception:
+                logger.warning("could not flush the metrics to redis", exc_info=True)
+        with self._lock:
+            for series, value in pending.items():
+                self._local_totals[series] += value
+
+    def collect(self):
+        """ The totals: a dict of (metric name, labels) to value """
+        self.flush()
+        client = get_redis_client()
+        if client is not None:
+            try:
+                totals = dict()
+                for field, value in client.hgetall(self.redis_key).items():
+                    name, labels = json.loads(field.decode('utf8') if isinstance(field, bytes) else field)
+                    totals[(name, tuple(tuple(l) for l in labels))] = float(value)
+                return totals
+            except Exception:
+                logger.warning("could not read the metrics from redis", exc_info=True)
+        with self._lock:
+            return dict(self._local_totals)
+
+    def render(self):
+        """ The totals in the Prometheus text exposition format """
+        totals = self.collect()
+        lines = defaultdict(list)
+
+        # the histogram buckets are counted separately, but are reported cumulatively
+        buckets = defaultdict(dict)
+        for (name, labels), value in totals.items():
+            if name == 'api_request_duration_seconds_bucket':
+                buckets[labels[:-1]][float(labels[-1][1])] = value
+            else:
+                lines[name.replace('_sum', '').replace('_count', '')
+                      if name.startswith('api_request_duration_seconds') else name].append((name, labels, value))
+        for labels, counts in buckets.items():
+            cumulative = 0
+            for bound in LATENCY_BUCKETS:
+                cumulative += counts.get(bound, 0)
+                lines['api_request_duration_seconds'].append(
+                    ('api_request_duration_seconds_bucket', labels + (('le', _format_bound(bound)),), cumulative))
+
+        # hit ratios from the cache counts
+        lookups = defaultdict(dict)
+        for name, labels, value in lines['cache_requests_total']:
+            lookups[labels[0][1]][labels[1][1]] = value
+        for cache_name, results in lookups.items():
+            total = sum(results.values())
+            if total:
+                hits = results.get('local_hit', 0) + results.get('shared_hit', 0)
+                lines['cache_hit_ratio'].append(('cache_hit_ratio', (('cache', cache_name),), hits / total))
+
+        output = list()
+        for metric, metric_type, description in _METRICS:
+            output.append('# HELP {0} {1}'.format(metric, description))
+            output.append('# TYPE {0} {1}'.format(metric, metric_type))
+            for name, labels, value in sorted(lines[metric], key=lambda line: (line[1], line[0])):
+                output.append('{0}{{{1}}} {2}'.format(
+                    name, ','.join('{0}="{1}"'.format(k, _escape(v)) for k, v in labels), repr(float(value))))
+        return '\n'.join(output) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def record_call(service, method, url, elapsed_secs, error=False, bytes_received=0):
+    """ Records one API call in the process' MetricsRegistry """
+    registry.record_call(service, method, url, elapsed_secs, error, bytes_received)
@@ -0,0 +1,309 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from email.utils import mktime_tz, parsedate_tz
+import hashlib
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# requests that can safely be sent again after they were throttled
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# Takes a token from the bucket in KEYS[1], refilled at its current rate up to the burst size.  The
+# token may be borrowed from the future, in which case the caller waits until it is earned; if the
+# bucket is blocked (after a Retry-After) no token is taken.  Returns {token taken (0/1), ms to wait,
+# current rate * 1000}.
+# ARGV: now (ms), max rate (tokens/s), burst, ttl (ms)
+_TAKE_TOKEN_SCRIPT = """
+local now = tonumber(ARGV[1])
+local max_rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate', 'blocked_until')
+local rate = math.min(tonumber(bucket[3]) or max_rate, max_rate)
+local blocked_until = tonumber(bucket[4]) or 0
+if blocked_until > now then
+    return {0, math.ceil(blocked_until - now), math.floor(rate * 1000)}
+end
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000) - 1
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now, 'rate', rate)
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+local wait = 0
+if tokens < 0 then
+    wait = math.ceil(-tokens * 1000 / rate)
+end
+return {1, wait, math.floor(rate * 1000)}
+"""
+
+# Changes the rate of the bucket in KEYS[1], and blocks it until a given time.
+# ARGV: new rate (tokens/s, or '' to keep it), blocked until (ms, 0 for not blocked), ttl (ms)
+_ADJUST_SCRIPT = """
+if ARGV[1] ~= '' then
+    redis.call('HSET', KEYS[1], 'rate', ARGV[1])
+end
+local blocked_until = tonumber(ARGV[2])
+if blocked_until > (tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0) then
+    redis.call('HSET', KEYS[1], 'blocked_until', blocked_until)
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+"""
+
+
+class _LocalBucket(object):
+    """ The same token bucket as _TAKE_TOKEN_SCRIPT, for when Redis can not be used """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.tokens = burst
+        self.ts = time.time()
+        self.blocked_until = 0
+
+    def take(self, max_rate, burst):
+        now = time.time()
+        self.rate = min(self.rate, max_rate)
+        if self.blocked_until > now:
+            return False, self.blocked_until - now, self.rate
+        self.tokens = min(burst, self.tokens + max(0, now - self.ts) * self.rate) - 1
+        self.ts = now
+        return True, max(0, -self.tokens / self.rate), self.rate
+
+
+class RateLimiter(object):
+    """
+    A token bucket per key (a host, an API token) shared by every worker process through the Redis
+    behind `CACHES['default']`, so that together they stay under the rate limits of the APIs we
+    call.  Buckets refill at `rate_setting` requests a second, up to `burst_setting` requests.
+
+    The rate adapts to the responses (see observe): it is halved, down to MIN_RATE_FRACTION of the
+    setting, when the API throttles us or, if `adapt_to_remaining`, when the X-Rate-Limit-Remaining
+    quota Canvas reports drops below settings.CANVAS_RATE_LIMIT_LOW_WATER; it then climbs back by a
+    tenth of the setting for each healthy response.  A Retry-After blocks the bucket for everyone.
+
+    If Redis can not be reached each process falls back to a bucket of its own.
+
+    Keys include API tokens, so only their hash is kept, here as in Redis.
+    """
+
+    # slowest a bucket gets, as a fraction of its configured rate
+    MIN_RATE_FRACTION = 1.0 / 16
+    # idle buckets are dropped from Redis after this long
+    BUCKET_TTL_MS = 10 * 60 * 1000
+    # upper bound on the number of keys whose rates and local buckets are kept in this process
+    MAX_LOCAL_KEYS = 1000
+
+    _redis_scripts = None
+    _redis_lock = threading.Lock()
+
+    def __init__(self, name, rate_setting, burst_setting, adapt_to_remaining=False):
+        self.name = name
+        self._rate_setting = rate_setting
+        self._burst_setting = burst_setting
+        self.adapt_to_remaining = adapt_to_remaining
+        # digest -> the rate each key was last seen at, if below the configured rate, so healthy
+        # responses only write to Redis when the rate has to recover; least recently seen first
+        self._rates = OrderedDict()
+        # digest -> the key's _LocalBucket, for when Redis can not be used
+        self._local = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return float(getattr(settings, self._rate_setting))
+
+    @property
+    def burst(self):
+        return float(getattr(settings, self._burst_setting))
+
+    @staticmethod
+    def digest(key):
+        return hashlib.md5(key.encode('utf8')).hexdigest()
+
+    def make_key(self, digest):
+        return cache.make_key('ratelimit:{0}:{1}'.format(self.name, digest))
+
+    def get_rate(self, key):
+        """ The rate the key's bucket was last seen at """
+        with self._lock:
+            return self._rates.get(self.digest(key), self.rate)
+
+    def _remember_rate(self, digest, rate):
+        with self._lock:
+            if rate >= self.rate:
+                # back at the configured rate, which is what a key that is not kept has
+                self._rates.pop(digest, None)
+                return
+            self._rates[digest] = rate
+            self._rates.move_to_end(digest)
+            while len(self._rates) > self.MAX_LOCAL_KEYS:
+                self._rates.popitem(last=False)
+
+    def _get_local_bucket(self, digest):
+        """ The key's bucket in this process; call with self._lock held """
+        bucket = self._local.get(digest)
+        if bucket is None:
+            if len(self._local) >= self.MAX_LOCAL_KEYS:
+                idle_since = time.time() - self.BUCKET_TTL_MS / 1000.0
+                self._local = dict((d, b) for d, b in self._local.items() if b.ts > idle_since)
+                if len(self._local) >= self.MAX_LOCAL_KEYS:
+                    self._local.clear()
+            bucket = self._local[digest] = _LocalBucket(self.rate, self.burst)
+        return bucket
+
+    @classmethod
+    def get_redis_scripts(cls):
+        """ The (take token, adjust) scripts registered with Redis, or None if the cache is not Redis """
+        if cls._redis_scripts is None:
+            with cls._redis_lock:
+                if cls._redis_scripts is None:
+                    client = get_redis_client()
+                    if client is not None:
+                        cls._redis_scripts = (client.register_script(_TAKE_TOKEN_SCRIPT),
+                                              client.register_script(_ADJUST_SCRIPT))
+                    else:
+                        cls._redis_scripts = False
+        return cls._redis_scripts or None
+
+    def reserve(self, key):
+        """
+        Takes a token for a request.
+        :return: (taken, seconds): if a token was taken, the request can be sent after waiting that
+         long; if not, the bucket is blocked and reserve should be called again after that long
+        """
+        digest = self.digest(key)
+        scripts = self.get_redis_scripts()
+        if scripts is not None:
+            try:
+                taken, wait_ms, rate = scripts[0](keys=[self.make_key(digest)],
+                                                  args=[int(time.time() * 1000), self.rate, self.burst,
+                                                        self.BUCKET_TTL_MS])
+                self._remember_rate(digest, rate / 1000.0)
+                return bool(taken), wait_ms / 1000.0
+            except Exception:
+                logger.warning("could not take a {} rate limit token from redis".format(self.name), exc_info=True)
+
+        with self._lock:
+            taken, wait, rate = self._get_local_bucket(digest).take(self.rate, self.burst)
+        self._remember_rate(digest, rate)
+        return taken, wait
+
+    def acquire(self, key):
+        """ Blocks until a request can be sent """
+        while True:
+            taken, wait = self.reserve(key)
+            if wait > 0:
+                time.sleep(wait)
+            if taken:
+                return
+
+    def adjust(self, key, rate=None, blocked_for=0):
+        """ Sets the rate of the key's bucket and/or blocks it for `blocked_for` seconds """
+        digest = self.digest(key)
+        if rate is not None:
+            self._remember_rate(digest, rate)
+        blocked_until = time.time() + blocked_for if blocked_for else 0
+        scripts = self.get_redis_scripts()
+        if scripts is not None:
+            try:
+                scripts[1](keys=[self.make_key(digest)],
+                           args=['' if rate is None else rate, int(blocked_until * 1000), self.BUCKET_TTL_MS])
+                return
+            except Exception:
+                logger.warning("could not adjust the {} rate limit in redis".format(self.name), exc_info=True)
+
+        with self._lock:
+            bucket = self._get_local_bucket(digest)
+            if rate is not None:
+                bucket.rate = rate
+            bucket.blocked_until = max(bucket.blocked_until, blocked_until)
+
+    def observe(self, key, response, throttled, retry_after):
+        """ Adapts the key's bucket to a response from the API """
+        current_rate = self.get_rate(key)
+        slower_rate = max(current_rate / 2, self.rate * self.MIN_RATE_FRACTION)
+        if throttled:
+            logger.info("{} rate limit slowed to {:.2f}/s after a {} response".format(
+                self.name, slower_rate, response.status_code))
+            self.adjust(key, rate=slower_rate, blocked_for=retry_after or 0)
+            return
+
+        remaining = response.headers.get('X-Rate-Limit-Remaining') if self.adapt_to_remaining else None
+        if remaining is not None:
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                remaining = None
+        if remaining is not None and remaining < settings.CANVAS_RATE_LIMIT_LOW_WATER:
+            self.adjust(key, rate=slower_rate)
+        elif current_rate < self.rate:
+            self.adjust(key, rate=min(self.rate, current_rate + self.rate / 10))
+
+
+def is_throttled(response):
+    """ Whether the API turned the request away because of load, rather than for what it asked """
+    if response.status_code in (429, 503):
+        return True
+    # Canvas reports throttling as a 403
+    return response.status_code == 403 and b'Rate Limit Exceeded' in (response.content or b'')
+
+
+def get_retry_after(response):
+    """ The seconds the Retry-After header asks us to wait (capped), or None """
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        seconds = float(retry_after)
+    except ValueError:
+        parsed = parsedate_tz(retry_after)
+        if parsed is None:
+            return None
+        seconds = mktime_tz(parsed) - time.time()
+    return min(max(seconds, 0), settings.HTTP_MAX_RETRY_WAIT)
+
+
+def get_backoff(attempt, retry_after=None):
+    """ Seconds to wait before retry number `attempt` (from 0): exponential backoff with full jitter """
+    backoff = random.uniform(0, min(settings.HTTP_MAX_RETRY_WAIT, settings.HTTP_RETRY_BACKOFF * 2 ** attempt))
+    return retry_after + backoff if retry_after else backoff
+
+
+def _should_retry(method, response, attempt, buckets):
+    throttled = is_throttled(response)
+    retry_after = get_retry_after(response)
+    for limiter, key in buckets:
+        limiter.observe(key, response, throttled, retry_after)
+    if throttled and method.upper() in IDEMPOTENT_METHODS and attempt < settings.HTTP_MAX_RETRIES:
+        logger.info("retrying a throttled {} call ({} response), attempt {}".format(
+            method, response.status_code, attempt + 1))
+        return get_backoff(attempt, retry_after)
+    return None
+
+
+def send_request(method, send, buckets):
+    """
+    Sends a request within the rate limits of each (RateLimiter, key) in `buckets`, adapts them to
+    the response, and sends idempotent requests that were throttled again after a backoff (up to
+    settings.HTTP_MAX_RETRIES times).
+    :param send: a function that sends the request and returns its requests.Response
+    :return: the last response
+    """
+    attempt = 0
+    while True:
+        for limiter, key in buckets:
+            limiter.acquire(key)
+        response = send()
+        wait = _should_retry(method, response, attempt, buckets)
+        if wait is None:
+            return response
+        time.sleep(wait)
+        attempt += 1
@@ -87,6 +87,26 @@ STATIC_ROOT = os.path.normpath(os.path.join(BASE_DIR, 'http_static'))
 # false pending IAM discussion
 CREATE_USER_PROFILES_FOR_TEACHERS = False
 
+# Maximum number of independent Canvas/Mediasite calls a single provisioning
+# request makes at the same time
+PROVISIONING_MAX_CONCURRENCY = 8
+
+# Default number of courses the provision_bulk command provisions at the same time.  Each of these
+# runs up to PROVISIONING_MAX_CONCURRENCY calls of its own.
+BULK_PROVISIONING_WORKERS = 4
+
+# Number of provisioning jobs each provision_worker process runs at the same time, and how often
+# (seconds) an idle worker looks for new jobs
+PROVISION_WORKER_CONCURRENCY = SECURE_SETTINGS.get('provision_worker_concurrency', 4)
+PROVISION_WORKER_POLL_INTERVAL = SECURE_SETTINGS.get('provision_worker_poll_interval_secs', 1)
+# A running job whose worker has not reported on it for this long (seconds) is assumed to have lost
+# its worker, and is queued again.  Workers report at least every PROVISION_WORKER_POLL_INTERVAL.
+PROVISION_JOB_TIMEOUT = SECURE_SETTINGS.get('provision_job_timeout_secs', 15 * 60)
+
+# How long (seconds) the Mediasite ids recorded for a provisioned course are trusted without checking
+# that the objects still exist, when the course is provisioned again
+PROVISIONED_COURSE_TRUST_SECS = SECURE_SETTINGS.get('provisioned_course_trust_secs', 60 * 60)
+
 # Database
 # https://docs.djangoproject.com/en/1.8/ref/settings/#databases
 DATABASES = {
@@ -131,6 +151,37 @@ CACHES = {
     },
 }
 
+# How long values cached in the shared cache above are also kept in each worker's memory.  This
+# bounds how long an invalidation made by one worker can go unnoticed by the others.
+LOCAL_CACHE_TIMEOUT = SECURE_SETTINGS.get('local_cache_timeout_secs', 60)
+# How long a lock taken through the shared cache (see mediasite_provisioning.cache.shared_lock) is
+# held at most, e.g. while a Mediasite folder is looked up and created, and how long to wait for one.
+SHARED_LOCK_TIMEOUT = SECURE_SETTINGS.get('shared_lock_timeout_secs', 30)
+# Well known Mediasite ids (the root folder and roles) rarely change, so cache them for a day
+MEDIASITE_FOLDER_CACHE_TIMEOUT = SECURE_SETTINGS.get('mediasite_folder_cache_timeout_secs', 60 * 60 * 24)
+MEDIASITE_ROLE_CACHE_TIMEOUT = SECURE_SETTINGS.get('mediasite_role_cache_timeout_secs', 60 * 60 * 24)
+# The (parent folder, name) -> folder index is refreshed by the sync_mediasite_folders command, so
+# entries should outlive the interval that command is scheduled at.  Entries are checked with a direct
+# get of the folder before they are used.
+MEDIASITE_FOLDER_INDEX_TIMEOUT = SECURE_SETTINGS.get('mediasite_folder_index_timeout_secs', 60 * 60 * 24 * 7)
+# Likewise the LinkedFolderId -> catalog index, refreshed by the sync_mediasite_catalogs command.  Entries are
+# checked with a direct get of the catalog before they are used.
+MEDIASITE_CATALOG_INDEX_TIMEOUT = SECURE_SETTINGS.get('mediasite_catalog_index_timeout_secs', 60 * 60 * 24 * 7)
+MEDIASITE_USER_PROFILE_CACHE_TIMEOUT = SECURE_SETTINGS.get('mediasite_user_profile_cache_timeout_secs', 60 * 60 * 24)
+# Folders, modules, roles and user profiles that were looked up and not found are remembered briefly, so
+# retries and bulk runs don't search for them again.  Creating one through this app forgets the miss; anything
+# created directly in Mediasite is found again once this expires.
+MEDIASITE_NOT_FOUND_CACHE_TIMEOUT = SECURE_SETTINGS.get('mediasite_not_found_cache_timeout_secs', 60)
+# Pages of Canvas course search results are kept briefly, to page back and forth and repeat searches
+# without going back to Canvas; provisioning a course drops the pages it is on
+CANVAS_SEARCH_CACHE_TIMEOUT = SECURE_SETTINGS.get('canvas_search_cache_timeout_secs', 5 * 60)
+# The schools each user can search, from the Canvas accounts they can see.  Users can refresh them
+# from the index page.
+CANVAS_ACCOUNTS_CACHE_TIMEOUT = SECURE_SETTINGS.get('canvas_accounts_cache_timeout_secs', 60 * 60)
+# Catalog settings are only written by this app, which updates the cache as it writes them
+MEDIASITE_CATALOG_SETTINGS_CACHE_TIMEOUT = SECURE_SETTINGS.get('mediasite_catalog_settings_cache_timeout_secs',
+                                                               60 * 60 * 24)
+
 # Turn off default Django logging
 # https://docs.djangoproject.com/en/1.8/topics/logging/#disabling-logging-configuration
 LOGGING_CONFIG = None
@@ -156,3 +207,44 @@ MEDIASITE_PASSWORD = SECURE_SETTINGS.get('mediasite_password')
 # Mediasite OAUTH defaults
 OAUTH_SHARED_SECRET = SECURE_SETTINGS.get('oauth_shared_secret')
 OAUTH_CONSUMER_KEY = SECURE_SETTINGS.get('oauth_consumer_key')
+# Upper bound on the number of Canvas API calls a single request fans out at once; keep this low
+# enough to stay within the Canvas rate limits (1 disables concurrent fetching)
+CANVAS_MAX_CONCURRENT_REQUESTS = SECURE_SETTINGS.get('canvas_max_concurrent_requests', 5)
+# Number of keep-alive connections to Canvas pooled by each worker process
+CANVAS_HTTP_POOL_SIZE = SECURE_SETTINGS.get('canvas_http_pool_size', 10)
+# Page size requested from the Canvas list endpoints (Canvas caps this at 100)
+CANVAS_PER_PAGE = SECURE_SETTINGS.get('canvas_per_page', 100)
+# Number of keep-alive connections to Mediasite pooled by each worker process; bulk provisioning
+# makes up to BULK_PROVISIONING_WORKERS * PROVISIONING_MAX_CONCURRENCY calls at once
+MEDIASITE_HTTP_POOL_SIZE = SECURE_SETTINGS.get('mediasite_http_pool_size', 32)
+# Upper bound on the number of Mediasite API calls a single batched lookup makes at once
+MEDIASITE_MAX_CONCURRENT_REQUESTS = SECURE_SETTINGS.get('mediasite_max_concurrent_requests', 8)
+# Longest OData $filter sent to Mediasite when lookups are combined into one query, which keeps the
+# url well inside server url length limits
+MEDIASITE_MAX_FILTER_LENGTH = SECURE_SETTINGS.get('mediasite_max_filter_length', 1500)
+# Number of results requested per page from Mediasite queries
+MEDIASITE_PAGE_SIZE = SECURE_SETTINGS.get('mediasite_page_size', 100)
+
+# Outbound rate limits, in requests a second (and the burst allowed above that), shared by every
+# worker process through redis; see mediasite_provisioning.ratelimit.  Canvas limits each API token
+# as well as the host as a whole.
+CANVAS_HOST_RATE_LIMIT = SECURE_SETTINGS.get('canvas_host_rate_limit', 50)
+CANVAS_HOST_RATE_LIMIT_BURST = SECURE_SETTINGS.get('canvas_host_rate_limit_burst', 100)
+CANVAS_TOKEN_RATE_LIMIT = SECURE_SETTINGS.get('canvas_token_rate_limit', 10)
+CANVAS_TOKEN_RATE_LIMIT_BURST = SECURE_SETTINGS.get('canvas_token_rate_limit_burst', 50)
+MEDIASITE_RATE_LIMIT = SECURE_SETTINGS.get('mediasite_rate_limit', 50)
+MEDIASITE_RATE_LIMIT_BURST = SECURE_SETTINGS.get('mediasite_rate_limit_burst', 100)
+# Canvas reports the quota left to a token (out of 700 by default) in X-Rate-Limit-Remaining; the
+# token's rate is halved whenever it drops below this
+CANVAS_RATE_LIMIT_LOW_WATER = SECURE_SETTINGS.get('canvas_rate_limit_low_water', 150)
+# Idempotent calls that are throttled (429, 503 or Canvas' 403 Rate Limit Exceeded) are retried
+# this many times, after a jittered exponential backoff starting at HTTP_RETRY_BACKOFF seconds
+HTTP_MAX_RETRIES = SECURE_SETTINGS.get('http_max_retries', 4)
+HTTP_RETRY_BACKOFF = SECURE_SETTINGS.get('http_retry_backoff_secs', 0.5)
+# Longest a single retry waits, including any Retry-After
+HTTP_MAX_RETRY_WAIT = SECURE_SETTINGS.get('http_max_retry_wait_secs', 30)
+
+# Each process adds its API call and cache metrics to the totals in redis this often (seconds)
+METRICS_FLUSH_INTERVAL = SECURE_SETTINGS.get('metrics_flush_interval_secs', 15)
+# Addresses (e.g. the Prometheus server) that may read /metrics without logging in as staff
+METRICS_ALLOWED_IPS = SECURE_SETTINGS.get('metrics_allowed_ips', ['127.0.0.1'])
@@ -0,0 +1,7 @@
+# local verification only -- never commit
+SECURE_SETTINGS = {
+    'mediasite_base_url': 'http://mediasite.invalid/',
+    'mediasite_api_path': 'api/v1/{0}',
+    'mediasite_lti_launch_path': 'lti',
+    'canvas_url': 'http://canvas.invalid/{0}',
+}
@@ -0,0 +1 @@
+default_app_config = 'web.apps.WebConfig'
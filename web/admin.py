@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import School, APIUser, Log
+from django.core.urlresolvers import reverse
+from django.utils.html import format_html
+from .jobs import enqueue_catalog_settings_job
+from .models import School, APIUser, Log, CatalogSettingsJob, ProvisionedCourse, ProvisionJob
 
 class LogAdmin(admin.ModelAdmin):
     model = Log
@@ -9,6 +12,30 @@ class LogAdmin(admin.ModelAdmin):
 
 class SchoolAdmin(admin.ModelAdmin):
     list_display = ('canvas_id', 'name', 'mediasite_root_folder')
+    catalog_settings_fields = ('catalog_show_date', 'catalog_show_time', 'catalog_items_per_page')
+
+    def save_model(self, request, obj, form, change):
+        super(SchoolAdmin, self).save_model(request, obj, form, change)
+        # bring the school's existing catalogs in line with its new settings; there can be too many
+        # to do within the request, so the provision_worker command does it
+        if change and any(f in form.changed_data for f in self.catalog_settings_fields):
+            job = enqueue_catalog_settings_job(obj)
+            self.message_user(request, format_html(
+                'The new catalog settings will be applied to the catalogs of the school\'s provisioned courses, '
+                'and to those in its Mediasite folders that sync_mediasite_catalogs has indexed; see '
+                '<a href="{0}">its progress</a>.', reverse('admin:web_catalogsettingsjob_change', args=(job.id,))))
+
+class ProvisionJobAdmin(admin.ModelAdmin):
+    list_display = ('created', 'user', 'school', 'course_id', 'status', 'finished')
+    list_filter = ('status',)
+
+class CatalogSettingsJobAdmin(admin.ModelAdmin):
+    list_display = ('created', 'school', 'status', 'total', 'updated', 'unchanged', 'failed', 'finished')
+    list_filter = ('status',)
+
+class ProvisionedCourseAdmin(admin.ModelAdmin):
+    list_display = ('sis_course_id', 'canvas_course_id', 'school', 'catalog_url', 'provisioned', 'verified')
+    search_fields = ('sis_course_id', 'canvas_course_id')
 
 class APIUserInline(admin.StackedInline):
     model = APIUser
@@ -18,5 +45,8 @@ class ExtendedUserAdmin(UserAdmin):
 
 admin.site.register(Log, LogAdmin)
 admin.site.register(School, SchoolAdmin)
+admin.site.register(ProvisionJob, ProvisionJobAdmin)
+admin.site.register(CatalogSettingsJob, CatalogSettingsJobAdmin)
+admin.site.register(ProvisionedCourse, ProvisionedCourseAdmin)
 admin.site.unregister(User)
 admin.site.register(User, ExtendedUserAdmin)
\ No newline at end of file
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
+
+
+class WebConfig(AppConfig):
+    name = 'web'
+
+    def ready(self):
+        from .models import School
+        from .schools import invalidate_schools
+
+        # every worker keeps a snapshot of the schools; see web.schools
+        post_save.connect(invalidate_schools, sender=School, dispatch_uid='web.schools.post_save')
+        post_delete.connect(invalidate_schools, sender=School, dispatch_uid='web.schools.post_delete')
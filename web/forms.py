@@ -1,7 +1,39 @@
 from django import forms
 
-from .models import School
+from .schools import get_schools
 from canvas.apimethods import CanvasAPI
+from mediasite_provisioning.cache import TieredCache
+
+# user id -> the ids of the Canvas accounts a (non staff) user can see.  Kept only in the shared
+# tier, so that a refresh is seen by every worker at once.  The schools are matched to them on each
+# request, so adding, renaming or removing a school shows at once.
+_account_ids_cache = TieredCache('web:account_ids', 'CANVAS_ACCOUNTS_CACHE_TIMEOUT', local_tier=False)
+
+
+def get_account_choices(user, refresh=False):
+    """
+    The (canvas_id, name) of the schools a user can search: every school for staff, otherwise the
+    schools of the Canvas accounts the user can see.  As listing the accounts walks every page of
+    them, the user's account ids are cached for settings.CANVAS_ACCOUNTS_CACHE_TIMEOUT, unless
+    `refresh` is set.
+    """
+    schools = get_schools()
+    if user.is_staff:
+        return [(s.canvas_id, s.name) for s in schools]
+
+    key = str(user.id)
+    account_ids = None if refresh else _account_ids_cache.get(key)
+    if account_ids is None:
+        canvas_api = CanvasAPI(user=user)
+        accounts = canvas_api.get_accounts_for_current_user()
+        account_ids = sorted(set([str(a.id) for a in accounts]))
+        _account_ids_cache.set(key, account_ids)
+    account_ids = set(account_ids)
+    return [(s.canvas_id, s.name) for s in schools if s.canvas_id in account_ids]
+
+
+def invalidate_account_choices(user):
+    _account_ids_cache.delete(str(user.id))
 
 
 class IndexForm(forms.Form):
@@ -12,15 +44,9 @@ class IndexForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user')
+        refresh = kwargs.pop('refresh', False)
         super(IndexForm, self).__init__(*args, **kwargs)
 
-        schools = School.objects.order_by('name').values_list(
-            'canvas_id', 'name')
-
-        if not self.user.is_staff:
-            canvas_api = CanvasAPI(user=self.user)
-            accounts = canvas_api.get_accounts_for_current_user()
-            account_ids = set([a.id for a in accounts])
-            schools = schools.filter(canvas_id__in=account_ids)
+        schools = get_account_choices(self.user, refresh=refresh)
 
         self.fields['accounts'] = forms.ChoiceField(schools, required=True)
@@ -0,0 +1,206 @@
+from __future__ import unicode_literals
+
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import CatalogSettingsJob, ProvisionJob, School
+from .provisioning import ProvisioningError, apply_school_catalog_settings, provision_course
+from canvas.apimethods import CanvasAPI, CanvasServiceException
+from mediasite.apimethods import MediasiteServiceException
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_job(user, school, course_id, root_folder=None, term=None, year=None):
+    """
+    Queues a course to be provisioned by the provision_worker command.  If the user already has the
+    course queued or being provisioned, that job is returned instead of queueing it again; a unique
+    index on the user's active jobs (migration 0011) keeps concurrent requests from queueing it twice.
+    """
+    active = ProvisionJob.objects.filter(user=user, school=school, course_id=course_id,
+                                         status__in=(ProvisionJob.QUEUED, ProvisionJob.RUNNING))
+    existing = active.first()
+    if existing is not None:
+        return existing
+    try:
+        with transaction.atomic():
+            return ProvisionJob.objects.create(user=user, school=school, course_id=course_id,
+                                               root_folder=root_folder, term=term, year=year)
+    except IntegrityError:
+        # another request queued it in the meantime
+        existing = active.first()
+        if existing is None:
+            raise
+        return existing
+
+
+def claim_jobs(limit):
+    """
+    Marks up to `limit` of the oldest queued jobs as running, and returns them.  Any number of
+    workers can claim jobs at the same time: rows another worker has locked are skipped (where the
+    database supports it), and a job is only returned if this worker is the one that moved it out of
+    the queue.  A job for a course that is already being provisioned (for another user) waits until
+    that one is done.
+
+    Workers report on the jobs they are running with touch_jobs.  Jobs that have not been reported
+    on for longer than settings.PROVISION_JOB_TIMEOUT, e.g. because their worker was killed, are
+    queued again first.
+    """
+    if limit <= 0:
+        return []
+    stale = timezone.now() - datetime.timedelta(seconds=settings.PROVISION_JOB_TIMEOUT)
+    ProvisionJob.objects.filter(Q(heartbeat__lt=stale) | Q(heartbeat__isnull=True, started__lt=stale),
+                                status=ProvisionJob.RUNNING).update(status=ProvisionJob.QUEUED)
+
+    claimed = list()
+    # courses already being provisioned are left out before the oldest are taken, so that they can't
+    # hold up the jobs queued after them
+    course_running = ProvisionJob.objects.filter(status=ProvisionJob.RUNNING, school_id=OuterRef('school_id'),
+                                                 course_id=OuterRef('course_id'))
+    with transaction.atomic():
+        candidates = list(ProvisionJob.objects.select_for_update(skip_locked=True)
+                          .annotate(course_running=Exists(course_running))
+                          .filter(status=ProvisionJob.QUEUED, course_running=False).order_by('created')[:limit])
+        running = set()
+        for job in candidates:
+            # two users' jobs for the same course
+            if (job.school_id, job.course_id) in running:
+                continue
+            started = timezone.now()
+            if ProvisionJob.objects.filter(id=job.id, status=ProvisionJob.QUEUED)\
+                    .update(status=ProvisionJob.RUNNING, started=started, heartbeat=started):
+                job.status = ProvisionJob.RUNNING
+                job.started = job.heartbeat = started
+                claimed.append(job)
+                running.add((job.school_id, job.course_id))
+    return claimed
+
+
+def touch_jobs(jobs):
+    """
+    Records that the worker running these jobs (provisioning or catalog settings jobs) is still
+    alive, so claim_jobs and claim_catalog_settings_jobs leave them be
+    """
+    now = timezone.now()
+    for model in set(type(job) for job in jobs):
+        model.objects.filter(id__in=[job.id for job in jobs if isinstance(job, model)], status=model.RUNNING)\
+            .update(heartbeat=now)
+
+
+def run_job(job):
+    """
+    Provisions the job's course, recording the catalog url or the error on the job.  The outcome is
+    only recorded if the job is still this run's claim, i.e. it was not queued again (see
+    claim_jobs) and claimed by another worker meanwhile.
+    """
+    try:
+        canvas_api = CanvasAPI(user=job.user)
+        course_catalog = provision_course(canvas_api,
+                                          job.school,
+                                          course_id=job.course_id,
+                                          mediasite_root_folder=job.root_folder or None,
+                                          term=job.term or None,
+                                          year=job.year or None,
+                                          username=job.user.username)
+        job.status = ProvisionJob.SUCCEEDED
+        job.catalog_url = course_catalog.CatalogUrl
+    except Exception as e:
+        logger.exception("{} could not provision course {}".format(job.user.username, job.course_id))
+        job.status = ProvisionJob.FAILED
+        job.error = describe_error(e)
+    job.finished = timezone.now()
+    if not ProvisionJob.objects.filter(id=job.id, status=ProvisionJob.RUNNING, started=job.started)\
+            .update(status=job.status, catalog_url=job.catalog_url, error=job.error, finished=job.finished):
+        logger.warning("provisioning job {} was claimed again while it ran, so its outcome ({}) was "
+                       "not recorded".format(job.id, job.status))
+    return job
+
+
+def enqueue_catalog_settings_job(school):
+    """
+    Queues the school's catalog settings to be applied to its catalogs by the provision_worker
+    command.  If that is already queued (and not yet started), that job is returned instead.
+    """
+    existing = CatalogSettingsJob.objects.filter(school=school, status=CatalogSettingsJob.QUEUED).first()
+    if existing is not None:
+        return existing
+    return CatalogSettingsJob.objects.create(school=school)
+
+
+def claim_catalog_settings_jobs(limit):
+    """
+    Marks up to `limit` of the oldest queued catalog settings jobs as running, and returns them, as
+    claim_jobs does for provisioning jobs.  A school's job waits while another one for the school is
+    running.
+    """
+    if limit <= 0:
+        return []
+    stale = timezone.now() - datetime.timedelta(seconds=settings.PROVISION_JOB_TIMEOUT)
+    CatalogSettingsJob.objects.filter(Q(heartbeat__lt=stale) | Q(heartbeat__isnull=True, started__lt=stale),
+                                      status=CatalogSettingsJob.RUNNING).update(status=CatalogSettingsJob.QUEUED)
+
+    claimed = list()
+    school_running = CatalogSettingsJob.objects.filter(status=CatalogSettingsJob.RUNNING,
+                                                       school_id=OuterRef('school_id'))
+    with transaction.atomic():
+        candidates = list(CatalogSettingsJob.objects.select_for_update(skip_locked=True)
+                          .annotate(school_running=Exists(school_running))
+                          .filter(status=CatalogSettingsJob.QUEUED, school_running=False).order_by('created')[:limit])
+        running = set()
+        for job in candidates:
+            if job.school_id in running:
+                continue
+            started = timezone.now()
+            if CatalogSettingsJob.objects.filter(id=job.id, status=CatalogSettingsJob.QUEUED)\
+                    .update(status=CatalogSettingsJob.RUNNING, started=started, heartbeat=started,
+                            total=None, updated=0, unchanged=0, failed=0, error=None):
+                job.status = CatalogSettingsJob.RUNNING
+                job.started = job.heartbeat = started
+                claimed.append(job)
+                running.add(job.school_id)
+    return claimed
+
+
+def run_catalog_settings_job(job):
+    """
+    Applies the school's current catalog settings to its catalogs, recording the counts on the job
+    as it goes so its progress shows in the admin.  As with run_job, only the current claim of the
+    job records anything.
+    """
+    claim = CatalogSettingsJob.objects.filter(id=job.id, status=CatalogSettingsJob.RUNNING, started=job.started)
+
+    def record_progress(total, results):
+        job.total = total
+        job.updated, job.unchanged, job.failed = results['updated'], results['unchanged'], results['failed']
+        claim.update(total=job.total, updated=job.updated, unchanged=job.unchanged, failed=job.failed,
+                     heartbeat=timezone.now())
+
+    try:
+        # the settings as they are now, not as they were when the job was queued
+        school = School.objects.get(id=job.school_id)
+        apply_school_catalog_settings(school, on_progress=record_progress)
+    except Exception as e:
+        logger.exception("could not apply the catalog settings of school {}".format(job.school_id))
+        job.error = describe_error(e)
+    job.status = CatalogSettingsJob.FINISHED
+    job.finished = timezone.now()
+    if not claim.update(status=job.status, error=job.error, finished=job.finished):
+        logger.warning("catalog settings job {} was claimed again while it ran, so its outcome was not "
+                       "recorded".format(job.id))
+    return job
+
+
+def describe_error(e):
+    """ The message shown to the user for an error provisioning a course """
+    if isinstance(e, ProvisioningError):
+        return str(e)
+    if isinstance(e, CanvasServiceException):
+        return 'Canvas error : {0} [{1}]'.format(e, e._canvas_exception)
+    if isinstance(e, MediasiteServiceException):
+        return 'Mediasite error : {0} [{1}-{2}]'.format(e, e._mediasite_exception, e.server_error())
+    return 'Unknown error : {0}'.format(e)
@@ -0,0 +1,56 @@
+from __future__ import unicode_literals
+
+import json
+import os
+import timeit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from canvas.apimethods import course_decoder
+from canvas.apimodels import Course
+from canvas.serializer import CourseSerializer
+from mediasite.apimethods import folder_decoder
+from mediasite.apimodels import Folder
+from mediasite.serializer import FolderSerializer
+from mediasite_provisioning import decoder
+
+
+def load_payload(app, name):
+    with open(os.path.join(settings.BASE_DIR, app, 'testdata', name)) as f:
+        return json.load(f)
+
+
+class Command(BaseCommand):
+    help = ('Compares decoding recorded Canvas course and Mediasite folder listings with the serializers, '
+            'and with the fast decoders in strict and trusted mode')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help='Number of records in each listing')
+
+    def handle(self, *args, **options):
+        courses = load_payload('canvas', 'courses.json')
+        folders = load_payload('mediasite', 'folders.json')['value']
+        benchmarks = (
+            ('canvas courses', CourseSerializer, Course, course_decoder,
+             (courses * (options['count'] // len(courses) + 1))[:options['count']]),
+            ('mediasite folders', FolderSerializer, Folder, folder_decoder,
+             (folders * (options['count'] // len(folders) + 1))[:options['count']]),
+        )
+
+        for label, serializer_class, model_class, model_decoder, payload in benchmarks:
+            def with_serializer():
+                serializer = serializer_class(data=payload, many=True)
+                serializer.is_valid(raise_exception=True)
+                return [model_class(**attrs) for attrs in serializer.validated_data]
+
+            for mode, func in (('serializer', with_serializer),
+                               ('decoder (strict)', lambda: model_decoder.build_many(payload)),
+                               ('decoder (trusted)', lambda: model_decoder.build_many(payload))):
+                decoder.set_trusted_mode(mode == 'decoder (trusted)')
+                try:
+                    secs = min(timeit.repeat(func, number=1, repeat=5))
+                finally:
+                    decoder.set_trusted_mode(False)
+                self.stdout.write('{0:<18} {1:<18} {2:8.1f} us/record'.format(
+                    label, mode, secs / len(payload) * 1e6))
@@ -0,0 +1,152 @@
+from __future__ import unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from canvas.fakeserver import FakeCanvasServer
+from mediasite.fakeserver import FakeMediasiteServer
+from mediasite_provisioning.cache import TieredCache
+from web.jobs import claim_jobs, run_job
+from web.models import APIUser, ProvisionJob, School
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[int(round(percent / 100.0 * (len(values) - 1)))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = ('Drives the search and provision views against in-process fake Canvas and Mediasite servers, '
+            'at each concurrency level, then runs the queued provisioning jobs as provision_worker would, '
+            'and reports their p50/p95 latency, throughput and the number of '
+            'calls they make to Canvas and Mediasite.  Runs in a throwaway test database and a local '
+            'memory cache, so nothing is written to the configured ones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,4,16',
+                            help='Comma separated numbers of requests to make at the same time (default 1,4,16)')
+        parser.add_argument('--requests', type=int, default=20,
+                            help='Number of searches, and of courses provisioned, at each concurrency level')
+        parser.add_argument('--latency', type=float, default=20,
+                            help='Milliseconds each fake Canvas and Mediasite call takes (default 20)')
+        parser.add_argument('--jitter', type=float, default=0,
+                            help='Up to this many more milliseconds are added to each call, at random')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Fraction of the Canvas and Mediasite calls that fail with a 503')
+        parser.add_argument('--rate-limits', action='store_true',
+                            help='Keep the configured outbound rate limits, rather than lifting them')
+
+    def handle(self, *args, **options):
+        levels = [int(c) for c in options['concurrency'].split(',')]
+        fake_options = dict(latency=options['latency'] / 1000.0, jitter=options['jitter'] / 1000.0,
+                            error_rate=options['error_rate'], seed=0)
+        overrides = dict(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                             'LOCATION': 'benchmark_provisioning'}})
+        if not options['rate_limits']:
+            overrides.update(CANVAS_HOST_RATE_LIMIT=1e6, CANVAS_TOKEN_RATE_LIMIT=1e6, MEDIASITE_RATE_LIMIT=1e6)
+
+        with FakeCanvasServer(**fake_options) as canvas_server, \
+                FakeMediasiteServer(**fake_options) as mediasite_server, \
+                override_settings(**dict(overrides, **dict(canvas_server.settings(), **mediasite_server.settings()))):
+            for cache in TieredCache.all_caches:
+                cache.clear_local()
+            account = canvas_server.populate(courses=options['requests'] * len(levels))
+            courses = [c for c in canvas_server.courses.values() if c['account_id'] == account['id']]
+
+            setup_test_environment()
+            old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                user = User.objects.create(username='benchmark')
+                APIUser.objects.create(user=user, canvas_api_key='benchmark-token')
+                school = School.objects.create(canvas_id=str(account['id']), name=account['name'],
+                                               mediasite_root_folder='Benchmark', consumer_key='benchmark',
+                                               shared_secret='benchmark', catalog_items_per_page=100)
+
+                self.stdout.write('{0:<10} {1:>11} {2:>8} {3:>9} {4:>9} {5:>10} {6:>14} {7:>17} {8:>7}'.format(
+                    'view', 'concurrency', 'requests', 'p50 ms', 'p95 ms', 'req/s', 'canvas calls/req',
+                    'mediasite calls/req', 'errors'))
+                for concurrency in levels:
+                    search = dict(accounts=school.canvas_id, search='FAKE', page='1')
+                    self.run_phase('search', concurrency, user, [('web:index', search)] * options['requests'],
+                                   canvas_server, mediasite_server)
+
+                    to_provision = [courses.pop() for n in range(options['requests'])]
+                    self.run_phase('enqueue', concurrency, user,
+                                   [('web:provision', dict(account_id=school.canvas_id, course_id=c['id'],
+                                                           root_folder=school.mediasite_root_folder,
+                                                           term=c['term']['name'], year='2016-2017'))
+                                    for c in to_provision],
+                                   canvas_server, mediasite_server)
+                    self.run_jobs(concurrency, canvas_server, mediasite_server)
+            finally:
+                connection.creation.destroy_test_db(old_database_name, verbosity=0)
+                teardown_test_environment()
+
+    def run_phase(self, view, concurrency, user, requests, canvas_server, mediasite_server):
+        # each thread borrows a logged in client; logging them in here keeps the session writes
+        # off the worker threads
+        clients = queue.Queue()
+        for n in range(concurrency):
+            client = Client()
+            client.force_login(user)
+            clients.put(client)
+
+        def post(request):
+            url_name, data = request
+            client = clients.get()
+            start_time = time.time()
+            try:
+                response = client.post(reverse(url_name), data)
+                elapsed_secs = time.time() - start_time
+                # the search page reports errors within a 200 response
+                if url_name == 'web:index':
+                    ok = response.status_code == 200 and b'SIS COURSE ID' in response.content
+                else:
+                    ok = response.status_code == 202
+                return elapsed_secs, ok
+            finally:
+                clients.put(client)
+                connections.close_all()
+
+        canvas_server.reset_calls()
+        mediasite_server.reset_calls()
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(post, requests))
+        self.report(view, concurrency, results, time.time() - start_time, canvas_server, mediasite_server)
+
+    def run_jobs(self, concurrency, canvas_server, mediasite_server):
+        """ Runs every queued job, `concurrency` at a time, timing each from when it was claimed """
+        def run(job):
+            try:
+                job = run_job(job)
+                return (job.finished - job.started).total_seconds(), job.status == ProvisionJob.SUCCEEDED
+            finally:
+                connections.close_all()
+
+        canvas_server.reset_calls()
+        mediasite_server.reset_calls()
+        start_time = time.time()
+        results = list()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            jobs = claim_jobs(concurrency)
+            while jobs:
+                results.extend(executor.map(run, jobs))
+                jobs = claim_jobs(concurrency)
+        self.report('provision', concurrency, results, time.time() - start_time, canvas_server, mediasite_server)
+
+    def report(self, view, concurrency, results, elapsed_secs, canvas_server, mediasite_server):
+        latencies = [r[0] for r in results]
+        count = max(len(results), 1)
+        self.stdout.write('{0:<10} {1:>11} {2:>8} {3:>9.1f} {4:>9.1f} {5:>10.2f} {6:>14.1f} {7:>17.1f} {8:>7}'.format(
+            view, concurrency, len(results), percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+            len(results) / elapsed_secs, canvas_server.call_count() / float(count),
+            mediasite_server.call_count() / float(count), sum(1 for r in results if not r[1])))
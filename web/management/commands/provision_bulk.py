@@ -0,0 +1,74 @@
+from __future__ import unicode_literals
+
+import csv
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from canvas.apimethods import CanvasAPI
+from mediasite_provisioning import decoder
+from mediasite_provisioning.metrics import registry
+from web.models import School
+from web.provisioning import provision_courses
+
+
+class Command(BaseCommand):
+    help = ('Provisions Mediasite for every course in a Canvas account and term, or for a CSV of '
+            'Canvas course ids.  Courses that are already provisioned are skipped, so an interrupted '
+            'run can simply be started again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', required=True,
+                            help='Canvas id of the school account; its School settings are used')
+        parser.add_argument('--term', help='Canvas enrollment term id to provision the courses of')
+        parser.add_argument('--csv', help='CSV file whose first column is the Canvas course ids to provision')
+        parser.add_argument('--user', required=True,
+                            help='Username whose Canvas API key is used to talk to Canvas')
+        parser.add_argument('--workers', type=int, default=settings.BULK_PROVISIONING_WORKERS,
+                            help='Number of courses to provision at the same time')
+        parser.add_argument('--force', action='store_true',
+                            help='Provision courses even if they already have the Mediasite link')
+        parser.add_argument('--strict', action='store_true',
+                            help='Fully validate every Canvas and Mediasite payload, instead of trusting them')
+
+    def handle(self, *args, **options):
+        if bool(options['term']) == bool(options['csv']):
+            raise CommandError('Provide exactly one of --term or --csv')
+
+        try:
+            school = School.objects.get(canvas_id=options['account'])
+        except School.DoesNotExist:
+            raise CommandError('There is no school for Canvas account {0}'.format(options['account']))
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('There is no user {0}'.format(options['user']))
+
+        # this process only runs the bulk job, so it can trust the API payloads
+        decoder.set_trusted_mode(not options['strict'])
+
+        canvas_api = CanvasAPI(user=user)
+        if options['csv']:
+            courses = self.get_course_ids_from_csv(options['csv'])
+        else:
+            courses = canvas_api.get_courses_for_account(options['account'], enrollment_term_id=options['term'])
+
+        summary = provision_courses(canvas_api, school, courses,
+                                    workers=options['workers'],
+                                    skip_provisioned=not options['force'],
+                                    username=user.username,
+                                    on_result=self.write_result)
+        # so the last calls of the job show up in /metrics
+        registry.flush()
+        self.stdout.write(str(summary))
+
+    def get_course_ids_from_csv(self, path):
+        # skips a header row, if there is one
+        with open(path) as csv_file:
+            for row in csv.reader(csv_file):
+                if row and row[0].strip().isdigit():
+                    yield row[0].strip()
+
+    def write_result(self, course_id, status, detail):
+        self.stdout.write('{0}\t{1}\t{2}'.format(course_id, status, detail or ''))
@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from web.jobs import (claim_catalog_settings_jobs, claim_jobs, run_catalog_settings_job, run_job,
+                      touch_jobs)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Runs the provisioning and catalog settings jobs queued by the web app, several at a time.  '
+            'Run as many of these processes as needed; each job is only run by one of them.  Stops, after '
+            'finishing the jobs it is running, on SIGTERM or SIGINT.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.PROVISION_WORKER_CONCURRENCY,
+                            help='Number of jobs to run at the same time')
+        parser.add_argument('--poll-interval', type=float, default=settings.PROVISION_WORKER_POLL_INTERVAL,
+                            help='Seconds to wait before looking for new jobs, and between reports on the '
+                                 'jobs being run')
+        parser.add_argument('--once', action='store_true',
+                            help='Run the jobs that are queued, then exit')
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        logger.info("provision worker started, running up to {} jobs at a time".format(concurrency))
+        # future -> the job it runs
+        in_flight = dict()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while in_flight or not self.stopping:
+                if not self.stopping:
+                    jobs = claim_jobs(concurrency - len(in_flight))
+                    in_flight.update((executor.submit(self.run_job, job), job) for job in jobs)
+                    jobs = claim_catalog_settings_jobs(concurrency - len(in_flight))
+                    in_flight.update((executor.submit(self.run_catalog_settings_job, job), job) for job in jobs)
+                if in_flight:
+                    # so claim_jobs does not take them for jobs whose worker went away
+                    touch_jobs(in_flight.values())
+                # the claims were made on this thread's connection; don't hold it while waiting
+                connections.close_all()
+
+                if not in_flight:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                # wait for a job to finish, or until the next poll
+                done = wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)[0]
+                for future in done:
+                    del in_flight[future]
+        logger.info("provision worker stopped")
+
+    def run_job(self, job):
+        start_time = time.time()
+        try:
+            job = run_job(job)
+            logger.info("provisioning job {} for course {} {} in {:.1f}s".format(
+                job.id, job.course_id, job.status, time.time() - start_time))
+        except Exception:
+            logger.exception("provisioning job {} could not be recorded".format(job.id))
+        finally:
+            # worker threads get their own database connections
+            connections.close_all()
+
+    def run_catalog_settings_job(self, job):
+        start_time = time.time()
+        try:
+            job = run_catalog_settings_job(job)
+            logger.info("catalog settings job {} for school {}: {} of {} catalogs updated, {} unchanged, {} failed "
+                        "in {:.1f}s".format(job.id, job.school_id, job.updated, job.total, job.unchanged,
+                                            job.failed, time.time() - start_time))
+        except Exception:
+            logger.exception("catalog settings job {} could not be recorded".format(job.id))
+        finally:
+            connections.close_all()
+
+    def stop(self, signum, frame):
+        logger.info("provision worker stopping after its current jobs")
+        self.stopping = True
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.12 on 2026-10-18 11:21
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('web', '0007_mediasite_root_folder_required_20161019_1943'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProvisionJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_id', models.TextField()),
+                ('root_folder', models.TextField(blank=True, null=True)),
+                ('term', models.TextField(blank=True, null=True)),
+                ('year', models.TextField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('catalog_url', models.TextField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('school', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='web.School')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='provisionjob',
+            index_together=set([('status', 'created')]),
+        ),
+    ]
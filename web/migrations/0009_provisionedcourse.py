@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.12 on 2026-10-18 11:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0008_provisionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProvisionedCourse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('canvas_course_id', models.TextField(unique=True)),
+                ('sis_course_id', models.TextField()),
+                ('mediasite_root_folder', models.TextField()),
+                ('term', models.TextField()),
+                ('year', models.TextField(blank=True, null=True)),
+                ('folder_id', models.TextField()),
+                ('catalog_id', models.TextField()),
+                ('catalog_url', models.TextField()),
+                ('module_id', models.TextField()),
+                ('course_role_id', models.TextField()),
+                ('instructor_role_id', models.TextField()),
+                ('ta_role_id', models.TextField()),
+                ('provisioned', models.DateTimeField(auto_now_add=True)),
+                ('verified', models.DateTimeField()),
+                ('school', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='web.School')),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.12 on 2026-10-18 11:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_canvas_ids(apps, schema_editor):
+    """
+    Stops the migration, before the unique index would fail, if schools share a Canvas account.
+    Which of them to keep (their settings and consumer keys may differ) is not for a migration to
+    decide: point the ProvisionJob and ProvisionedCourse rows of the others at the one to keep,
+    delete the others in the admin, and migrate again.
+    """
+    School = apps.get_model('web', 'School')
+    duplicate_ids = School.objects.values('canvas_id').annotate(count=Count('id')).filter(count__gt=1)\
+        .values_list('canvas_id', flat=True)
+    duplicates = ['{0} (schools {1})'.format(canvas_id, ', '.join(
+        str(school_id) for school_id in School.objects.filter(canvas_id=canvas_id).values_list('id', flat=True)))
+        for canvas_id in duplicate_ids]
+    if duplicates:
+        raise RuntimeError('Schools share these Canvas account ids, so canvas_id cannot be made unique: {0}.  '
+                           'Keep one school for each (see web/migrations/0010_school_canvas_id_unique.py) and '
+                           'migrate again.'.format(', '.join(duplicates)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0009_provisionedcourse'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_canvas_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='school',
+            name='canvas_id',
+            field=models.TextField(unique=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    """ Only the newest of a user's active jobs for a course may stay active under the new index """
+    ProvisionJob = apps.get_model('web', 'ProvisionJob')
+    seen = set()
+    for job in ProvisionJob.objects.filter(status__in=('queued', 'running')).order_by('-created'):
+        key = (job.user_id, job.school_id, job.course_id)
+        if key in seen:
+            job.status = 'failed'
+            job.error = 'Superseded by a newer request to provision this course'
+            job.save(update_fields=['status', 'error'])
+        seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0010_school_canvas_id_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provisionjob',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        # a user can only have one queued or running job per course (see web.jobs.enqueue_job); the
+        # ORM of this Django version cannot declare a partial index, but postgres and sqlite both have them
+        migrations.RunSQL(
+            ["CREATE UNIQUE INDEX web_provisionjob_active_uniq ON web_provisionjob (user_id, school_id, course_id) "
+             "WHERE status IN ('queued', 'running')"],
+            ["DROP INDEX web_provisionjob_active_uniq"],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0011_provisionjob_heartbeat_active_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogSettingsJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('finished', 'Finished')], default='queued', max_length=16)),
+                ('total', models.IntegerField(blank=True, null=True)),
+                ('updated', models.IntegerField(default=0)),
+                ('unchanged', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('school', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='web.School')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='catalogsettingsjob',
+            index_together=set([('status', 'created')]),
+        ),
+    ]
@@ -3,7 +3,7 @@ from django.db import models
 
 
 class School(models.Model):
-    canvas_id = models.TextField()
+    canvas_id = models.TextField(unique=True)
     name = models.TextField()
     mediasite_root_folder = models.TextField(blank=False, null=False)
     consumer_key = models.TextField(blank=True, null=True)
@@ -23,3 +23,95 @@ class Log(models.Model):
     created = models.DateTimeField(auto_now=True)
     error = models.TextField()
 
+
+class ProvisionJob(models.Model):
+    """ A request to provision a course, run by the provision_worker command (see web.jobs) """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    school = models.ForeignKey(School, on_delete=models.CASCADE)
+    course_id = models.TextField()
+    root_folder = models.TextField(blank=True, null=True)
+    term = models.TextField(blank=True, null=True)
+    year = models.TextField(blank=True, null=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    catalog_url = models.TextField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    # when the worker running the job last reported it was alive, see web.jobs.touch_jobs
+    heartbeat = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        index_together = (('status', 'created'),)
+
+    @property
+    def is_finished(self):
+        return self.status in (ProvisionJob.SUCCEEDED, ProvisionJob.FAILED)
+
+
+class CatalogSettingsJob(models.Model):
+    """
+    A request to apply a school's catalog settings to its existing catalogs, queued when the
+    settings are changed in the admin and run by the provision_worker command (see web.jobs)
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FINISHED, 'Finished'),
+    )
+
+    school = models.ForeignKey(School, on_delete=models.CASCADE)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    # the number of catalogs found for the school, and how many of them have been done so far
+    total = models.IntegerField(blank=True, null=True)
+    updated = models.IntegerField(default=0)
+    unchanged = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    # why the catalogs could not be found, if they could not
+    error = models.TextField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    heartbeat = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        index_together = (('status', 'created'),)
+
+
+class ProvisionedCourse(models.Model):
+    """
+    What provisioning a course created in Mediasite, written once the course is fully provisioned so
+    that provisioning it again can reuse the ids rather than searching for every object (see
+    web.provisioning.get_provisioned_course).  The folder path the course was provisioned under is
+    kept too, as asking for a different one means provisioning it again.
+    """
+    school = models.ForeignKey(School, on_delete=models.CASCADE)
+    canvas_course_id = models.TextField(unique=True)
+    sis_course_id = models.TextField()
+    mediasite_root_folder = models.TextField()
+    term = models.TextField()
+    year = models.TextField(blank=True, null=True)
+    folder_id = models.TextField()
+    catalog_id = models.TextField()
+    catalog_url = models.TextField()
+    module_id = models.TextField()
+    course_role_id = models.TextField()
+    instructor_role_id = models.TextField()
+    ta_role_id = models.TextField()
+    provisioned = models.DateTimeField(auto_now_add=True)
+    # when the Mediasite objects were last created or seen to exist
+    verified = models.DateTimeField()
@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Pipeline(object):
+    """
+    A set of named steps, each of which may depend on the results of other steps.  Steps whose
+    dependencies have completed are run at the same time on a bounded thread pool, so independent
+    Canvas and Mediasite calls do not wait on each other.
+
+    Each step is called with the results of its dependencies as keyword arguments, e.g. a step added
+    with `depends_on=('catalog',)` is called as `func(catalog=<result of the catalog step>)`.
+    """
+
+    def __init__(self, max_workers):
+        self._max_workers = max_workers
+        self._steps = dict()
+
+    def add_step(self, name, func, depends_on=()):
+        if name in self._steps:
+            raise ValueError('A step named {0} has already been added'.format(name))
+        self._steps[name] = (func, tuple(depends_on))
+
+    def run(self):
+        """
+        Runs every step and returns a dict of step name to result.  If a step raises, no further
+        steps are started and the original exception is re-raised once the running steps finish.
+        """
+        for name, (func, depends_on) in self._steps.items():
+            missing = [d for d in depends_on if d not in self._steps]
+            if missing:
+                raise ValueError('Step {0} depends on unknown steps {1}'.format(name, missing))
+
+        results = dict()
+        pending = dict(self._steps)
+        running = dict()
+        with ThreadPoolExecutor(max_workers=max(1, self._max_workers)) as executor:
+            while pending or running:
+                ready = [n for n, (f, deps) in pending.items() if all(d in results for d in deps)]
+                for name in sorted(ready):
+                    func, depends_on = pending.pop(name)
+                    kwargs = dict((d, results[d]) for d in depends_on)
+                    running[executor.submit(func, **kwargs)] = name
+
+                if not running:
+                    raise ValueError('Steps {0} have circular dependencies'.format(sorted(pending)))
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        logger.debug("step {} failed, abandoning steps {}".format(name, sorted(pending)))
+                        wait(running)
+                        raise error
+                    results[name] = future.result()
+        return results
@@ -0,0 +1,529 @@
+from __future__ import unicode_literals
+
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .models import ProvisionedCourse
+from .pipeline import Pipeline
+from mediasite.apimethods import MediasiteAPI, MediasiteServiceException
+from mediasite.apimodels import Catalog, Folder, Role
+
+logger = logging.getLogger(__name__)
+
+
+class ProvisioningError(Exception):
+    """ Raised when a course cannot be provisioned because of its data or the school's configuration """
+    pass
+
+
+def provision_course(canvas_api, school, course_id=None, course=None, mediasite_root_folder=None, term=None,
+                     year=None, username=None):
+    """
+    Creates (or finds) the Mediasite folder structure, catalog, module, roles and permissions for a
+    Canvas course, then adds the Mediasite external tool link to the course in Canvas.
+    :param canvas_api: a CanvasAPI for the user doing the provisioning
+    :param school: the web.models.School the course belongs to
+    :param course_id: the Canvas course id; not needed if `course` is given
+    :param course: the canvas.apimodels.Course, if the caller has already fetched it
+    :param mediasite_root_folder: defaults to the school's root folder
+    :param term: defaults to the course's term name
+    :param year: defaults to the course's year
+    :param username: the user provisioning the course, for logging
+    :return: the course's mediasite.apimodels.Catalog
+    """
+    oath_consumer_key = settings.OAUTH_CONSUMER_KEY
+    shared_secret = settings.OAUTH_SHARED_SECRET
+    catalog_show_date, catalog_show_time, catalog_items_per_page = get_school_catalog_settings(school)
+
+    if school.consumer_key and school.shared_secret:
+        oath_consumer_key = school.consumer_key
+        shared_secret = school.shared_secret
+
+    if oath_consumer_key and shared_secret:
+        # get the course from Canvas, unless the caller already has it
+        if course is None:
+            course = canvas_api.get_course(course_id)
+        course_id = course.id
+
+        if hasattr(course, 'sis_course_id') == False:
+            raise Exception('While you can communicate with Canvas, you do not have permissions to view '
+                            'SIS properties and will not be able to provision courses.')
+
+        if getattr(course, 'sis_course_id', None) is None:
+            raise Exception('The course that you are trying to provision [{0}], does not have an SIS course '
+                            'Id and provisioning cannot continue.  Please contact your Canvas '
+                            'administrator'.format(course_id))
+
+        # default the folder structure to the school's root folder and the course's own term and year
+        if mediasite_root_folder is None:
+            mediasite_root_folder = school.mediasite_root_folder
+        if term is None:
+            term = course.term.name
+        if year is None:
+            year = course.year
+
+        # course long name
+        course_long_name = "({0}) {1} {2} ({3})"\
+            .format(term, course.course_code, course.name, course.sis_course_id)
+
+        logger.info(
+            "{} is attempting to provision course with sis id {} and long name {}".format(
+                username, course.sis_course_id, course_long_name))
+
+        # a course that has already been provisioned under this folder path has its Mediasite ids
+        # recorded, which saves looking up its folders, catalog, module and course roles.  Everything
+        # that can change without the ids changing (catalog settings, permissions, the Canvas link) is
+        # still brought up to date.
+        provisioned_course = get_provisioned_course(school, course, mediasite_root_folder, term, year)
+        if provisioned_course is not None:
+            logger.info("reusing the Mediasite ids course with sis id {} was provisioned with on {}".format(
+                course.sis_course_id, provisioned_course.provisioned))
+            course_folder = Folder(Id=provisioned_course.folder_id)
+        else:
+            course_folder = get_or_create_course_folder(course, course_long_name, mediasite_root_folder, term, year)
+
+        if course_folder is not None:
+            # create course catalog, with course instance id to ensure uniqueness
+            catalog_display_name = '{0}-{1}-{2}-{3}-lecture-video'\
+                .format(mediasite_root_folder, term, course.course_code, course.sis_course_id)
+            # This is needed because a bug in Mediasite allows for the
+            # creation of a URL with potentially dangerous strings in it.
+            # we strip out the characters that we know might create that
+            # type of URL. Unicode strings require a translation map of
+            # code points to replacement characters, see
+            # https://docs.python.org/2/library/stdtypes.html#str.translate
+            catalog_display_name = catalog_display_name.translate(
+                {ord(c): None for c in '<>*%:&\\ '})
+
+            # Everything below only depends on the course folder, so the independent Canvas and
+            # Mediasite calls are run as a pipeline of steps, at the same time where possible.
+            # The results are merged into the folder permissions afterwards, in a fixed order.
+            pipeline = Pipeline(max_workers=settings.PROVISIONING_MAX_CONCURRENCY)
+
+            def get_or_create_catalog():
+                if provisioned_course is not None:
+                    return Catalog(Id=provisioned_course.catalog_id,
+                                   LinkedFolderId=provisioned_course.folder_id,
+                                   CatalogUrl=provisioned_course.catalog_url)
+                return MediasiteAPI.get_or_create_catalog(friendly_name=catalog_display_name,
+                                                          catalog_name=course_long_name,
+                                                          course_folder_id=course_folder.Id,
+                                                          search_term=course.sis_course_id)
+
+            def set_catalog_settings(catalog):
+                if catalog is not None:
+                    MediasiteAPI.set_catalog_settings(catalog.Id, catalog_show_date, catalog_show_time,
+                                                      catalog_items_per_page)
+
+            def get_or_create_module(catalog):
+                if catalog is not None:
+                    # create Mediasite module if it doesn't exist
+                    course_module = MediasiteAPI.get_or_create_module(
+                        course.sis_course_id,
+                        catalog_display_name,
+                        catalog_mediasite_id=catalog.Id)
+
+                    # associate the module with the catalog
+                    existing_association = next(
+                        (a for a in course_module.Associations
+                         if catalog.Id in a),
+                        None)
+                    if existing_association is None:
+                        MediasiteAPI.add_module_association_by_mediasite_id(
+                            course_module.Id, catalog.Id)
+                    return course_module
+
+            def get_or_create_role(recorded_id_field, role_name, directory_entry):
+                if provisioned_course is not None:
+                    return Role(Id=getattr(provisioned_course, recorded_id_field))
+                return MediasiteAPI.get_or_create_role(role_name=role_name, directory_entry=directory_entry)
+
+            pipeline.add_step('catalog', get_or_create_catalog)
+            pipeline.add_step('catalog_settings', set_catalog_settings, depends_on=('catalog',))
+            if provisioned_course is None:
+                pipeline.add_step('module', get_or_create_module, depends_on=('catalog',))
+
+            # the course's link in Canvas, which is created once the course folder is secured
+            pipeline.add_step('external_link', lambda: canvas_api.get_mediasite_app_external_link(
+                course_id=course.id, course_term=course.term.name))
+
+            ###################################
+            # Assign permissions
+            ###################################
+            # get existing permissions for course folder
+            pipeline.add_step('folder_permissions',
+                              lambda: MediasiteAPI.get_folder_permissions(course_folder.Id))
+
+            # create student role if it does not exist
+            pipeline.add_step('course_role', lambda: get_or_create_role(
+                'course_role_id',
+                role_name=course_long_name,
+                directory_entry="{0}@{1}".format(course.sis_course_id, oath_consumer_key)))
+
+            # create Instructor role if it does not exist
+            pipeline.add_step('instructor_role', lambda: get_or_create_role(
+                'instructor_role_id',
+                role_name="{0} [Instructor]".format(course_long_name),
+                directory_entry="{0}@{1}".format(
+                    "urn:lti:role:ims/lis/Instructor:{0}".format(course.sis_course_id), oath_consumer_key)))
+
+            # create Teaching assistant role if it does not exist
+            pipeline.add_step('ta_role', lambda: get_or_create_role(
+                'ta_role_id',
+                role_name="{0} [Teaching Assistant]".format(course_long_name),
+                directory_entry="{0}@{1}".format(
+                    "urn:lti:role:ims/lis/TeachingAssistant:{0}".format(course.sis_course_id),
+                    oath_consumer_key)))
+
+            # Analytics role for VPAL Research
+            pipeline.add_step('analytics_users_role',
+                              lambda: MediasiteAPI.get_role_by_name('Analytics Application'))
+
+            # role for general canvas users
+            pipeline.add_step('canvas_user_role', lambda: MediasiteAPI.get_role_by_directory_entry(
+                'canvas@{0}'.format(oath_consumer_key)))
+
+            # authenticateduser role
+            pipeline.add_step('authenticated_users_role',
+                              lambda: MediasiteAPI.get_role_by_name('AuthenticatedUsers'))
+
+            # find or create the teachers for this course as users in Mediasite
+            if settings.CREATE_USER_PROFILES_FOR_TEACHERS:
+                def get_teacher_roles(canvas_teachers):
+                    teacher_users = MediasiteAPI.get_or_create_users_by_email_address(
+                        [(t.primary_email, t.name) for t in canvas_teachers])
+                    return [Role(Id=MediasiteAPI.convert_user_profile_to_role_id(teacher_users[t.primary_email].Id))
+                            for t in canvas_teachers]
+
+                # get the teaching users for the course from Canvas
+                pipeline.add_step('canvas_teachers',
+                                  lambda: canvas_api.get_teaching_users_with_email(course_id))
+                pipeline.add_step('teacher_roles', get_teacher_roles, depends_on=('canvas_teachers',))
+
+            steps = pipeline.run()
+            course_catalog = steps['catalog']
+            folder_permissions = steps['folder_permissions']
+
+            # NOTE: The following calls to `update_folder_permissions` do
+            # NOT actually call out to the Mediasite API.  Instead, they
+            # build up the `folder_permissions` Python list model.  The
+            # ultimate call to `assign_permissions_to_folder` makes the
+            # API call that passes up the list of permissions to Mediasite.
+            # As a future TBD, we should consider taking the
+            # `update_folder_permission` method out of the `apimethods`
+            # module since it's not actually an API call.
+            folder_permissions = MediasiteAPI.update_folder_permissions(
+                folder_permissions, steps['course_role'], MediasiteAPI.VIEW_ONLY_PERMISSION_FLAG)
+            folder_permissions = MediasiteAPI.update_folder_permissions(
+                folder_permissions, steps['instructor_role'], MediasiteAPI.READ_WRITE_PERMISSION_FLAG)
+            folder_permissions = MediasiteAPI.update_folder_permissions(
+                folder_permissions, steps['ta_role'], MediasiteAPI.READ_WRITE_PERMISSION_FLAG)
+
+            # add Analytics role for VPAL Research - note that they need read and view, but view is default,
+            # so we do not need to add that permission explicitly
+            if steps['analytics_users_role']:
+                folder_permissions = MediasiteAPI.update_folder_permissions(
+                    folder_permissions, steps['analytics_users_role'], MediasiteAPI.READ_ONLY_PERMISSION_FLAG)
+
+            # remove permissions for general canvas users users from the in memory permission set
+            # so that the course folder is secured
+            if steps['canvas_user_role']:
+                folder_permissions = MediasiteAPI.update_folder_permissions(
+                    folder_permissions, steps['canvas_user_role'], MediasiteAPI.NO_ACCESS_PERMISSION_FLAG)
+
+            # remove authenticateduser role
+            if steps['authenticated_users_role']:
+                folder_permissions = MediasiteAPI.update_folder_permissions(
+                    folder_permissions, steps['authenticated_users_role'], MediasiteAPI.NO_ACCESS_PERMISSION_FLAG)
+
+            # add read write permissions for the teachers to the in memory permission set, in the
+            # order Canvas returned them
+            for teacher_role in steps.get('teacher_roles', []):
+                folder_permissions = MediasiteAPI.update_folder_permissions(
+                    folder_permissions, teacher_role, MediasiteAPI.READ_WRITE_PERMISSION_FLAG)
+
+            # assign in memory  permissions to folder in Mediasite, if they differ from what it already has
+            try:
+                MediasiteAPI.assign_permissions_to_folder(course_folder.Id, folder_permissions)
+            except MediasiteServiceException:
+                if provisioned_course is not None:
+                    # the recorded roles may have been deleted; provisioning again looks them up
+                    logger.info("forgetting the Mediasite ids provisioned for course with sis id {}".format(
+                        course.sis_course_id))
+                    provisioned_course.delete()
+                raise
+
+            # reach back into Canvas and create the Mediasite link if it does not exist
+            if steps['external_link'] is None:
+                canvas_api.create_mediasite_app_external_link(
+                    course_id=course.id,
+                    course_term=course.term.name,
+                    url=settings.MEDIASITE_LTI_LAUNCH_URL,
+                    consumer_key=oath_consumer_key,
+                    shared_secret=shared_secret)
+
+            # remember what was provisioned, so that provisioning the course again can skip the lookups above
+            if provisioned_course is None and course_catalog is not None and steps['module'] is not None:
+                ProvisionedCourse.objects.update_or_create(
+                    canvas_course_id=str(course.id),
+                    defaults=dict(school=school,
+                                  sis_course_id=course.sis_course_id,
+                                  mediasite_root_folder=mediasite_root_folder,
+                                  term=term,
+                                  year=year,
+                                  folder_id=course_folder.Id,
+                                  catalog_id=course_catalog.Id,
+                                  catalog_url=course_catalog.CatalogUrl,
+                                  module_id=steps['module'].Id,
+                                  course_role_id=steps['course_role'].Id,
+                                  instructor_role_id=steps['instructor_role'].Id,
+                                  ta_role_id=steps['ta_role'].Id,
+                                  verified=timezone.now()))
+
+            return course_catalog
+        else:
+            raise ProvisioningError('Unable to create or find Mediasite course folder : {0}'
+                                    .format(course_long_name))
+    else:
+        raise ProvisioningError('The system is not configured to communicate with Mediasite. '
+                                'School/account : {0}'.format(school.name))
+
+
+def get_or_create_course_folder(course, course_long_name, mediasite_root_folder, term, year):
+    """ Creates (or finds) the root, year and term folders, and the course folder within them """
+    # create the Mediasite folder structure
+    course_folder = None
+    year_folder = None
+    term_folder = None
+    root_folder = MediasiteAPI.get_or_create_folder(name=mediasite_root_folder, parent_folder_id=None)
+    if root_folder is not None:
+        if term.lower()== 'ongoing':
+            # First check for Ongoing terms(The Ongoing term also have
+            # year=None, so do the term check first so it doesn't raise
+            # an Exception in the next block)
+            # For such terms, do not create a folder for the year, move
+            # onto the term folder.(essentially collapsing the folder structure).(TLT-2856)
+            term_folder = MediasiteAPI.get_or_create_folder(name=term, parent_folder_id=root_folder.Id)
+        elif year is None or year == 'None':
+            #If the year is not set, raise an error
+            raise Exception('Sorry, there was an error provisioning this'
+                            ' course. Please contact video-support@harvard.edu')
+        else:
+            year_folder = MediasiteAPI.get_or_create_folder(name=year, parent_folder_id=root_folder.Id)
+
+    if year_folder is not None:
+        term_folder = MediasiteAPI.get_or_create_folder(name=term, parent_folder_id=year_folder.Id)
+
+    if term_folder is not None:
+        course_folder = MediasiteAPI.get_or_create_folder(name=course_long_name,
+                                                          parent_folder_id=term_folder.Id,
+                                                          search_term=course.sis_course_id,
+                                                          is_copy_destination=True,
+                                                          is_shared=True)
+
+    return course_folder
+
+
+def get_school_catalog_settings(school):
+    """ The (show date, show time, items per page) settings of the school's course catalogs """
+    catalog_show_date = False
+    catalog_show_time = False
+    catalog_items_per_page = 100
+
+    if school is not None:
+        catalog_show_date = school.catalog_show_date
+        catalog_show_time = school.catalog_show_time
+        if school.catalog_items_per_page is not None:
+            catalog_items_per_page = school.catalog_items_per_page
+    return catalog_show_date, catalog_show_time, catalog_items_per_page
+
+
+def get_school_catalog_ids(school, executor):
+    """
+    The ids of the catalogs of the school's courses: those recorded as provisioned (see
+    ProvisionedCourse), and those linked to the course folders under the school's root folder, which
+    are looked up in the catalog index.  A catalog the index has not seen yet, e.g. one made in
+    Mediasite since sync_mediasite_catalogs last ran, is not found.
+    :param executor: reads the child folders of each level of the folder tree concurrently
+    """
+    catalog_ids = set(ProvisionedCourse.objects.filter(school=school).values_list('catalog_id', flat=True))
+    root_folder = MediasiteAPI.get_folder(school.mediasite_root_folder, None)
+    if root_folder is None:
+        return sorted(catalog_ids)
+
+    def child_folders(folders):
+        return [f for children in executor.map(lambda folder: MediasiteAPI.sync_child_folders(folder.Id), folders)
+                for f in children]
+
+    # root -> year -> term -> course, but root -> term -> course for the Ongoing term, which has no
+    # year (see get_or_create_course_folder)
+    year_folders = list()
+    term_folders = list()
+    for folder in MediasiteAPI.sync_child_folders(root_folder.Id):
+        (term_folders if folder.Name.lower() == 'ongoing' else year_folders).append(folder)
+    term_folders.extend(child_folders(year_folders))
+    for course_folder in child_folders(term_folders):
+        catalog = MediasiteAPI.get_indexed_catalog(course_folder.Id)
+        if catalog is not None:
+            catalog_ids.add(catalog.Id)
+    return sorted(catalog_ids)
+
+
+def apply_school_catalog_settings(school, workers=None, on_progress=None):
+    """
+    Applies the school's catalog settings to its catalogs (see get_school_catalog_ids), `workers`
+    catalogs at a time.  Only the settings that differ are written.
+    :param on_progress: called with the number of catalogs found, then with the Counter so far after
+    each catalog
+    :return: a Counter of the catalogs 'updated', 'unchanged' and 'failed'
+    """
+    catalog_settings = get_school_catalog_settings(school)
+    results = Counter()
+
+    def apply(catalog_id):
+        try:
+            return 'updated' if MediasiteAPI.set_catalog_settings(catalog_id, *catalog_settings) else 'unchanged'
+        except Exception:
+            logger.exception("failed to apply the settings of school {} to catalog {}".format(school.name,
+                                                                                             catalog_id))
+            return 'failed'
+
+    with ThreadPoolExecutor(max_workers=workers or settings.PROVISIONING_MAX_CONCURRENCY) as executor:
+        catalog_ids = get_school_catalog_ids(school, executor)
+        if on_progress is not None:
+            on_progress(len(catalog_ids), results)
+        for result in executor.map(apply, catalog_ids):
+            results[result] += 1
+            if on_progress is not None:
+                on_progress(len(catalog_ids), results)
+    return results
+
+
+def get_provisioned_course(school, course, mediasite_root_folder, term, year):
+    """
+    The ProvisionedCourse recorded for a course provisioned under the same folder path, if its
+    Mediasite objects still exist.  A record verified within settings.PROVISIONED_COURSE_TRUST_SECS
+    is used as it is; older ones are checked by getting the folder, catalog and module by their ids,
+    which is much cheaper than the searches provisioning makes, and are deleted if any has gone.
+    """
+    provisioned_course = ProvisionedCourse.objects.filter(school=school, canvas_course_id=str(course.id)).first()
+    if provisioned_course is None:
+        return None
+    if (provisioned_course.sis_course_id, provisioned_course.mediasite_root_folder, provisioned_course.term,
+            provisioned_course.year) != (course.sis_course_id, mediasite_root_folder, term, year):
+        return None
+
+    trusted_since = timezone.now() - datetime.timedelta(seconds=settings.PROVISIONED_COURSE_TRUST_SECS)
+    if provisioned_course.verified >= trusted_since:
+        return provisioned_course
+
+    pipeline = Pipeline(max_workers=settings.PROVISIONING_MAX_CONCURRENCY)
+    pipeline.add_step('folder', lambda: MediasiteAPI.get_folder_by_id(provisioned_course.folder_id))
+    pipeline.add_step('catalog', lambda: MediasiteAPI.get_catalog_by_id(provisioned_course.catalog_id))
+    pipeline.add_step('module', lambda: MediasiteAPI.get_module(mediasite_id=provisioned_course.module_id))
+    steps = pipeline.run()
+    if steps['folder'] is None or steps['module'] is None or steps['catalog'] is None \
+            or steps['catalog'].LinkedFolderId != provisioned_course.folder_id:
+        logger.info("the Mediasite objects provisioned for course with sis id {} have changed".format(
+            course.sis_course_id))
+        provisioned_course.delete()
+        return None
+
+    provisioned_course.verified = timezone.now()
+    provisioned_course.save(update_fields=['verified'])
+    return provisioned_course
+
+
+def is_course_provisioned(canvas_api, course):
+    """
+    A course is provisioned once its Mediasite external tool link exists, as that is the last step.
+    Canvas is asked even for courses with a ProvisionedCourse record, as the link can be deleted there.
+    """
+    return canvas_api.get_mediasite_app_external_link(course_id=course.id, course_term=course.term.name) is not None
+
+
+class BulkProvisioningSummary(object):
+    def __init__(self):
+        self.provisioned = 0
+        self.skipped = 0
+        self.failed = 0
+        self.elapsed_secs = 0.0
+
+    @property
+    def total(self):
+        return self.provisioned + self.skipped + self.failed
+
+    def courses_per_second(self):
+        return self.total / self.elapsed_secs if self.elapsed_secs else 0.0
+
+    def __str__(self):
+        return ('{0} courses in {1:.1f}s ({2:.2f} courses/s): {3} provisioned, {4} skipped, {5} failed'
+                .format(self.total, self.elapsed_secs, self.courses_per_second(),
+                        self.provisioned, self.skipped, self.failed))
+
+
+def provision_courses(canvas_api, school, courses, workers, skip_provisioned=True, username=None,
+                      on_result=None):
+    """
+    Provisions many courses on a pool of `workers` threads.  `courses` may be any iterable of
+    canvas.apimodels.Course (e.g. the generator returned by CanvasAPI.get_courses_for_account) or of
+    Canvas course ids, which are fetched by the workers; it is consumed as the workers free up, so
+    an entire account is never held in memory.
+    :param skip_provisioned: skip courses that already have the Mediasite external tool link, which
+     makes an interrupted run safe to resume
+    :param on_result: optional callback, called with (course_id, status, detail) for each course where
+     status is one of 'provisioned', 'skipped' or 'failed', and detail is the catalog url or the error
+    :return: a BulkProvisioningSummary
+    """
+    summary = BulkProvisioningSummary()
+    start_time = time.time()
+
+    # resolve the user's Canvas credentials on this thread, so that the workers do not each query for them
+    canvas_api.get_canvas_headers()
+
+    def provision(course):
+        course_id = getattr(course, 'id', course)
+        try:
+            if not hasattr(course, 'id'):
+                course = canvas_api.get_course(course_id)
+            if skip_provisioned and is_course_provisioned(canvas_api, course):
+                return course_id, 'skipped', None
+            catalog = provision_course(canvas_api, school, course=course, username=username)
+            return course_id, 'provisioned', catalog.CatalogUrl
+        except Exception as e:
+            logger.exception("failed to provision course {}".format(course_id))
+            return course_id, 'failed', e
+        finally:
+            # worker threads get their own database connections
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # submit a bounded window of courses at a time so that the course iterable is consumed lazily
+        courses = iter(courses)
+        in_flight = set()
+        for course in courses:
+            in_flight.add(executor.submit(provision, course))
+            if len(in_flight) >= workers * 2:
+                in_flight = _collect_done(in_flight, summary, on_result)
+        while in_flight:
+            in_flight = _collect_done(in_flight, summary, on_result)
+
+    summary.elapsed_secs = time.time() - start_time
+    return summary
+
+
+def _collect_done(futures, summary, on_result):
+    done, not_done = wait(futures, return_when=FIRST_COMPLETED)
+    for future in done:
+        course_id, status, detail = future.result()
+        setattr(summary, status, getattr(summary, status) + 1)
+        if on_result is not None:
+            on_result(course_id, status, detail)
+    return not_done
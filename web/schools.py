@@ -0,0 +1,87 @@
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import School
+
+logger = logging.getLogger(__name__)
+
+# changed whenever a school is saved or deleted, so that every worker reloads its snapshot
+_VERSION_KEY = 'web:schools:version'
+
+_lock = threading.Lock()
+# (version, schools ordered by name, canvas_id -> school, when it was loaded)
+_snapshot = None
+
+
+def get_schools():
+    """ Every School, ordered by name.  The schools are shared, so treat them as read only. """
+    return _get_snapshot()[1]
+
+
+def get_school(canvas_id):
+    """ The School of a Canvas account; raises School.DoesNotExist like School.objects.get """
+    school = _get_snapshot()[2].get(str(canvas_id))
+    if school is None:
+        raise School.DoesNotExist('No school for Canvas account {0}'.format(canvas_id))
+    return school
+
+
+def invalidate_schools(**kwargs):
+    """ Makes every worker reload the schools; connected to School's post_save and post_delete in web.apps """
+    global _snapshot
+    with _lock:
+        _snapshot = None
+    # the other workers must not reload the schools before the change is committed
+    transaction.on_commit(_change_version)
+
+
+def _change_version():
+    try:
+        cache.set(_VERSION_KEY, uuid.uuid4().hex, None)
+    except Exception:
+        logger.warning("could not change the version of the schools in the shared cache", exc_info=True)
+
+
+def _get_version():
+    try:
+        version = cache.get(_VERSION_KEY)
+        if version is None:
+            cache.add(_VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(_VERSION_KEY)
+        return version
+    except Exception:
+        logger.warning("could not read the version of the schools from the shared cache", exc_info=True)
+        return None
+
+
+def _get_snapshot():
+    """
+    This worker's snapshot of the School table, loaded again when the version in the shared cache
+    changes.  Checking the version is a single cache read, so requests make no School queries.
+
+    Without a version, i.e. the shared cache cannot be reached or does not keep anything (a
+    DummyCache), the changes other workers make cannot be seen, so the snapshot is only kept for
+    settings.LOCAL_CACHE_TIMEOUT seconds.
+    """
+    global _snapshot
+    version = _get_version()
+    snapshot = _snapshot
+    expired = version is None and snapshot is not None and \
+        time.time() - snapshot[3] >= settings.LOCAL_CACHE_TIMEOUT
+    if snapshot is None or snapshot[0] != version or expired:
+        if version is None:
+            logger.warning("the schools have no version in the shared cache, so they are reloaded every {} "
+                           "seconds".format(settings.LOCAL_CACHE_TIMEOUT))
+        schools = list(School.objects.order_by('name'))
+        snapshot = (version, schools, dict((s.canvas_id, s) for s in schools), time.time())
+        with _lock:
+            _snapshot = snapshot
+    return snapshot
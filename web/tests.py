@@ -1,3 +1,511 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import os
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+import requests
+from rest_framework.exceptions import ValidationError
+
+from canvas.apimethods import CanvasAPI, course_decoder
+from canvas.apimodels import Course
+from canvas.fakeserver import FakeCanvasServer
+from canvas.serializer import CourseSerializer
+from mediasite.apimethods import MediasiteAPI, folder_decoder
+from mediasite.fakeserver import FakeMediasiteServer
+from mediasite.serializer import FolderSerializer
+from mediasite_provisioning import decoder
+from mediasite_provisioning.cache import TieredCache
+from mediasite_provisioning.metrics import MetricsRegistry, normalize_endpoint
+from mediasite_provisioning.ratelimit import RateLimiter, get_retry_after, send_request
+
+from . import jobs
+from .forms import get_account_choices
+from .models import APIUser, CatalogSettingsJob, ProvisionedCourse, ProvisionJob, School
+from .pipeline import Pipeline
+from .provisioning import apply_school_catalog_settings, is_course_provisioned, provision_course, provision_courses
+from .schools import get_school, get_schools
+
+
+class PipelineTestCase(SimpleTestCase):
+
+    def test_steps_receive_dependency_results(self):
+        pipeline = Pipeline(max_workers=4)
+        pipeline.add_step('a', lambda: 1)
+        pipeline.add_step('b', lambda: 2)
+        pipeline.add_step('c', lambda a, b: a + b, depends_on=('a', 'b'))
+        self.assertEqual(pipeline.run(), {'a': 1, 'b': 2, 'c': 3})
+
+    def test_step_errors_are_reraised(self):
+        def fail():
+            raise KeyError('missing')
+
+        pipeline = Pipeline(max_workers=2)
+        pipeline.add_step('a', fail)
+        pipeline.add_step('b', lambda a: a, depends_on=('a',))
+        self.assertRaises(KeyError, pipeline.run)
+
+    def test_circular_dependencies_are_rejected(self):
+        pipeline = Pipeline(max_workers=2)
+        pipeline.add_step('a', lambda b: b, depends_on=('b',))
+        pipeline.add_step('b', lambda a: a, depends_on=('a',))
+        self.assertRaises(ValueError, pipeline.run)
+
+
+class ApiModelTestCase(SimpleTestCase):
+
+    def test_builds_slotted_models(self):
+        course = Course(id=1, name='Biostatistics', start_at=None, term={'name': '2016 Fall'}, unknown_field='x')
+        self.assertEqual((course.id, course.name, course.term.name, course.year), (1, 'Biostatistics', '2016 Fall',
+                                                                                  '2016-2017'))
+        self.assertFalse(hasattr(course, 'unknown_field'))
+        self.assertFalse(hasattr(course, 'sis_course_id'))
+        # list defaults are not shared
+        self.assertIsNot(course.teaching_users, Course(id=2, term=None).teaching_users)
+
+
+class DecoderTestCase(SimpleTestCase):
+
+    def setUp(self):
+        with open(os.path.join(settings.BASE_DIR, 'canvas', 'testdata', 'courses.json')) as f:
+            self.courses = json.load(f)
+        with open(os.path.join(settings.BASE_DIR, 'mediasite', 'testdata', 'folders.json')) as f:
+            self.folders = json.load(f)['value']
+
+    def tearDown(self):
+        decoder.set_trusted_mode(False)
+
+    def validate(self, serializer_class, data, many=True):
+        serializer = serializer_class(data=data, many=many)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def test_decodes_the_same_as_the_serializers(self):
+        self.assertEqual(course_decoder.decode_many(self.courses), self.validate(CourseSerializer, self.courses))
+        self.assertEqual(folder_decoder.decode_many(self.folders), self.validate(FolderSerializer, self.folders))
+
+    def test_strict_mode_raises_the_serializer_errors(self):
+        folder = dict(self.folders[0], Name='  ')
+        del folder['Owner']
+        with self.assertRaises(ValidationError) as expected:
+            self.validate(FolderSerializer, folder, many=False)
+        with self.assertRaises(ValidationError) as raised:
+            folder_decoder.decode(folder)
+        self.assertEqual(raised.exception.detail, expected.exception.detail)
+
+    def test_strict_mode_accepts_what_the_serializer_coerces(self):
+        course = dict(self.courses[0], total_students='312')
+        self.assertEqual(course_decoder.decode(course)['total_students'], 312)
+
+    def test_trusted_mode_skips_validation(self):
+        decoder.set_trusted_mode(True)
+        folder = dict(self.folders[0], Name='')
+        del folder['Owner']
+        attrs = folder_decoder.decode(folder)
+        self.assertEqual(attrs['Name'], '')
+        self.assertNotIn('Owner', attrs)
+
+
+def make_response(status_code, content=b'', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    return response
+
+
+@override_settings(TEST_RATE_LIMIT=1000, TEST_RATE_LIMIT_BURST=2, HTTP_MAX_RETRIES=2,
+                   HTTP_RETRY_BACKOFF=0.001, CANVAS_RATE_LIMIT_LOW_WATER=100)
+class RateLimiterTestCase(SimpleTestCase):
+    # these run against the per-process buckets, as the test cache is not redis
+
+    def setUp(self):
+        self.limiter = RateLimiter('test', 'TEST_RATE_LIMIT', 'TEST_RATE_LIMIT_BURST', adapt_to_remaining=True)
+
+    def test_waits_once_the_burst_is_used(self):
+        self.assertEqual(self.limiter.reserve('host'), (True, 0))
+        self.assertEqual(self.limiter.reserve('host'), (True, 0))
+        taken, wait = self.limiter.reserve('host')
+        self.assertTrue(taken)
+        self.assertGreater(wait, 0)
+        self.assertEqual(self.limiter.reserve('other host'), (True, 0))
+
+    def test_adapts_to_the_remaining_quota(self):
+        self.limiter.reserve('token')
+        self.limiter.observe('token', make_response(200, headers={'X-Rate-Limit-Remaining': '50.5'}), False, None)
+        self.assertEqual(self.limiter.get_rate('token'), 500)
+        self.limiter.observe('token', make_response(200, headers={'X-Rate-Limit-Remaining': '600'}), False, None)
+        self.assertEqual(self.limiter.get_rate('token'), 600)
+
+    def test_keeps_only_hashed_keys_below_the_configured_rate(self):
+        self.limiter.observe('Bearer secret', make_response(429), True, None)
+        self.assertEqual(self.limiter.get_rate('Bearer secret'), 500)
+        self.assertNotIn('Bearer secret', repr((self.limiter._rates, self.limiter._local)))
+        for n in range(5):
+            self.limiter.observe('Bearer secret', make_response(200), False, None)
+        self.assertEqual(self.limiter.get_rate('Bearer secret'), 1000)
+        self.assertEqual(len(self.limiter._rates), 0)
+
+        with mock.patch.object(RateLimiter, 'MAX_LOCAL_KEYS', 10):
+            for n in range(25):
+                self.limiter.reserve('Bearer {0}'.format(n))
+                self.limiter.observe('Bearer {0}'.format(n), make_response(429), True, None)
+            self.assertLessEqual(len(self.limiter._rates), 10)
+            self.assertLessEqual(len(self.limiter._local), 10)
+
+    def test_retry_after_blocks_the_bucket(self):
+        self.limiter.observe('host', make_response(503), True, 5)
+        taken, wait = self.limiter.reserve('host')
+        self.assertFalse(taken)
+        self.assertGreater(wait, 4)
+
+    def test_retries_throttled_idempotent_requests(self):
+        responses = [make_response(403, b'403 Forbidden (Rate Limit Exceeded)'), make_response(429),
+                     make_response(200)]
+        response = send_request('GET', lambda: responses.pop(0), [(self.limiter, 'host')])
+        self.assertEqual(response.status_code, 200)
+
+        responses = [make_response(429), make_response(200)]
+        response = send_request('POST', lambda: responses.pop(0), [(self.limiter, 'other host')])
+        self.assertEqual(response.status_code, 429)
+
+    def test_parses_retry_after(self):
+        self.assertEqual(get_retry_after(make_response(503, headers={'Retry-After': '3'})), 3)
+        self.assertEqual(get_retry_after(make_response(503, headers={'Retry-After': '300'})), 30)
+        self.assertIsNone(get_retry_after(make_response(503)))
+
+
+class MetricsTestCase(SimpleTestCase):
+
+    def test_normalizes_endpoints(self):
+        self.assertEqual(normalize_endpoint('https://canvas.test/api/v1/courses/123/external_tools?per_page=100'),
+                         'courses/{id}/external_tools')
+        self.assertEqual(normalize_endpoint('https://canvas.test/api/v1/courses/sis_course_id:A-1/enrollments'),
+                         'courses/{id}/enrollments')
+        self.assertEqual(normalize_endpoint("https://ms.test/Mediasite/Api/v1/Folders('8f2b')/UpdatePermissions"),
+                         "Folders('{id}')/UpdatePermissions")
+        self.assertEqual(normalize_endpoint('https://ms.test/Mediasite/Api/v1/Folders?$filter=Name eq \'x\''),
+                         'Folders')
+
+    def test_renders_prometheus_text(self):
+        registry = MetricsRegistry()
+        registry.record_call('canvas', 'get', 'https://canvas.test/api/v1/courses/1', 0.2, bytes_received=100)
+        registry.record_call('canvas', 'get', 'https://canvas.test/api/v1/courses/2', 3, error=True)
+        cache = TieredCache('metrics_test', 'LOCAL_CACHE_TIMEOUT')
+        cache.get('missing')
+
+        text = registry.render()
+        labels = 'endpoint="courses/{id}",method="GET",service="canvas"'
+        self.assertIn('api_request_duration_seconds_bucket{{{0},le="0.1"}} 0.0'.format(labels), text)
+        self.assertIn('api_request_duration_seconds_bucket{{{0},le="0.25"}} 1.0'.format(labels), text)
+        self.assertIn('api_request_duration_seconds_bucket{{{0},le="+Inf"}} 2.0'.format(labels), text)
+        self.assertIn('api_request_duration_seconds_count{{{0}}} 2.0'.format(labels), text)
+        self.assertIn('api_request_errors_total{{{0}}} 1.0'.format(labels), text)
+        self.assertIn('api_response_bytes_total{{{0}}} 100.0'.format(labels), text)
+        self.assertIn('cache_requests_total{cache="metrics_test",result="miss"} 1.0', text)
+        self.assertIn('cache_hit_ratio{cache="metrics_test"} 0.0', text)
+
+
+class FakeServersTestCase(TestCase):
+    """ Runs each test against its own fake Canvas and Mediasite, with a school and a user to provision with """
+
+    def setUp(self):
+        self.canvas_server = FakeCanvasServer(tokens=['test-token']).start()
+        self.addCleanup(self.canvas_server.stop)
+        self.mediasite_server = FakeMediasiteServer().start()
+        self.addCleanup(self.mediasite_server.stop)
+        # sessions are kept out of the cache, which may not be a real one here
+        settings_override = override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies',
+                                              **dict(self.canvas_server.settings(), **self.mediasite_server.settings()))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for cache in TieredCache.all_caches:
+            cache.clear_local()
+
+        account = self.canvas_server.populate(courses=2)
+        self.course_ids = sorted(c['id'] for c in self.canvas_server.courses.values())
+        self.user = User.objects.create(username='teacher')
+        APIUser.objects.create(user=self.user, canvas_api_key='test-token')
+        self.school = School.objects.create(canvas_id=str(account['id']), name=account['name'],
+                                            mediasite_root_folder='Test', consumer_key='key',
+                                            shared_secret='secret', catalog_items_per_page=100)
+
+
+class ProvisionJobTestCase(FakeServersTestCase):
+
+    def test_a_course_is_only_queued_once(self):
+        job = jobs.enqueue_job(self.user, self.school, self.course_ids[0])
+        self.assertEqual(jobs.enqueue_job(self.user, self.school, self.course_ids[0]).id, job.id)
+        second = jobs.enqueue_job(self.user, self.school, self.course_ids[1])
+        self.assertNotEqual(second.id, job.id)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProvisionJob.objects.create(user=self.user, school=self.school, course_id=self.course_ids[0])
+
+        # another user gets a job of their own, which waits for the first to finish
+        other = jobs.enqueue_job(User.objects.create(username='another'), self.school, self.course_ids[0])
+        self.assertNotEqual(other.id, job.id)
+        self.assertEqual([j.id for j in jobs.claim_jobs(5)], [job.id, second.id])
+        self.assertEqual(jobs.claim_jobs(5), [])
+        # nor does it hold up the jobs queued after it
+        third = jobs.enqueue_job(self.user, self.school, '99999')
+        self.assertEqual([j.id for j in jobs.claim_jobs(1)], [third.id])
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        first = jobs.enqueue_job(self.user, self.school, self.course_ids[0])
+        second = jobs.enqueue_job(self.user, self.school, self.course_ids[1])
+        self.assertEqual([j.id for j in jobs.claim_jobs(1)], [first.id])
+        self.assertEqual([j.id for j in jobs.claim_jobs(5)], [second.id])
+        self.assertEqual(jobs.claim_jobs(5), [])
+
+        # a job whose worker went away is picked up again, unless its worker reports on it
+        ProvisionJob.objects.filter(id=second.id).update(heartbeat=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual([j.id for j in jobs.claim_jobs(5)], [second.id])
+        jobs.touch_jobs([first, second])
+        self.assertEqual(jobs.claim_jobs(5), [])
+        with override_settings(PROVISION_JOB_TIMEOUT=-1):
+            self.assertEqual(sorted(j.id for j in jobs.claim_jobs(5)), [first.id, second.id])
+
+    def test_only_the_current_claim_records_the_outcome(self):
+        jobs.enqueue_job(self.user, self.school, self.course_ids[0])
+        with override_settings(PROVISION_JOB_TIMEOUT=-1):
+            first_claim = jobs.claim_jobs(1)[0]
+            second_claim = jobs.claim_jobs(1)[0]
+        self.assertEqual(jobs.run_job(first_claim).status, ProvisionJob.SUCCEEDED, first_claim.error)
+        self.assertEqual(ProvisionJob.objects.get(id=first_claim.id).status, ProvisionJob.RUNNING)
+        jobs.run_job(second_claim)
+        self.assertEqual(ProvisionJob.objects.get(id=first_claim.id).status, ProvisionJob.SUCCEEDED)
+
+    def test_provisioning_job(self):
+        job = jobs.enqueue_job(self.user, self.school, self.course_ids[0], root_folder='Test', term='2016 Fall',
+                               year='2016-2017')
+        job = jobs.run_job(jobs.claim_jobs(1)[0])
+        self.assertEqual(job.status, ProvisionJob.SUCCEEDED, job.error)
+        self.assertEqual(job.catalog_url, list(self.mediasite_server.catalogs.values())[0]['CatalogUrl'])
+
+        client = self.client
+        client.force_login(self.user)
+        status = client.get(reverse('web:provision_status', args=[job.id])).json()
+        self.assertEqual((status['status'], status['catalog_url']), (ProvisionJob.SUCCEEDED, job.catalog_url))
+
+        # only the user who queued the job can see it
+        client.force_login(User.objects.create(username='another'))
+        self.assertEqual(client.get(reverse('web:provision_status', args=[job.id])).status_code, 404)
+
+    def test_provision_view_queues_the_course(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('web:provision'), dict(account_id=self.school.canvas_id,
+                                                                   course_id=self.course_ids[0], root_folder='Test',
+                                                                   term='2016 Fall', year='2016-2017'))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(ProvisionJob.objects.get(id=response.json()['job_id']).status, ProvisionJob.QUEUED)
+
+
+class BulkProvisioningTestCase(TransactionTestCase):
+    """ The workers write to the database from their own threads, so the tests can't run in a transaction """
+    setUp = FakeServersTestCase.setUp
+
+    def add_new_term_courses(self, count):
+        course_ids = [self.canvas_server.add_course(int(self.school.canvas_id), 'New Course {0}'.format(n),
+                                                    'NEW {0}'.format(n), sis_course_id=str(600000 + n),
+                                                    term_name='2017 Spring', sis_term_id='2017-2')['id']
+                      for n in range(count)]
+        # slow enough that the workers all look for the new folders before any is created
+        self.mediasite_server.latency = 0.02
+        return course_ids
+
+    def assert_one_folder_for_each(self, course_count):
+        folder_names = [f['Name'] for f in self.mediasite_server.folders.values()]
+        self.assertEqual(folder_names.count('Test'), 1)
+        self.assertEqual(folder_names.count('2017 Spring'), 1)
+        course_folders = [f for f in self.mediasite_server.folders.values() if 'New Course' in f['Name']]
+        self.assertEqual(len(course_folders), course_count)
+        self.assertEqual(len(set(f['ParentFolderId'] for f in course_folders)), 1)
+
+    def test_courses_of_a_new_term_share_its_folders(self):
+        course_ids = self.add_new_term_courses(6)
+        summary = provision_courses(CanvasAPI(user=self.user), self.school, course_ids, workers=6)
+        self.assertEqual((summary.provisioned, summary.failed), (6, 0))
+        self.assert_one_folder_for_each(6)
+
+    def test_jobs_for_courses_of_a_new_term_share_its_folders(self):
+        for course_id in self.add_new_term_courses(4):
+            jobs.enqueue_job(self.user, self.school, course_id)
+
+        def run_job(job):
+            try:
+                return jobs.run_job(job)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            finished = list(executor.map(run_job, jobs.claim_jobs(4)))
+        self.assertEqual([job.status for job in finished], [ProvisionJob.SUCCEEDED] * 4)
+        self.assert_one_folder_for_each(4)
+
+
+class ProvisionedCourseTestCase(FakeServersTestCase):
+
+    def provision(self, **kwargs):
+        return provision_course(CanvasAPI(user=self.user), self.school, course_id=self.course_ids[0], **kwargs)
+
+    def test_provisioning_again_reuses_the_recorded_ids(self):
+        catalog = self.provision()
+        provisioned_course = ProvisionedCourse.objects.get(canvas_course_id=str(self.course_ids[0]))
+        self.assertEqual((provisioned_course.catalog_id, provisioned_course.catalog_url),
+                         (catalog.Id, catalog.CatalogUrl))
+
+        # trusted as recorded: nothing is searched for or created
+        self.mediasite_server.reset_calls()
+        self.assertEqual(self.provision().CatalogUrl, catalog.CatalogUrl)
+        self.assertEqual(self.mediasite_server.calls[('GET', 'Folders')], 0)
+        self.assertEqual(self.mediasite_server.calls[('GET', 'Catalogs')], 0)
+        self.assertEqual(self.mediasite_server.calls[('GET', 'Modules')], 0)
+        self.assertEqual(self.mediasite_server.call_count('POST'), 0)
+
+        # checked by id once it is no longer fresh
+        with override_settings(PROVISIONED_COURSE_TRUST_SECS=-1):
+            self.assertEqual(self.provision().CatalogUrl, catalog.CatalogUrl)
+        self.assertEqual(self.mediasite_server.calls[('GET', "Folders('{id}')")], 1)
+        self.assertEqual(self.mediasite_server.calls[('GET', "Catalogs('{id}')")], 1)
+        self.assertEqual(self.mediasite_server.call_count('POST'), 0)
+
+    @override_settings(CREATE_USER_PROFILES_FOR_TEACHERS=True)
+    def test_provisioning_again_restores_the_link_and_permissions(self):
+        catalog = self.provision()
+        self.assertEqual(len(self.canvas_server.external_tools[self.course_ids[0]]), 1)
+        self.assertTrue(ProvisionedCourse.objects.filter(canvas_course_id=str(self.course_ids[0])).exists())
+
+        # the link is deleted in Canvas, and a teacher joins the course
+        self.canvas_server.external_tools[self.course_ids[0]] = []
+        teacher = self.canvas_server.add_user('New Teacher', 'new-teacher@example.edu')
+        self.canvas_server.enroll(self.course_ids[0], teacher)
+        course = CanvasAPI(user=self.user).get_course(self.course_ids[0])
+        self.assertFalse(is_course_provisioned(CanvasAPI(user=self.user), course))
+
+        self.assertEqual(self.provision().CatalogUrl, catalog.CatalogUrl)
+        self.assertEqual(len(self.canvas_server.external_tools[self.course_ids[0]]), 1)
+        self.assertTrue(is_course_provisioned(CanvasAPI(user=self.user), course))
+        profile = next(p for p in self.mediasite_server.user_profiles.values()
+                       if p['Email'] == 'new-teacher@example.edu')
+        self.assertIn({'RoleId': MediasiteAPI.convert_user_profile_to_role_id(profile['Id']), 'PermissionMask': 7},
+                      self.mediasite_server.permissions[catalog.LinkedFolderId]['AccessControlList'])
+
+        # nothing changed, so nothing is written
+        self.mediasite_server.reset_calls()
+        self.provision()
+        self.assertEqual(self.mediasite_server.call_count('POST'), 0)
+        self.assertEqual(len(self.canvas_server.external_tools[self.course_ids[0]]), 1)
+
+    def test_provisions_again_when_the_catalog_has_gone(self):
+        catalog = self.provision()
+        del self.mediasite_server.catalogs[catalog.Id]
+        self.mediasite_server.reset_calls()
+        with override_settings(PROVISIONED_COURSE_TRUST_SECS=-1):
+            new_catalog = self.provision()
+        self.assertNotEqual(new_catalog.Id, catalog.Id)
+        # the folder's permissions were already right
+        self.assertEqual(self.mediasite_server.calls[('POST', "Folders('{id}')/UpdatePermissions")], 0)
+        self.assertEqual(ProvisionedCourse.objects.get(canvas_course_id=str(self.course_ids[0])).catalog_id,
+                         new_catalog.Id)
+
+    def test_applies_changed_school_catalog_settings(self):
+        catalog = self.provision()
+        self.assertEqual(apply_school_catalog_settings(self.school), {'unchanged': 1})
+
+        self.school.catalog_items_per_page = 20
+        self.school.save()
+        self.assertEqual(apply_school_catalog_settings(self.school), {'updated': 1})
+        self.assertEqual(self.mediasite_server.catalog_settings[catalog.Id]['PresentationsPerPage'], 20)
+
+        # catalogs in the school's folders are found without a record of provisioning them, for
+        # Ongoing terms (which have no year folder) too
+        ongoing_catalog = provision_course(CanvasAPI(user=self.user), self.school, course_id=self.course_ids[1],
+                                           term='Ongoing')
+        ProvisionedCourse.objects.all().delete()
+        self.school.catalog_items_per_page = 50
+        self.school.save()
+        self.mediasite_server.reset_calls()
+        self.assertEqual(apply_school_catalog_settings(self.school), {'updated': 2})
+        self.assertEqual(self.mediasite_server.catalog_settings[catalog.Id]['PresentationsPerPage'], 50)
+        self.assertEqual(self.mediasite_server.catalog_settings[ongoing_catalog.Id]['PresentationsPerPage'], 50)
+        # the children of the root folder, the year folder and the two term folders, but not of the course folders
+        self.assertEqual(self.mediasite_server.calls[('GET', 'Folders')], 4)
+
+    def test_catalog_settings_job(self):
+        catalog = self.provision()
+        # changing the settings in the admin queues the job rather than doing it in the request
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        self.mediasite_server.reset_calls()
+        response = self.client.post(reverse('admin:web_school_change', args=[self.school.id]),
+                                    dict(canvas_id=self.school.canvas_id, name=self.school.name,
+                                         mediasite_root_folder=self.school.mediasite_root_folder,
+                                         catalog_items_per_page=20))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.mediasite_server.call_count(), 0)
+        job = CatalogSettingsJob.objects.get(school=self.school)
+        self.assertEqual(jobs.enqueue_catalog_settings_job(self.school).id, job.id)
+
+        claimed = jobs.claim_catalog_settings_jobs(5)
+        self.assertEqual([j.id for j in claimed], [job.id])
+        self.assertEqual(jobs.claim_catalog_settings_jobs(5), [])
+        jobs.run_catalog_settings_job(claimed[0])
+        job = CatalogSettingsJob.objects.get(id=job.id)
+        self.assertEqual((job.status, job.total, job.updated, job.unchanged, job.failed),
+                         (CatalogSettingsJob.FINISHED, 1, 1, 0, 0))
+        self.assertEqual(self.mediasite_server.catalog_settings[catalog.Id]['PresentationsPerPage'], 20)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'account_choices_tests'}})
+class AccountChoicesTestCase(FakeServersTestCase):
+
+    def test_account_choices_are_cached(self):
+        School.objects.create(canvas_id='9999', name='Not in Canvas', mediasite_root_folder='Other')
+        choices = [(self.school.canvas_id, self.school.name)]
+        self.assertEqual(get_account_choices(self.user), choices)
+        self.assertEqual(get_account_choices(self.user), choices)
+        self.assertEqual(self.canvas_server.calls[('GET', 'accounts')], 1)
+
+        self.assertEqual(get_account_choices(self.user, refresh=True), choices)
+        self.assertEqual(self.canvas_server.calls[('GET', 'accounts')], 2)
+
+    def test_account_choices_follow_the_schools(self):
+        self.assertEqual(get_account_choices(self.user, refresh=True), [(self.school.canvas_id, self.school.name)])
+        self.school.name = 'Renamed School'
+        self.school.save()
+        self.assertEqual(get_account_choices(self.user), [(self.school.canvas_id, 'Renamed School')])
+        self.school.delete()
+        self.assertEqual(get_account_choices(self.user), [])
+        self.assertEqual(self.canvas_server.calls[('GET', 'accounts')], 1)
+
+
+class SchoolsTestCase(TestCase):
+
+    def test_schools_are_read_once_until_one_changes(self):
+        school = School.objects.create(canvas_id='1', name='B School', mediasite_root_folder='B')
+        School.objects.create(canvas_id='2', name='A School', mediasite_root_folder='A')
+        self.assertEqual([s.name for s in get_schools()], ['A School', 'B School'])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_school('1').mediasite_root_folder, 'B')
+            with self.assertRaises(School.DoesNotExist):
+                get_school('3')
+
+        school.mediasite_root_folder = 'C'
+        school.save()
+        self.assertEqual(get_school(1).mediasite_root_folder, 'C')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_schools_without_a_shared_version_are_reloaded_after_a_while(self):
+        School.objects.create(canvas_id='1', name='A School', mediasite_root_folder='A')
+        self.assertEqual(get_school('1').mediasite_root_folder, 'A')
+        # as another worker would change it: this one is not told
+        School.objects.filter(canvas_id='1').update(mediasite_root_folder='B')
+        self.assertEqual(get_school('1').mediasite_root_folder, 'A')
+        with override_settings(LOCAL_CACHE_TIMEOUT=0):
+            self.assertEqual(get_school('1').mediasite_root_folder, 'B')
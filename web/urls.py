@@ -6,6 +6,8 @@ app_name = 'web'
 
 urlpatterns = [
     url(r'^$', views.search, name='index'),
+    url(r'^provision/(?P<job_id>\d+)$', views.provision_status, name='provision_status'),
     url(r'provision', views.provision, name='provision'),
     url(r'oauth', views.oauth, name='oauth'),
+    url(r'^metrics$', views.metrics, name='metrics'),
 ]